@@ -1,4 +1,23 @@
 """API endpoints package"""
-from .endpoints import router
+from .endpoints import (
+    router, registry, plot_pool, shap_prefetcher, risk_lane, explain_lane, audit_log, shadow,
+    warmup_steps,
+)
+from .jobs import router as jobs_router, job_manager
+from .live import router as live_router
 
-__all__ = ["router"]
+router.include_router(jobs_router)
+router.include_router(live_router)
+
+__all__ = [
+    "router",
+    "job_manager",
+    "registry",
+    "plot_pool",
+    "shap_prefetcher",
+    "risk_lane",
+    "explain_lane",
+    "audit_log",
+    "shadow",
+    "warmup_steps",
+]
@@ -1,12 +1,53 @@
 """
 API endpoint implementations for fracture risk calculation
 """
+import asyncio
+import json
 import logging
-from typing import Dict
-
-from fastapi import APIRouter, HTTPException
-from app.models import RiskRequest, RiskResponse, ShapPlotRequest, ShapPlotResponse
-from app.ml.risk_calculator import BonoAI
+import time
+from typing import Optional
+
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+
+from app.config import settings
+
+from app.models import (
+    FIELD_RULES,
+    ColumnarRiskBatchRequest,
+    ColumnValidationError,
+    PatientData,
+    RiskBatchRequest,
+    RiskBatchResponse,
+    RiskRequest,
+    RiskResponse,
+    RiskSurfaceRequest,
+    RiskSurfaceResponse,
+    ShapPlotRequest,
+    ShapPlotResponse,
+    TreatmentComparisonRequest,
+    TreatmentComparisonResponse,
+    TreatmentScenario,
+    patients_to_columns,
+    read_arrow_stream,
+    validate_patient_columns,
+)
+from app.middleware import requests_in_progress
+from app.ml.risk_calculator import FX_TYPES, TREATMENTS, BonoAI
+from app.ml.store import ModelStore
+from app.services.audit import AuditLog
+from app.services.cancellation import DeadlineExceeded, request_deadline, run_cancellable
+from app.services.lanes import Lane
+from app.services.plots import PlotPool
+from app.services.prefetch import ShapPrefetcher
+from app.services.registry import CANNED_COHORT, ModelRegistry
+from app.services.runtime import limit_blas_threads
+from app.services.shadow import ShadowEvaluator
+from app.services.singleflight import SingleFlight, request_key
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -14,18 +55,104 @@ logger = logging.getLogger(__name__)
 # Create router
 router = APIRouter(prefix="/api", tags=["risk-calculation"])
 
-# Initialize BonoAI once at module level for performance
-# This avoids loading models on every request
+
+def load_model(store_path: str = "") -> BonoAI:
+    """The models of a store (all of app.ml.models without one) with the inference runtime settings"""
+    limit_blas_threads(settings.BLAS_THREADS)
+    return BonoAI(
+        store=ModelStore(store_path) if store_path else None,
+        nthread=settings.XGB_NTHREAD or None,
+        store_max_rows=settings.STORE_MAX_ROWS,
+    )
+
+
+# Load the models once at module level for performance, this avoids loading
+# them on every request. The registry swaps in new versions from MODEL_DIR
+# while serving; every request reads `registry.model` once and uses that
+# version throughout.
 try:
-    bono_ai = BonoAI()
-    logger.info("BonoAI model loaded successfully")
+    registry = ModelRegistry(
+        settings.MODEL_DIR,
+        default=lambda: load_model(settings.MODEL_STORE),
+        interval=settings.MODEL_RELOAD_INTERVAL,
+        max_drift=settings.MODEL_RELOAD_MAX_DRIFT,
+        load=load_model,
+    )
+    logger.info("BonoAI model version %s loaded successfully", registry.version)
 except Exception as e:
-    logger.error(f"Failed to load BonoAI model: {str(e)}", exc_info=True)
+    logger.error("Failed to load BonoAI model: %s", e, exc_info=True)
     raise
 
+# Separate threads for cheap risk predictions and expensive explanations, so
+# that a burst of SHAP plots can't delay risk requests
+risk_lane = Lane("risk", settings.LANE_RISK_WORKERS)
+explain_lane = Lane("explain", settings.LANE_EXPLAIN_WORKERS)
+
+plot_pool = PlotPool(workers=settings.PLOT_WORKERS, lane=explain_lane)
+
+# SHAP plots of a patient are usually requested right after its risks
+shap_prefetcher = ShapPrefetcher(
+    enabled=settings.PREFETCH_ENABLED,
+    render=settings.PREFETCH_RENDER,
+    plot_pool=plot_pool,
+    max_entries=settings.PREFETCH_CACHE_SIZE,
+    max_queued=settings.PREFETCH_MAX_QUEUED,
+    max_load=settings.PREFETCH_MAX_LOAD,
+    load=requests_in_progress.value,
+)
+
+# A candidate model tried on sampled getRisk requests after the response.
+# Single-threaded boosters, so the shadow CPU cap covers all of its work.
+shadow = ShadowEvaluator(
+    candidate=BonoAI(
+        store=ModelStore(settings.SHADOW_MODEL), nthread=1, store_max_rows=settings.STORE_MAX_ROWS
+    ) if settings.SHADOW_MODEL else None,
+    sample_rate=settings.SHADOW_SAMPLE_RATE,
+    max_cpu_share=settings.SHADOW_MAX_CPU,
+    max_queued=settings.SHADOW_MAX_QUEUED,
+    load=requests_in_progress.value,
+)
+
+# Every prediction is recorded, off the request path
+audit_log = AuditLog(
+    settings.AUDIT_DIR,
+    file_format=settings.AUDIT_FORMAT,
+    max_queued=settings.AUDIT_MAX_QUEUED,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+    max_file_bytes=settings.AUDIT_MAX_FILE_MB * 1024 * 1024,
+    rotate_interval=settings.AUDIT_ROTATE_INTERVAL,
+)
+
+# Streaming responses report the model version in this header
+MODEL_VERSION_HEADER = "X-Model-Version"
+
+risk_flight = SingleFlight("getRisk")
+shap_flight = SingleFlight("getShapPlot")
+
+
+def _calculate_risks(model: BonoAI, request: RiskRequest):
+    start = time.perf_counter()
+    # Prepare data for ML model, BMI and the derived features are calculated
+    # from the patient fields
+    columns = patients_to_columns([request.patientData])
+    features = model.prepare_matrix(columns)
+
+    # Convert risk horizon to months
+    risk_horizon_months = request.riskHorizon * 12
+
+    # Calculate risks for each fracture type, as rounded percentages
+    risks = {
+        fx_type: round(float(model.predict_risks(features, fx_type, [risk_horizon_months])[0, 0]) * 100, 2)
+        for fx_type in FX_TYPES
+    }
+    # the inputs and features for the audit log, the seconds of the prediction
+    # alone for the shadow comparison
+    return risks, columns, features, time.perf_counter() - start
+
 
 @router.post("/getRisk/", response_model=RiskResponse)
-async def get_risk(request: RiskRequest) -> RiskResponse:
+async def get_risk(request: RiskRequest, background_tasks: BackgroundTasks) -> RiskResponse:
     """
     Calculate fracture risk for a patient
 
@@ -59,58 +186,97 @@ async def get_risk(request: RiskRequest) -> RiskResponse:
     }
     ```
     """
+    model = registry.model
+    start = time.perf_counter()
     try:
-        logger.info(f"Risk calculation request received for {request.riskHorizon} year horizon")
-
-        # Prepare patient data
-        data = request.patientData.model_dump()
-
-        # Remove sex field (not used by model)
-        data.pop("sex", None)
-
-        # Calculate BMI
-        height_m = data["height"] / 100
-        data["bmi"] = round(data["weight"] / (height_m ** 2), 2)
-
-        # Convert risk horizon to months
-        risk_horizon_months = request.riskHorizon * 12
-
-        # Prepare data for ML model
-        prepared_data = bono_ai.prepare_data(data)
-
-        # Calculate risks for each fracture type
-        vertebral_risk = bono_ai.predict_risk("vertebral", t=risk_horizon_months)
-        hip_risk = bono_ai.predict_risk("hip", t=risk_horizon_months)
-        any_risk = bono_ai.predict_risk("any", t=risk_horizon_months)
+        logger.info("Risk calculation request received for %s year horizon", request.riskHorizon)
+
+        # Identical concurrent requests (double clicks, retries) share one computation
+        risks, columns, features, seconds = await risk_flight.do(
+            request_key(model.version, request.riskHorizon, request.patientData.model_dump()),
+            risk_lane.run,
+            _calculate_risks,
+            model,
+            request,
+        )
 
-        # Convert to percentages and round
-        risks = {
-            "vertebral": round(vertebral_risk * 100, 2),
-            "hip": round(hip_risk * 100, 2),
-            "any": round(any_risk * 100, 2),
-        }
+        logger.info("Risk calculated successfully: %s", risks)
+        latency = time.perf_counter() - start
+        audit_log.record(
+            "getRisk", model, [request.riskHorizon], columns, features,
+            {fx_type: [risk] for fx_type, risk in risks.items()}, latency,
+        )
 
-        logger.info(f"Risk calculated successfully: {risks}")
+        # background tasks run after the response is sent
+        if shap_prefetcher.enabled:
+            background_tasks.add_task(shap_prefetcher.schedule, request.patientData, model)
+        if shadow.sample():
+            # the candidate is timed for the same work, not the whole request
+            background_tasks.add_task(shadow.schedule, model, columns, request.riskHorizon, risks, seconds)
 
         return RiskResponse(
             message="Risk score successfully calculated.",
+            modelVersion=model.version,
             risks=risks
         )
 
     except ValueError as e:
-        logger.warning(f"Validation error in risk calculation: {str(e)}")
+        logger.warning("Validation error in risk calculation: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
     except Exception as e:
-        logger.error(f"Unexpected error in risk calculation: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in risk calculation: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error during risk calculation"
         )
 
 
+def warmup_steps(model: BonoAI, shap: bool = True):
+    """
+    Representative requests for the warm-up at startup (app.services.warmup):
+    a risk request in the risk lane and, with `shap`, the SHAP plot of every
+    fracture type rendered where plot requests render them
+    """
+    patient = CANNED_COHORT[0]
+    request = RiskRequest(riskHorizon=5, patientData=patient)
+    steps = [("risk", lambda: risk_lane.run(_calculate_risks, model, request))]
+
+    async def shap_plot(fx_type):
+        features = model.prepare_matrix(patients_to_columns([patient]), dtype="float64")
+        await plot_pool.render(model.explain(features[0], fx_type))
+
+    if shap:
+        for fx_type in FX_TYPES:
+            steps.append((f"shap_{fx_type}", lambda fx_type=fx_type: shap_plot(fx_type)))
+    return steps
+
+
+async def _create_shap_plot(model: BonoAI, request: ShapPlotRequest) -> str:
+    # Use the explanation prefetched after the risk request, if any
+    prefetched = None
+    if shap_prefetcher.enabled:
+        prefetched = await shap_prefetcher.get(request.patientData, request.fxType, model)
+
+    if prefetched is not None and prefetched["plot"] is not None:
+        return prefetched["plot"]
+
+    if prefetched is not None:
+        explanation = prefetched["explanation"]
+    else:
+        # Prepare data for ML model
+        features = model.prepare_matrix(
+            patients_to_columns([request.patientData]), dtype="float64"
+        )
+        explanation = model.explain(features[0], request.fxType)
+
+    # Generate SHAP waterfall plot, in the plot worker processes or the
+    # explanation lane
+    return await plot_pool.render(explanation)
+
+
 @router.post("/getShapPlot/", response_model=ShapPlotResponse)
-async def get_shap_plot(request: ShapPlotRequest) -> ShapPlotResponse:
+async def get_shap_plot(request: ShapPlotRequest, http_request: Request) -> ShapPlotResponse:
     """
     Generate SHAP waterfall plot for model explainability
 
@@ -122,6 +288,10 @@ async def get_shap_plot(request: ShapPlotRequest) -> ShapPlotResponse:
     - **patientData**: Complete patient data
     - **fxType**: Fracture type ("vertebral", "hip", or "any")
 
+    An optional `X-Deadline-Ms` header sets how long the client waits for the
+    plot; past it the plot is abandoned with `504`. The plot is also abandoned
+    when the client disconnects.
+
     **Returns:**
     - **shap_plot**: Base64 encoded PNG image of the SHAP waterfall plot
 
@@ -134,39 +304,663 @@ async def get_shap_plot(request: ShapPlotRequest) -> ShapPlotResponse:
     }
     ```
     """
+    model = registry.model
     try:
-        logger.info(f"SHAP plot request received for {request.fxType} fracture type")
+        logger.info("SHAP plot request received for %s fracture type", request.fxType)
+
+        deadline = request_deadline(http_request.scope)
+
+        # Identical concurrent requests share one plot, the risk horizon
+        # doesn't change it. The plot is cancelled once no client waits for it.
+        shap_plot_base64 = await run_cancellable(
+            http_request,
+            shap_flight.do(
+                request_key(model.version, request.fxType, request.patientData.model_dump()),
+                _create_shap_plot,
+                model,
+                request,
+            ),
+            deadline=deadline,
+            endpoint="getShapPlot",
+        )
 
-        # Prepare patient data
-        data = request.patientData.model_dump()
+        logger.info("SHAP plot created successfully for %s", request.fxType)
 
-        # Remove sex field (not used by model)
-        data.pop("sex", None)
+        return ShapPlotResponse(
+            message="SHAP plot successfully created.",
+            modelVersion=model.version,
+            shap_plot=shap_plot_base64
+        )
 
-        # Calculate BMI
-        height_m = data["height"] / 100
-        data["bmi"] = round(data["weight"] / (height_m ** 2), 2)
+    except ClientDisconnect:
+        logger.info("Client disconnected, SHAP plot for %s cancelled", request.fxType)
+        # nobody reads it, 499 as in nginx marks the request in the access log
+        raise HTTPException(status_code=499, detail="Client closed request")
 
-        # Prepare data for ML model
-        prepared_data = bono_ai.prepare_data(data)
+    except DeadlineExceeded as e:
+        logger.warning("SHAP plot for %s cancelled: %s", request.fxType, e)
+        raise HTTPException(status_code=504, detail=str(e))
+
+    except ValueError as e:
+        logger.warning("Validation error in SHAP plot generation: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error("Unexpected error in SHAP plot generation: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error during SHAP plot generation"
+        )
 
-        # Generate SHAP waterfall plot
-        shap_plot_base64 = bono_ai.create_shap_waterfall(prepared_data, request.fxType)
 
-        logger.info(f"SHAP plot created successfully for {request.fxType}")
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        return ShapPlotResponse(
-            message="SHAP plot successfully created.",
-            shap_plot=shap_plot_base64
+
+@router.post(
+    "/getRiskExplained/",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def get_risk_explained(request: RiskRequest):
+    """
+    Calculate fracture risks and stream the SHAP explanation of every fracture type
+
+    Replaces one `/api/getRisk/` plus three `/api/getShapPlot/` calls: the
+    patient is validated and prepared once, the risks are sent right away, and
+    the three waterfall plots are rendered in parallel and streamed as
+    Server-Sent Events in the order they complete:
+
+    - `event: risks` with `{"modelVersion": "...", "risks": {"vertebral": 2.15, "hip": 1.45, "any": 8.23}}`
+    - `event: shap` with `{"fxType": "hip", "baseValue": ..., "shapValues": {...},
+      "shap_plot": "<base64 PNG>"}`, once per fracture type
+    - `event: error` with `{"fxType": "hip", "detail": "..."}` if a plot failed
+    - `event: done` after the last plot
+
+    **Parameters:**
+    - **riskHorizon**: Years to predict (1-7)
+    - **patientData**: Complete patient data
+    """
+    model = registry.model
+    start = time.perf_counter()
+    try:
+        logger.info("Explained risk request received for %s year horizon", request.riskHorizon)
+
+        columns = patients_to_columns([request.patientData])
+        features = model.prepare_matrix(columns, dtype="float64")
+        risks = {
+            fx_type: round(
+                float(model.predict_risks(features, fx_type, [request.riskHorizon * 12])[0, 0]) * 100, 2
+            )
+            for fx_type in FX_TYPES
+        }
+        audit_log.record(
+            "getRiskExplained", model, [request.riskHorizon], columns, features,
+            {fx_type: [risk] for fx_type, risk in risks.items()}, time.perf_counter() - start,
         )
+        explanations = {fx_type: model.explain(features[0], fx_type) for fx_type in FX_TYPES}
 
     except ValueError as e:
-        logger.warning(f"Validation error in SHAP plot generation: {str(e)}")
+        logger.warning("Validation error in explained risk calculation: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
     except Exception as e:
-        logger.error(f"Unexpected error in SHAP plot generation: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in explained risk calculation: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
-            detail="Internal server error during SHAP plot generation"
+            detail="Internal server error during explained risk calculation"
+        )
+
+    async def render(fx_type):
+        try:
+            return fx_type, await plot_pool.render(explanations[fx_type]), None
+        except Exception as e:
+            logger.error("SHAP plot generation failed for %s: %s", fx_type, e, exc_info=True)
+            return fx_type, None, e
+
+    async def events():
+        yield _sse("risks", {"modelVersion": model.version, "risks": risks})
+
+        tasks = [asyncio.ensure_future(render(fx_type)) for fx_type in FX_TYPES]
+        try:
+            for next_plot in asyncio.as_completed(tasks):
+                fx_type, shap_plot, error = await next_plot
+                if error is not None:
+                    yield _sse("error", {
+                        "fxType": fx_type,
+                        "detail": "Internal server error during SHAP plot generation",
+                    })
+                    continue
+                values, base_value, _, feature_names = explanations[fx_type]
+                yield _sse("shap", {
+                    "fxType": fx_type,
+                    "baseValue": base_value,
+                    "shapValues": dict(zip(feature_names, values.tolist())),
+                    "shap_plot": shap_plot,
+                })
+            yield _sse("done", {})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            MODEL_VERSION_HEADER: model.version,
+        },
+    )
+
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def _parse_batch(content_type: str, body: bytes, risk_horizon: Optional[int]):
+    """
+    Parse and validate a batch risk request body
+
+    Returns `(risk_horizon, columns)` where columns maps every PatientData field
+    to one NumPy array. Invalid input raises RequestValidationError (422).
+    """
+    try:
+        if content_type == ARROW_STREAM_MEDIA_TYPE:
+            if risk_horizon is None:
+                raise RequestValidationError([{
+                    "type": "missing",
+                    "loc": ["query", "riskHorizon"],
+                    "msg": "Field required",
+                }])
+            columns, _ = validate_patient_columns(read_arrow_stream(body))
+            return risk_horizon, columns
+
+        payload = json.loads(body)
+        if isinstance(payload, dict) and "columns" in payload:
+            batch = ColumnarRiskBatchRequest.model_validate(payload)
+            columns, _ = validate_patient_columns(batch.columns)
+            return batch.riskHorizon, columns
+
+        batch = RiskBatchRequest.model_validate(payload)
+        return batch.riskHorizon, patients_to_columns(batch.patients)
+
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+        )
+    except ColumnValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors]
+        )
+    except RequestValidationError:
+        raise
+    except Exception as e:
+        # malformed JSON or Arrow data
+        logger.warning("Could not parse batch request body: %s", e)
+        raise HTTPException(status_code=400, detail="Request body could not be parsed")
+
+
+def _score_batch(model: BonoAI, risk_horizon: int, columns, start: float) -> bytes:
+    """Score validated batch columns, return the RiskBatchResponse JSON"""
+    n_patients = len(columns["age"])
+    logger.info("Batch risk calculation request received for %s patients", n_patients)
+
+    risks = {fx_type: [] for fx_type in FX_TYPES}
+    if n_patients:
+        features = model.prepare_matrix(columns)
+        rounded = {
+            fx_type: np.round(model.predict_risks(features, fx_type, [risk_horizon * 12]) * 100, 2)
+            for fx_type in FX_TYPES
+        }
+        for fx_type in FX_TYPES:
+            risks[fx_type] = rounded[fx_type][:, 0].tolist()
+        audit_log.record(
+            "getRiskBatch", model, [risk_horizon], columns, features, rounded,
+            time.perf_counter() - start,
+        )
+
+    response = RiskBatchResponse(
+        message="Risk scores successfully calculated.",
+        modelVersion=model.version,
+        risks=risks,
+    )
+    # serialize with pydantic-core directly, much faster than the default
+    # encoder for large batches
+    return response.model_dump_json().encode()
+
+
+@router.post(
+    "/getRiskBatch/",
+    response_model=RiskBatchResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "oneOf": [
+                            RiskBatchRequest.model_json_schema(),
+                            ColumnarRiskBatchRequest.model_json_schema(),
+                        ]
+                    }
+                },
+                ARROW_STREAM_MEDIA_TYPE: {
+                    "schema": {"type": "string", "format": "binary"}
+                },
+            },
+        }
+    },
+)
+async def get_risk_batch(
+    request: Request,
+    riskHorizon: Optional[int] = Query(
+        default=None,
+        ge=1,
+        le=7,
+        description="Time horizon in years (1-7), required for Arrow input",
+    ),
+) -> Response:
+    """
+    Calculate fracture risks for many patients at once
+
+    The patients can be sent in three formats:
+    - **application/json** with `patients`: one PatientData object per patient
+    - **application/json** with `columns`: one array per PatientData field
+    - **application/vnd.apache.arrow.stream**: an Arrow IPC stream with one
+      column per PatientData field, `riskHorizon` given as query parameter
+
+    Column-oriented input is validated with vectorized range checks that mirror
+    the PatientData constraints, which is much cheaper than validating every
+    patient object for large batches: 100k patients take under a second as
+    columns or Arrow, but several seconds as patient objects.
+
+    **Returns:**
+    - **risks**: Object with one array of risk percentages per fracture type
+      (vertebral, hip, any), in the order of the input patients
+    """
+    start = time.perf_counter()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await request.body()
+    # parsing, validating and scoring 100k patients takes a second or more,
+    # too long for the event loop
+    risk_horizon, columns = await risk_lane.run(_parse_batch, content_type, body, riskHorizon)
+
+    model = registry.model
+    try:
+        content = await risk_lane.run(_score_batch, model, risk_horizon, columns, start)
+        return Response(content=content, media_type="application/json")
+
+    except ValueError as e:
+        logger.warning("Validation error in batch risk calculation: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error("Unexpected error in batch risk calculation: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error during batch risk calculation"
+        )
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body iterator may keep reading the request body
+
+    The default StreamingResponse listens for the client disconnect by calling
+    `receive()` while streaming, which would swallow request body messages. Here
+    a disconnect surfaces as ClientDisconnect in `request.stream()` instead.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# Longest NDJSON line of a streamed patient, longer ones aren't buffered
+NDJSON_MAX_LINE_BYTES = 64 * 1024
+
+
+async def _ndjson_lines(request: Request, max_line_bytes: int = NDJSON_MAX_LINE_BYTES):
+    """
+    Yield the non-empty lines of a newline-delimited request body as they arrive
+
+    A line longer than `max_line_bytes` is yielded as None, its bytes are
+    skipped instead of buffered. Every chunk is scanned once, the parts of an
+    unfinished line are joined when its newline arrives.
+    """
+    parts = []  # of the unfinished line
+    size = 0  # bytes of the unfinished line, also of skipped parts
+    async for chunk in request.stream():
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            size += end - start
+            if size > max_line_bytes:
+                yield None
+            else:
+                line = b"".join([*parts, chunk[start:end]])
+                if line.strip():
+                    yield line
+            parts, size = [], 0
+            start = end + 1
+        size += len(chunk) - start
+        if size > max_line_bytes:
+            parts = []
+        elif start < len(chunk):
+            parts.append(chunk[start:])
+    if size > max_line_bytes:
+        yield None
+    elif parts:
+        line = b"".join(parts)
+        if line.strip():
+            yield line
+
+
+def _score_ndjson_chunk(model: BonoAI, lines, first_index: int, risk_horizon: int) -> bytes:
+    """Validate and score a chunk of NDJSON patient lines, return NDJSON results"""
+    start = time.perf_counter()
+    results = []
+    patients = []
+    for index, line in enumerate(lines, start=first_index):
+        if line is None:
+            results.append({"index": index, "detail": [{
+                "type": "line_too_long",
+                "loc": [],
+                "msg": f"Line is longer than {NDJSON_MAX_LINE_BYTES} bytes",
+            }]})
+            continue
+        try:
+            patients.append((index, PatientData.model_validate_json(line)))
+        except ValidationError as e:
+            errors = json.loads(e.json(include_url=False))
+            results.append({"index": index, "detail": errors})
+
+    if patients:
+        columns = patients_to_columns([patient for _, patient in patients])
+        features = model.prepare_matrix(columns)
+        risks = {
+            fx_type: np.round(
+                model.predict_risks(features, fx_type, [risk_horizon * 12])[:, 0] * 100, 2
+            )
+            for fx_type in FX_TYPES
+        }
+        for row, (index, _) in enumerate(patients):
+            results.append({
+                "index": index,
+                "risks": {fx_type: float(risks[fx_type][row]) for fx_type in FX_TYPES},
+            })
+        audit_log.record(
+            "getRiskStream", model, [risk_horizon], columns, features, risks, time.perf_counter() - start
+        )
+
+    results.sort(key=lambda result: result["index"])
+    return b"".join(json.dumps(result).encode() + b"\n" for result in results)
+
+
+@router.post(
+    "/getRiskStream/",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/x-ndjson": {"schema": PatientData.model_json_schema()}},
+        }
+    },
+)
+async def get_risk_stream(
+    request: Request,
+    riskHorizon: int = Query(ge=1, le=7, description="Time horizon in years (1-7)"),
+):
+    """
+    Calculate fracture risks for a stream of patients
+
+    The request body is newline-delimited JSON with one PatientData object per
+    line. Patients are scored in chunks of `STREAM_CHUNK_SIZE` while the body is
+    still being received, and one result line is streamed back per patient:
+
+    - `{"index": 0, "risks": {"vertebral": 2.15, "hip": 1.45, "any": 8.23}}`
+    - `{"index": 1, "detail": [...]}` for a line that failed validation or is
+      longer than 64 KiB
+
+    The whole stream is scored by one model version, sent in the
+    `X-Model-Version` response header. Only one chunk is held in memory at a time. The next chunk is read only
+    after the previous results were handed to the server, so a slow client
+    throttles the scoring instead of letting results pile up.
+    """
+    chunk_size = settings.STREAM_CHUNK_SIZE
+    model = registry.model
+    logger.info("Streaming risk calculation started for %s year horizon", riskHorizon)
+
+    async def results():
+        n_patients = 0
+        chunk = []
+        try:
+            async for line in _ndjson_lines(request):
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    yield await risk_lane.run(
+                        _score_ndjson_chunk, model, chunk, n_patients, riskHorizon
+                    )
+                    n_patients += len(chunk)
+                    chunk = []
+            if chunk:
+                yield await risk_lane.run(
+                    _score_ndjson_chunk, model, chunk, n_patients, riskHorizon
+                )
+                n_patients += len(chunk)
+        except ClientDisconnect:
+            logger.warning("Client disconnected after %s streamed patients", n_patients)
+            return
+        except Exception as e:
+            # the status code is already sent, all we can do is end the stream
+            logger.error("Unexpected error in streaming risk calculation: %s", e, exc_info=True)
+            return
+        logger.info("Streaming risk calculation finished for %s patients", n_patients)
+
+    return DuplexStreamingResponse(
+        results(),
+        media_type="application/x-ndjson",
+        headers={MODEL_VERSION_HEADER: model.version},
+    )
+
+
+def _compare_treatments(model: BonoAI, request: TreatmentComparisonRequest):
+    # one scenario per entry of ["none"] + TREATMENTS: every current and new
+    # treatment of the patient is stopped, then only the scenario's treatment
+    # is started. Prior treatments are history and stay as entered.
+    stopped = {
+        f"{treatment}_{state}": False for treatment in TREATMENTS for state in ("current", "new")
+    }
+    patient = request.patientData
+    scenarios = [patient.model_copy(update=stopped)] + [
+        patient.model_copy(update={**stopped, f"{treatment}_new": True}) for treatment in TREATMENTS
+    ]
+
+    columns = patients_to_columns(scenarios)
+    features = model.prepare_matrix(columns)
+    risks = {
+        fx_type: np.round(
+            model.predict_risks(features, fx_type, [request.riskHorizon * 12])[:, 0] * 100, 2
+        )
+        for fx_type in FX_TYPES
+    }
+    # the inputs and features for the audit log
+    return risks, columns, features
+
+
+@router.post("/getTreatmentComparison/", response_model=TreatmentComparisonResponse)
+async def get_treatment_comparison(
+    request: TreatmentComparisonRequest,
+) -> TreatmentComparisonResponse:
+    """
+    Compare the fracture risk of a patient under every treatment option
+
+    Expands the patient into one scenario per treatment (bisphosphonate,
+    denosumab, SERM, teriparatide, HRT) in which only that treatment is newly
+    started, plus "none" without any treatment. Current and new treatments of
+    the patient are stopped in every scenario, prior treatments are kept as
+    entered. The derived treatment features are re-computed for every scenario
+    and all scenarios are scored in one batched prediction per fracture type.
+
+    **Parameters:**
+    - **riskHorizon**: Years to predict (1-7)
+    - **patientData**: Complete patient data including treatment history
+    - **rankBy**: Fracture type used for ranking (default "any")
+
+    **Returns:**
+    - **scenarios**: Risks and absolute risk reduction of every scenario,
+      ranked from lowest to highest risk
+    """
+    model = registry.model
+    start = time.perf_counter()
+    try:
+        logger.info("Treatment comparison request received for %s year horizon", request.riskHorizon)
+
+        treatments = ["none"] + TREATMENTS
+        risks, columns, features = await risk_lane.run(_compare_treatments, model, request)
+        audit_log.record(
+            "getTreatmentComparison", model, [request.riskHorizon], columns, features, risks,
+            time.perf_counter() - start,
+        )
+
+        results = [
+            TreatmentScenario(
+                treatment=treatment,
+                risks={fx_type: float(risks[fx_type][index]) for fx_type in FX_TYPES},
+                riskReduction={
+                    fx_type: round(float(risks[fx_type][0] - risks[fx_type][index]), 2)
+                    for fx_type in FX_TYPES
+                },
+            )
+            for index, treatment in enumerate(treatments)
+        ]
+        results.sort(key=lambda scenario: scenario.risks[request.rankBy])
+
+        return TreatmentComparisonResponse(
+            message="Treatment comparison successfully calculated.",
+            modelVersion=model.version,
+            scenarios=results,
+        )
+
+    except ValueError as e:
+        logger.warning("Validation error in treatment comparison: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error("Unexpected error in treatment comparison: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error during treatment comparison"
+        )
+
+
+def _surface_columns(request: RiskSurfaceRequest):
+    """
+    The grid of a risk surface request as validated patient columns
+
+    Returns `(grids, columns)` with the values of every axis and one column per
+    PatientData field with one row per grid point (first axis slowest).
+    Invalid grid values raise RequestValidationError (422).
+    """
+    grids = []
+    for axis in request.axes:
+        values = np.linspace(axis.start, axis.stop, axis.steps)
+        if FIELD_RULES[axis.feature]["kind"] is int:
+            # integer inputs: whole numbers only, without duplicates
+            values = np.array(list(dict.fromkeys(np.round(values))))
+        grids.append(values)
+    mesh = np.meshgrid(*grids, indexing="ij")
+
+    n_points = mesh[0].size
+    columns = {
+        name: np.repeat(values, n_points)
+        for name, values in patients_to_columns([request.patientData]).items()
+    }
+    for axis, values in zip(request.axes, mesh):
+        columns[axis.feature] = values.ravel()
+
+    try:
+        columns, _ = validate_patient_columns(columns)
+    except ColumnValidationError as e:
+        # the same grid value fails once per point of the other axis
+        errors = {
+            (error["loc"][1], f"Grid value {error.get('input')}: {error['msg']}"): error["type"]
+            for error in e.errors
+        }
+        raise RequestValidationError([
+            {"type": error_type, "loc": ("body", "axes", feature), "msg": msg}
+            for (feature, msg), error_type in errors.items()
+        ])
+    return grids, columns
+
+
+def _score_surface(model: BonoAI, request: RiskSurfaceRequest, grids, columns, start: float) -> bytes:
+    """Score the grid columns of _surface_columns, return the RiskSurfaceResponse JSON"""
+    shape = tuple(len(grid) for grid in grids)
+    logger.info("Risk surface request received for %s grid points", int(np.prod(shape)))
+
+    features = model.prepare_matrix(columns)
+    rounded = {
+        fx_type: np.round(
+            model.predict_risks(features, fx_type, [request.riskHorizon * 12])[:, 0] * 100, 2
+        )
+        for fx_type in FX_TYPES
+    }
+    # one record per grid point
+    audit_log.record(
+        "getRiskSurface", model, [request.riskHorizon], columns, features, rounded,
+        time.perf_counter() - start,
+    )
+    risks = {fx_type: values.reshape(shape).tolist() for fx_type, values in rounded.items()}
+
+    response = RiskSurfaceResponse(
+        message="Risk surface successfully calculated.",
+        modelVersion=model.version,
+        axes={axis.feature: grid.tolist() for axis, grid in zip(request.axes, grids)},
+        risks=risks,
+    )
+    return response.model_dump_json().encode()
+
+
+@router.post("/getRiskSurface/", response_model=RiskSurfaceResponse)
+async def get_risk_surface(request: RiskSurfaceRequest) -> Response:
+    """
+    Sweep one or two inputs of a patient over a grid (partial dependence)
+
+    Every grid point is the patient with the swept inputs replaced by the grid
+    values. Derived features (BMI, minimum T-score) are re-computed for every
+    point, and the whole grid (up to 100 x 100 points) is scored with one
+    vectorized feature build and one booster call per fracture type.
+
+    **Parameters:**
+    - **riskHorizon**: Years to predict (1-7)
+    - **patientData**: Complete patient data
+    - **axes**: One or two of `{"feature", "start", "stop", "steps"}`, e.g.
+      `age`, `tscore_neck`, `steroid_daily_dosage`, `number_of_falls` or `tbs`
+
+    **Returns:**
+    - **axes**: The grid values of every swept input
+    - **risks**: Risk percentages per fracture type, as a list over the first
+      axis (of lists over the second axis)
+    """
+    start = time.perf_counter()
+    # up to 10k grid points, built, validated and scored off the event loop
+    grids, columns = await risk_lane.run(_surface_columns, request)
+
+    model = registry.model
+    try:
+        content = await risk_lane.run(_score_surface, model, request, grids, columns, start)
+        return Response(content=content, media_type="application/json")
+
+    except ValueError as e:
+        logger.warning("Validation error in risk surface calculation: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error("Unexpected error in risk surface calculation: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error during risk surface calculation"
         )
@@ -0,0 +1,133 @@
+"""
+API endpoints for asynchronous cohort scoring jobs
+"""
+import logging
+
+from fastapi import APIRouter, HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse
+
+from app.config import settings
+from app.models import (
+    ColumnValidationError,
+    JobRequest,
+    JobStatus,
+    patients_to_columns,
+    validate_patient_columns,
+)
+from app.services.jobs import ACTIVE_STATES, JobManager, QueueFullError
+from .endpoints import audit_log, registry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create router
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+job_manager = JobManager(
+    settings.JOBS_DIR,
+    max_concurrency=settings.JOBS_MAX_CONCURRENCY,
+    max_queued=settings.JOBS_MAX_QUEUED,
+    chunk_size=settings.JOBS_CHUNK_SIZE,
+    retention=settings.JOBS_RETENTION_SECONDS,
+    audit_log=audit_log,
+)
+
+MEDIA_TYPES = {"parquet": "application/vnd.apache.parquet", "csv": "text/csv"}
+
+
+def _get_status(job_id: str) -> dict:
+    status = job_manager.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return status
+
+
+# The handlers are plain functions: FastAPI runs them in its thread pool, so the
+# job directory listings and status file reads and writes don't block the
+# event loop
+
+@router.post("", response_model=JobStatus, status_code=202)
+def create_job(request: JobRequest) -> JobStatus:
+    """
+    Queue a cohort scoring job
+
+    The job runs in the background; poll `GET /api/jobs/{id}` for its progress
+    and download the result from `GET /api/jobs/{id}/result` once completed.
+
+    **Parameters:**
+    - **horizons**: Years to predict (1-7 each), one risk column per horizon
+    - **shap**: Also return the SHAP values of every patient
+    - **format**: Result file format, "parquet" or "csv"
+    - **patients** or **columns**: The cohort, as objects or column-oriented
+    """
+    if request.columns is not None:
+        try:
+            columns, n_patients = validate_patient_columns(request.columns)
+        except ColumnValidationError as e:
+            raise RequestValidationError(
+                [{**error, "loc": ("body", *error["loc"])} for error in e.errors]
+            )
+    else:
+        columns, n_patients = patients_to_columns(request.patients), len(request.patients)
+
+    if n_patients == 0:
+        raise HTTPException(status_code=422, detail="The job contains no patients")
+
+    try:
+        job = job_manager.submit(
+            columns,
+            n_patients,
+            horizons=request.horizons,
+            shap=request.shap,
+            file_format=request.format,
+            model=registry.model,
+        )
+    except QueueFullError as e:
+        logger.warning("%s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    return JobStatus(**job.to_dict())
+
+
+@router.get("/{job_id}", response_model=JobStatus)
+def get_job(job_id: str) -> JobStatus:
+    """
+    Get the status and progress of a job
+    """
+    return JobStatus(**_get_status(job_id))
+
+
+@router.get("/{job_id}/result", response_class=FileResponse)
+def get_job_result(job_id: str) -> FileResponse:
+    """
+    Download the result file of a completed job
+
+    One row per patient, in input order, with a `<fxType>_risk_<horizon>y`
+    column per fracture type and horizon (percentages) and, for SHAP jobs,
+    `<fxType>_shap_<feature>` and `<fxType>_shap_base` columns.
+    """
+    status = _get_status(job_id)
+    if status["status"] != "completed":
+        raise HTTPException(
+            status_code=409, detail=f"Job {job_id} is {status['status']}, not completed"
+        )
+    return FileResponse(
+        job_manager.result_path(job_id, status["format"]),
+        media_type=MEDIA_TYPES[status["format"]],
+        filename=f"bonoai-{job_id}.{status['format']}",
+    )
+
+
+@router.delete("/{job_id}", response_model=JobStatus)
+def cancel_job(job_id: str) -> JobStatus:
+    """
+    Cancel a queued or running job, or delete a finished one
+
+    A running job stops before its next chunk. A finished job's status and
+    result file are deleted, the response is its last status.
+    """
+    status = _get_status(job_id)
+    if status["status"] in ACTIVE_STATES:
+        return JobStatus(**job_manager.cancel(job_id))
+    return JobStatus(**job_manager.remove(job_id))
@@ -0,0 +1,236 @@
+"""
+WebSocket endpoint for live risk updates while a patient form is edited
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+import numpy as np
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from app.config import settings
+from app.models import PatientData, patients_to_columns
+from app.ml.incremental import IncrementalRiskModel
+from .endpoints import audit_log, registry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create router
+router = APIRouter(tags=["risk-calculation"])
+
+# Every horizon the models support, in years
+HORIZONS = list(range(1, 8))
+
+# Re-evaluates only the trees affected by the fields changed since the last
+# update of the same connection. One per model version: the active one and the
+# one replaced last, which open sessions may still hold state in.
+live_models = {}
+_live_models_lock = threading.Lock()
+
+
+def live_model_for(model) -> IncrementalRiskModel:
+    with _live_models_lock:
+        live_model = live_models.get(model.version)
+        if live_model is None:
+            live_model = IncrementalRiskModel(model, max_sessions=settings.LIVE_MAX_SESSIONS)
+            live_models[model.version] = live_model
+            while len(live_models) > 2:
+                live_models.pop(next(iter(live_models)))
+        return live_model
+
+
+# built for every new version before it is activated
+registry.add_warmer(live_model_for)
+
+
+def _apply_messages(draft, messages):
+    """
+    Apply client messages to the draft patient
+
+    Returns `(draft, seq, errors)`. The draft holds the fields as sent, so a
+    temporarily invalid form (e.g. more recent than previous fractures while
+    typing) is kept and can be fixed by the next change.
+    """
+    seq = None
+    errors = []
+    for text in messages:
+        try:
+            message = json.loads(text)
+            if not isinstance(message, dict):
+                raise ValueError("message must be a JSON object")
+        except ValueError as e:
+            errors.append({"type": "json_invalid", "loc": [], "msg": f"Invalid JSON message: {str(e)}"})
+            continue
+
+        seq = message.get("seq", seq)
+        if isinstance(message.get("patientData"), dict):
+            draft = dict(message["patientData"])
+        elif isinstance(message.get("changes"), dict):
+            if draft is None:
+                errors.append({
+                    "type": "missing",
+                    "loc": ["patientData"],
+                    "msg": "Send the complete patientData before any changes",
+                })
+                continue
+            for name, value in message["changes"].items():
+                if name not in PatientData.model_fields:
+                    errors.append({
+                        "type": "extra_forbidden",
+                        "loc": ["changes", name],
+                        "msg": "Unknown patient field",
+                        "input": value,
+                    })
+                    continue
+                draft[name] = value
+        else:
+            errors.append({
+                "type": "missing",
+                "loc": [],
+                "msg": "Message must contain patientData or changes",
+            })
+    return draft, seq, errors
+
+
+def _live_risks(live_model, key, patient: PatientData):
+    """Risk percentages of one patient for every horizon"""
+    start = time.perf_counter()
+    columns = patients_to_columns([patient])
+    features = live_model.model.prepare_matrix(columns)
+    risks = live_model.predict_risks(key, features[0], [horizon * 12 for horizon in HORIZONS])
+    risks = {fx_type: np.round(values * 100, 2) for fx_type, values in risks.items()}
+    audit_log.record(
+        "liveRisk", live_model.model, HORIZONS, columns, features, risks, time.perf_counter() - start
+    )
+    return {fx_type: values.tolist() for fx_type, values in risks.items()}
+
+
+async def _receive_messages(websocket: WebSocket, messages: asyncio.Queue):
+    """
+    Forward received text messages to `messages`, `None` marks the end
+
+    Returns 1003 (unsupported data) if the client sent a binary frame, the
+    close code for the session, else None.
+    """
+    code = None
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("text") is None:
+                code = 1003
+                break
+            await messages.put(message["text"])
+    except Exception as e:
+        logger.warning("Could not receive live risk message: %s", e)
+    finally:
+        # without waiting, also when cancelled: make room by dropping a
+        # message, the session ends anyway
+        if messages.full():
+            messages.get_nowait()
+        messages.put_nowait(None)
+    return code
+
+
+async def _next_burst(messages: asyncio.Queue, debounce: float):
+    """
+    Wait for a message and collect all messages arriving within `debounce`
+    seconds after it, returns None once the client disconnected
+    """
+    message = await messages.get()
+    if message is None:
+        return None
+    burst = [message]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + debounce
+    while (timeout := deadline - loop.time()) > 0:
+        try:
+            message = await asyncio.wait_for(messages.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if message is None:
+            return None
+        burst.append(message)
+    return burst
+
+
+@router.websocket("/liveRisk/")
+async def live_risk(websocket: WebSocket):
+    """
+    Live fracture risks for a patient form
+
+    The client first sends the complete patient and afterwards only the fields
+    that changed:
+
+    - `{"seq": 1, "patientData": {...}}`
+    - `{"seq": 2, "changes": {"age": 71, "tscore_neck": -2.8}}`
+
+    Messages arriving within `LIVE_DEBOUNCE_MS` of each other are merged, and
+    one update is pushed per burst with the risks for all horizons (1-7 years)
+    and the `seq` of the last message it includes:
+
+    - `{"seq": 2, "modelVersion": "...", "horizons": [1, ..., 7], "risks": {"vertebral": [...], ...}}`
+
+    Every update is calculated by the model version active when it is sent.
+
+    The merged patient is validated with the PatientData rules. If it is
+    invalid, or a message could not be applied, the update contains a `detail`
+    list of errors (and no risks while the patient is invalid).
+    """
+    await websocket.accept()
+    key = uuid.uuid4().hex
+    logger.info("Live risk session %s opened", key)
+
+    # bounded, so a client flooding changes is throttled by the socket
+    messages = asyncio.Queue(maxsize=100)
+    reader = asyncio.create_task(_receive_messages(websocket, messages))
+    draft = None
+    live_model = None
+    n_updates = 0
+    try:
+        while True:
+            burst = await _next_burst(messages, settings.LIVE_DEBOUNCE_MS / 1000)
+            if burst is None:
+                # the reader has finished
+                code = await reader
+                if code is not None:
+                    await websocket.close(code=code)
+                break
+            draft, seq, errors = _apply_messages(draft, burst)
+
+            update = {"seq": seq}
+            if draft is not None:
+                try:
+                    patient = PatientData.model_validate(draft)
+                    active = live_model_for(registry.model)
+                    if live_model is not None and live_model is not active:
+                        # a new model version, start over with all trees
+                        live_model.forget(key)
+                    live_model = active
+                    # a few hundred microseconds, cheaper than a thread hand-off
+                    update["modelVersion"] = live_model.model.version
+                    update["horizons"] = HORIZONS
+                    update["risks"] = _live_risks(live_model, key, patient)
+                except ValidationError as e:
+                    errors.extend(json.loads(e.json(include_url=False)))
+            if errors:
+                update["detail"] = errors
+            await websocket.send_text(json.dumps(update))
+            n_updates += 1
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error("Unexpected error in live risk session %s: %s", key, e, exc_info=True)
+        await websocket.close(code=1011)
+    finally:
+        reader.cancel()
+        if live_model is not None:
+            live_model.forget(key)
+        logger.info("Live risk session %s closed after %s updates", key, n_updates)
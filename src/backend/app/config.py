@@ -3,6 +3,7 @@ Application configuration and settings
 """
 
 import os
+import tempfile
 from typing import List, Optional, Union
 from pydantic import field_validator
 from pydantic_settings import BaseSettings
@@ -37,6 +38,125 @@ class Settings(BaseSettings):
 
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # "json" (one object per line, with the request id) or "text"
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    # Fraction of the records below WARNING kept per logger (and its children),
+    # e.g. "app.api.endpoints=0.1,uvicorn.access=0.01"; empty keeps all
+    LOG_SAMPLE_RATES: str = os.getenv("LOG_SAMPLE_RATES", "")
+    # Records waiting for the writer thread; more are dropped
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    # Memory-mapped model store (python -m app.ml.store <path>), shared by all
+    # worker processes; empty loads the JSON boosters and pickled Cox models
+    MODEL_STORE: str = os.getenv("MODEL_STORE", "")
+
+    # Model hot reload: the newest valid bundle (*.store) of MODEL_DIR is
+    # served, and the directory is polled every MODEL_RELOAD_INTERVAL seconds
+    # for new ones; MODEL_STORE is the fallback while it has none. A bundle
+    # whose risks on the canned check cohort differ from the active version by
+    # more than MODEL_RELOAD_MAX_DRIFT percentage points is rejected (0: any)
+    MODEL_DIR: str = os.getenv("MODEL_DIR", "")
+    MODEL_RELOAD_INTERVAL: float = float(os.getenv("MODEL_RELOAD_INTERVAL", "30"))
+    MODEL_RELOAD_MAX_DRIFT: float = float(os.getenv("MODEL_RELOAD_MAX_DRIFT", "0"))
+
+    # Warm-up at startup: a risk request and, with WARMUP_SHAP, a SHAP plot
+    # per fracture type run before /ready reports the worker ready
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_SHAP: bool = os.getenv("WARMUP_SHAP", "true").lower() == "true"
+
+    # Inference runtime, applied whenever models are loaded. Every worker
+    # process (WEB_CONCURRENCY, set by app.serve) gets an equal share of the
+    # cores: XGB_NTHREAD threads per booster prediction (0: XGBoost's default
+    # of all cores) and BLAS_THREADS threads for NumPy's BLAS (0: the
+    # library's default of all cores). Up to STORE_MAX_ROWS patients are
+    # scored by the compiled forests of MODEL_STORE without any threads.
+    XGB_NTHREAD: int = int(
+        os.getenv(
+            "XGB_NTHREAD",
+            str(max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", "1"))))),
+        )
+    )
+    BLAS_THREADS: int = int(os.getenv("BLAS_THREADS", "1"))
+    STORE_MAX_ROWS: int = int(os.getenv("STORE_MAX_ROWS", "8"))
+
+    # Worker lanes: threads for risk predictions (getRisk, streamed chunks) and
+    # for explanations (SHAP plots rendered in threads), kept apart so SHAP
+    # traffic can't occupy the threads risk requests need
+    LANE_RISK_WORKERS: int = int(os.getenv("LANE_RISK_WORKERS", "4"))
+    LANE_EXPLAIN_WORKERS: int = int(os.getenv("LANE_EXPLAIN_WORKERS", "2"))
+
+    # Worker processes rendering SHAP plots, one per fracture type renders the
+    # three plots of /api/getRiskExplained/ in parallel; 0 renders in the
+    # explanation lane instead (the default on a single core)
+    PLOT_WORKERS: int = int(
+        os.getenv("PLOT_WORKERS", "3" if (os.cpu_count() or 1) > 1 else "0")
+    )
+
+    # Audit log of every prediction (input hash, features, model version,
+    # risks, latency), written in batches by a background thread to rotating
+    # AUDIT_FORMAT files (ndjson or parquet) in AUDIT_DIR; empty disables it.
+    # Once AUDIT_MAX_QUEUED records wait predictions are dropped, counted
+    # in bonoai_audit_records_total
+    AUDIT_DIR: str = os.getenv("AUDIT_DIR", "")
+    AUDIT_FORMAT: str = os.getenv("AUDIT_FORMAT", "ndjson")
+    AUDIT_MAX_QUEUED: int = int(os.getenv("AUDIT_MAX_QUEUED", "10000"))
+    AUDIT_BATCH_SIZE: int = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+    AUDIT_FLUSH_INTERVAL: float = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+    AUDIT_MAX_FILE_MB: int = int(os.getenv("AUDIT_MAX_FILE_MB", "64"))
+    AUDIT_ROTATE_INTERVAL: int = int(os.getenv("AUDIT_ROTATE_INTERVAL", "3600"))
+
+    # Shadow evaluation: SHADOW_SAMPLE_RATE of the getRisk requests are also
+    # scored by the candidate model store SHADOW_MODEL after the response, on
+    # a background thread using at most SHADOW_MAX_CPU of one core; the
+    # comparison is reported at /shadow. Empty SHADOW_MODEL disables it
+    SHADOW_MODEL: str = os.getenv("SHADOW_MODEL", "")
+    SHADOW_SAMPLE_RATE: float = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+    SHADOW_MAX_CPU: float = float(os.getenv("SHADOW_MAX_CPU", "0.1"))
+    SHADOW_MAX_QUEUED: int = int(os.getenv("SHADOW_MAX_QUEUED", "64"))
+
+    # In-process sampling profiler at /debug/profile, unauthenticated: enable
+    # it only temporarily, where py-spy can't be attached
+    PROFILER_ENABLED: bool = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+    # Longest profile a request may ask for, in seconds
+    PROFILER_MAX_SECONDS: float = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+    # Streaming: number of patients scored together in /api/getRiskStream/
+    STREAM_CHUNK_SIZE: int = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+
+    # Cohort scoring jobs (/api/jobs)
+    JOBS_DIR: str = os.getenv(
+        "JOBS_DIR", os.path.join(tempfile.gettempdir(), "bonoai-jobs")
+    )
+    JOBS_MAX_CONCURRENCY: int = int(os.getenv("JOBS_MAX_CONCURRENCY", "1"))
+    JOBS_MAX_QUEUED: int = int(os.getenv("JOBS_MAX_QUEUED", "16"))
+    JOBS_CHUNK_SIZE: int = int(os.getenv("JOBS_CHUNK_SIZE", "5000"))
+    # Seconds a finished job's status and result files are kept, 0 keeps them
+    JOBS_RETENTION_SECONDS: int = int(os.getenv("JOBS_RETENTION_SECONDS", "86400"))
+
+    # Speculative SHAP prefetching after /api/getRisk/: explanations (and plots
+    # with PREFETCH_RENDER) of all fracture types are computed in the background
+    # into a cache of PREFETCH_CACHE_SIZE entries, and dropped while more than
+    # PREFETCH_MAX_LOAD requests are in progress
+    PREFETCH_ENABLED: bool = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+    PREFETCH_RENDER: bool = os.getenv("PREFETCH_RENDER", "true").lower() == "true"
+    PREFETCH_CACHE_SIZE: int = int(os.getenv("PREFETCH_CACHE_SIZE", "128"))
+    PREFETCH_MAX_QUEUED: int = int(os.getenv("PREFETCH_MAX_QUEUED", "48"))
+    PREFETCH_MAX_LOAD: int = int(os.getenv("PREFETCH_MAX_LOAD", "2"))
+
+    # Admission control: requests handled at once and waiting per endpoint
+    # class, beyond that requests get 503 with Retry-After (seconds).
+    # /api/getRisk/ and /health are always admitted.
+    ADMISSION_SHAP_CONCURRENCY: int = int(os.getenv("ADMISSION_SHAP_CONCURRENCY", "2"))
+    ADMISSION_SHAP_QUEUE: int = int(os.getenv("ADMISSION_SHAP_QUEUE", "4"))
+    ADMISSION_BULK_CONCURRENCY: int = int(os.getenv("ADMISSION_BULK_CONCURRENCY", "2"))
+    ADMISSION_BULK_QUEUE: int = int(os.getenv("ADMISSION_BULK_QUEUE", "8"))
+    ADMISSION_RETRY_AFTER: int = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+    # Live risk WebSocket (/api/liveRisk/): changes arriving within the debounce
+    # window are merged into one update, and the incremental evaluator keeps the
+    # tree outputs of at most LIVE_MAX_SESSIONS open connections
+    LIVE_DEBOUNCE_MS: int = int(os.getenv("LIVE_DEBOUNCE_MS", "50"))
+    LIVE_MAX_SESSIONS: int = int(os.getenv("LIVE_MAX_SESSIONS", "1024"))
 
     class Config:
         case_sensitive = True
@@ -0,0 +1,175 @@
+"""
+Structured, non-blocking logging
+
+The root logger used to write every record to stdout synchronously, on the
+event loop or lane thread of the request that logged it. Here it only has a
+queue handler: a log call puts the record on a bounded in-memory queue and
+returns, and a listener thread formats it (one JSON object per line, or text)
+and writes it. Messages are formatted lazily on the listener thread, so log
+with %-style arguments (`logger.info("Risks: %s", risks)`) and don't change
+the arguments afterwards; records below the level or sampled out are never
+formatted. When the queue is full records are dropped, not waited for.
+
+Every record carries the id of the request it was logged for (`request_id`,
+set by app.middleware.RequestIdMiddleware), also from lane threads and
+background tasks. Loggers with many INFO lines can be sampled: with the rate
+0.1 for `app.api.endpoints` one in ten of its records below WARNING is kept.
+Dropped records are counted in `bonoai_log_records_dropped_total`.
+"""
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from app.services.metrics import metrics
+
+TEXT_FORMAT = "%(levelname)s %(asctime)s [%(name)s] %(message)s"
+
+# the request being handled, None outside of requests
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+dropped_total = metrics.counter(
+    "bonoai_log_records_dropped_total", "Log records not written: queue_full or sampled",
+    labels=("reason",),
+)
+
+# attributes every LogRecord has, the others were passed with `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id",
+}
+
+# the queue handler and listener of this process, see setup_logging
+_handler = None
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the request id of the logging context to the record"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records below WARNING of some loggers and their children"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved = {}  # logger name -> rate of it or its nearest sampled parent
+
+    def rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            parts = name.split(".")
+            for end in range(len(parts), 0, -1):
+                parent = ".".join(parts[:end])
+                if parent in self.rates:
+                    rate = self.rates[parent]
+                    break
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        if rate >= 1 or random.random() < rate:
+            return True
+        dropped_total.inc(reason="sampled")
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request id and the `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Enqueues records unformatted, drops them when the queue is full"""
+
+    def prepare(self, record):
+        # the stdlib handler formats the message here, for queues to other
+        # processes; the listener runs in this process and formats it instead
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_total.inc(reason="queue_full")
+
+
+def parse_sample_rates(text):
+    """`"app.api.endpoints=0.1,uvicorn.access=0.01"` -> {logger name: rate}"""
+    rates = {}
+    for item in text.split(","):
+        if item.strip():
+            name, _, rate = item.partition("=")
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(level="INFO", log_format="json", sample_rates=None, max_queued=10000, stream=None):
+    """Route all records through the queue to a listener thread writing `stream` (stdout)"""
+    global _handler, _listener
+    stop_logging()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    _handler = NonBlockingQueueHandler(queue.Queue(maxsize=max_queued))
+    # sampled out first, so skipped records cost the least
+    _handler.addFilter(SamplingFilter(sample_rates or {}))
+    _handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child():
+    # the listener thread isn't forked with the process (app.serve's workers):
+    # every child writes its records with its own thread, from a new queue
+    global _listener
+    if _listener is not None:
+        _handler.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+        _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def stop_logging():
+    """Write the queued records and stop the listener thread"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
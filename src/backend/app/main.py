@@ -5,26 +5,40 @@ A high-performance ML-powered API for calculating osteoporotic fracture risk
 in postmenopausal women.
 """
 
+import asyncio
 import logging
-import sys
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from app.config import settings
-from app.api import router
+from app.api import (
+    router, job_manager, registry, plot_pool, shap_prefetcher, risk_lane, explain_lane, audit_log,
+    shadow, warmup_steps,
+)
+from app.logs import parse_sample_rates, setup_logging
+from app.middleware import AdmissionMiddleware, RequestIdMiddleware, RequestMetricsMiddleware
+from app.services.admission import ConcurrencyLimiter
+from app.services.memory import memory_usage
+from app.services.metrics import metrics
+from app.services.profiler import ProfileRunning, collapsed, profiler
+from app.services.runtime import effective_runtime, report_runtime
+from app.services.warmup import Warmup
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL),
-    format="%(levelname)s %(asctime)s [%(name)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
+# Configure logging: records are queued and written by a listener thread
+setup_logging(
+    level=settings.LOG_LEVEL,
+    log_format=settings.LOG_FORMAT,
+    sample_rates=parse_sample_rates(settings.LOG_SAMPLE_RATES),
+    max_queued=settings.LOG_QUEUE_SIZE,
 )
 
 logger = logging.getLogger(__name__)
 
+warmup = Warmup(enabled=settings.WARMUP_ENABLED)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -32,15 +46,46 @@ async def lifespan(app: FastAPI):
     Lifespan context manager for startup and shutdown events
     """
     # Startup
-    logger.info(f"Starting {settings.APP_NAME} v{settings.APP_VERSION}")
-    logger.info(f"Environment: {settings.ENVIRONMENT}")
-    logger.info(f"Debug mode: {settings.DEBUG}")
-    logger.info(f"CORS Origins: {settings.CORS_ORIGINS}")
+    logger.info("Starting %s v%s", settings.APP_NAME, settings.APP_VERSION)
+    logger.info("Environment: %s", settings.ENVIRONMENT)
+    logger.info("Debug mode: %s", settings.DEBUG)
+    logger.info("CORS Origins: %s", settings.CORS_ORIGINS)
+    plot_pool.start()
+    audit_log.start()
+    profiler.set_routes(app.routes)
+    # checks the models and polls for new ones, in every worker: threads and
+    # XGBoost's OpenMP runtime don't survive app.serve's fork
+    registry.start()
+    logger.info("Model version: %s", registry.version)
+    report_runtime(effective_runtime(
+        registry.model,
+        lane_risk_workers=settings.LANE_RISK_WORKERS,
+        lane_explain_workers=settings.LANE_EXPLAIN_WORKERS,
+        plot_workers=settings.PLOT_WORKERS,
+        jobs_max_concurrency=settings.JOBS_MAX_CONCURRENCY,
+        store_max_rows=settings.STORE_MAX_ROWS,
+        stream_chunk_size=settings.STREAM_CHUNK_SIZE,
+        jobs_chunk_size=settings.JOBS_CHUNK_SIZE,
+    ))
+    # in the background: /health answers right away, /ready once it completed
+    warmup_task = asyncio.create_task(
+        warmup.run(warmup_steps(registry.model, shap=settings.WARMUP_SHAP))
+    )
 
     yield
 
     # Shutdown
-    logger.info(f"Shutting down {settings.APP_NAME}")
+    logger.info("Shutting down %s", settings.APP_NAME)
+    warmup_task.cancel()
+    registry.shutdown()
+    job_manager.shutdown(timeout=10)
+    plot_pool.shutdown()
+    shap_prefetcher.shutdown()
+    shadow.shutdown()
+    risk_lane.shutdown()
+    explain_lane.shutdown()
+    # after everything that records predictions
+    audit_log.shutdown()
 
 
 # Create FastAPI application
@@ -54,15 +99,43 @@ app = FastAPI(
     openapi_url="/openapi.json",
 )
 
+# Admission control per endpoint class, inside CORS so that 503 responses
+# carry CORS headers too
+shap_limiter = ConcurrencyLimiter(
+    "shap", settings.ADMISSION_SHAP_CONCURRENCY, settings.ADMISSION_SHAP_QUEUE
+)
+bulk_limiter = ConcurrencyLimiter(
+    "bulk", settings.ADMISSION_BULK_CONCURRENCY, settings.ADMISSION_BULK_QUEUE
+)
+app.add_middleware(
+    AdmissionMiddleware,
+    limiters={
+        "/api/getShapPlot/": shap_limiter,
+        "/api/getRiskExplained/": shap_limiter,
+        "/api/getRiskBatch/": bulk_limiter,
+        "/api/getRiskStream/": bulk_limiter,
+        "/api/getRiskSurface/": bulk_limiter,
+        "/api/getTreatmentComparison/": bulk_limiter,
+    },
+    retry_after=settings.ADMISSION_RETRY_AFTER,
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Model-Version", "X-Request-ID"],
 )
 
+# Count the requests in progress, for /metrics and to pause background work
+app.add_middleware(RequestMetricsMiddleware)
+
+# Outermost: everything logged for a request carries its id
+app.add_middleware(RequestIdMiddleware)
+
 # Include API routes
 app.include_router(router)
 
@@ -80,10 +153,96 @@ async def health_check():
             "status": "healthy",
             "version": settings.APP_VERSION,
             "environment": settings.ENVIRONMENT,
+            "modelVersion": registry.version,
         },
     )
 
 
+@app.get("/ready", tags=["health"])
+async def readiness_check():
+    """
+    Readiness endpoint
+
+    Returns 200 once the warm-up of this worker completed and 503 while it is
+    running (or if it failed), with the duration of every warm-up step. Point
+    load balancer health checks here, so cold workers get no traffic.
+    """
+    report = warmup.report()
+    return JSONResponse(
+        status_code=200 if warmup.ready else 503,
+        content={
+            "status": "ready" if warmup.ready else report["status"],
+            "modelVersion": registry.version,
+            "warmup": report,
+        },
+    )
+
+
+# Memory of this worker, USS drops when workers share the models (python -m app.serve)
+if memory_usage() is not None:
+    metrics.gauge(
+        "bonoai_process_unique_memory_bytes", "Memory only this worker process uses (USS)",
+        function=lambda: memory_usage()["uss"],
+    )
+    metrics.gauge(
+        "bonoai_process_proportional_memory_bytes", "Memory of this worker process with shared pages split (PSS)",
+        function=lambda: memory_usage()["pss"],
+    )
+
+
+@app.get("/metrics", tags=["health"], response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Metrics endpoint
+
+    Returns the metrics of this worker process in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/shadow", tags=["health"])
+async def shadow_report():
+    """
+    Shadow evaluation endpoint
+
+    Returns how the risks of the candidate model (SHADOW_MODEL) compare to the
+    served ones on the recently sampled getRisk requests of this worker: mean
+    and largest deltas and rank correlation per fracture type, and the
+    latencies of both.
+    """
+    return shadow.report()
+
+
+@app.get(
+    "/debug/profile", tags=["debug"], response_class=PlainTextResponse,
+    include_in_schema=settings.PROFILER_ENABLED,
+)
+async def profile(
+    seconds: float = Query(10, gt=0, le=settings.PROFILER_MAX_SECONDS, description="Duration of the profile"),
+    interval: float = Query(0.01, ge=0.001, le=1, description="Seconds between samples"),
+    idle: bool = Query(False, description="Also count waiting threads"),
+):
+    """
+    Sampling profiler endpoint (PROFILER_ENABLED)
+
+    Samples the stacks of all threads of this worker for `seconds` and returns
+    them in the collapsed format (`flamegraph.pl`, speedscope), every stack
+    starting with the endpoint and pipeline stage it belongs to. One profile
+    at a time per worker, 409 while another one runs.
+    """
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        future = profiler.start(seconds, interval, idle)
+    except ProfileRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    result = await asyncio.wrap_future(future)
+    return PlainTextResponse(
+        collapsed(result["stacks"]),
+        headers={"X-Profile-Samples": str(result["samples"]), "X-Profile-Seconds": str(result["seconds"])},
+    )
+
+
 @app.get("/", tags=["info"])
 async def root():
     """
@@ -97,6 +256,7 @@ async def root():
         "description": settings.APP_DESCRIPTION,
         "docs": "/docs",
         "health": "/health",
+        "ready": "/ready",
     }
 
 
@@ -106,7 +266,7 @@ async def global_exception_handler(request, exc):
     """
     Global exception handler for unhandled errors
     """
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal server error", "type": type(exc).__name__},
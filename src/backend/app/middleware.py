@@ -0,0 +1,137 @@
+"""
+ASGI middleware of the application
+"""
+import asyncio
+import uuid
+
+from starlette.responses import JSONResponse
+
+from app.logs import request_id_var
+from app.services.admission import Overloaded
+from app.services.cancellation import abandoned_total, remaining, request_deadline
+from app.services.metrics import metrics
+from app.services.profiler import endpoint_var
+
+# Monitoring endpoints, not counted as load
+UNCOUNTED_PATHS = ("/health", "/metrics", "/debug/profile")
+
+requests_in_progress = metrics.gauge(
+    "bonoai_requests_in_progress", "HTTP requests currently being handled"
+)
+
+
+class RequestIdMiddleware:
+    """
+    Give every request an id, for its log records and the X-Request-ID header
+
+    The client's X-Request-ID is used if it has one (of at most 64 printable
+    characters), so a request can be followed from the frontend or a proxy.
+    The id is set in request_id_var (and the path in the profiler's
+    endpoint_var) for the request's task, whose context the lanes and
+    background tasks copy.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if not request_id or len(request_id) > 64 or not request_id.isprintable():
+            request_id = uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        # for the sampling profiler's tags
+        endpoint_token = endpoint_var.set(scope["path"])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+            endpoint_var.reset(endpoint_token)
+
+
+class RequestMetricsMiddleware:
+    """
+    Count the HTTP requests in progress
+
+    A plain ASGI middleware instead of BaseHTTPMiddleware, which would buffer
+    streaming responses. A request counts until its response (including any
+    background task) is finished.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNCOUNTED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            requests_in_progress.dec()
+
+
+class AdmissionMiddleware:
+    """
+    Limit the concurrent requests of expensive endpoint classes
+
+    `limiters` maps request paths to the ConcurrencyLimiter of their class.
+    Other paths (e.g. /health and /api/getRisk/) are always admitted. A request
+    that can't be queued is answered with 503 and Retry-After before its body
+    is read, one whose `X-Deadline-Ms` passes while queued with 504.
+    """
+
+    def __init__(self, app, limiters, retry_after=1):
+        self.app = app
+        self.limiters = limiters
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiters.get(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            deadline = request_deadline(scope)
+        except ValueError:
+            deadline = None  # rejected by the endpoint
+
+        try:
+            if deadline is None:
+                await limiter.acquire()
+            else:
+                await asyncio.wait_for(limiter.acquire(), remaining(deadline))
+        except Overloaded:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server is busy, please retry later"},
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        except asyncio.TimeoutError:
+            abandoned_total.inc(endpoint=scope["path"].strip("/").split("/")[-1], reason="deadline")
+            response = JSONResponse(
+                status_code=504,
+                content={"detail": "Deadline exceeded while waiting for admission"},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
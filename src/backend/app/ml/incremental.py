@@ -0,0 +1,174 @@
+"""
+Incremental re-scoring of single patients
+
+In the form workflow consecutive requests for the same patient usually differ
+in a single field. Each tree of a booster only depends on the features it splits
+on, so after an edit only the trees that split on a changed feature can reach a
+different leaf. The evaluator here indexes the trees of a booster by feature,
+caches the leaf value of every tree for the last feature vector of each session
+key, and on an update re-walks only the affected trees.
+
+Results are identical to walking all trees (`TreeIndex.predict`) and agree with
+the booster's own predictions up to its float32 summation order.
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .risk_calculator import FX_TYPES
+
+# Output transformation of the supported objectives, applied to the margin
+OBJECTIVE_TRANSFORMS = {
+    "survival:aft": np.exp,
+    "survival:cox": np.exp,
+    "reg:squarederror": lambda margin: margin,
+}
+
+
+class TreeIndex:
+    """The trees of an XGBoost booster and which trees split on which feature"""
+
+    def __init__(self, booster):
+        model = json.loads(booster.save_raw(raw_format="json"))
+        learner = model["learner"]
+        objective = learner["objective"]["name"]
+        if objective not in OBJECTIVE_TRANSFORMS:
+            raise ValueError(f"Unsupported objective for incremental evaluation: {objective}")
+        self.transform = OBJECTIVE_TRANSFORMS[objective]
+
+        base_score = float(learner["learner_model_param"]["base_score"])
+        # the base score is stored on the output scale
+        self.base_margin = np.log(base_score) if self.transform is np.exp else base_score
+
+        self.trees = []
+        features_per_tree = []
+        for tree in learner["gradient_booster"]["model"]["trees"]:
+            # thresholds and leaves are float32 in the booster, keep their exact value
+            conditions = np.asarray(tree["split_conditions"], dtype="float32").tolist()
+            self.trees.append((
+                tree["left_children"],
+                tree["right_children"],
+                tree["split_indices"],
+                conditions,
+                [bool(value) for value in tree["default_left"]],
+            ))
+            features_per_tree.append({
+                feature
+                for feature, left in zip(tree["split_indices"], tree["left_children"])
+                if left != -1
+            })
+
+        self.n_features = int(learner["learner_model_param"]["num_feature"])
+        self.trees_by_feature = [
+            [index for index, features in enumerate(features_per_tree) if feature in features]
+            for feature in range(self.n_features)
+        ]
+
+    def leaf_value(self, tree_index, row):
+        """Walk one tree for a feature vector (a list of floats) and return its leaf"""
+        left, right, features, conditions, default_left = self.trees[tree_index]
+        node = 0
+        while left[node] != -1:
+            value = row[features[node]]
+            if value != value:  # NaN, missing value
+                node = left[node] if default_left[node] else right[node]
+            elif value < conditions[node]:
+                node = left[node]
+            else:
+                node = right[node]
+        return conditions[node]
+
+    def leaf_values(self, row, tree_indices=None):
+        if tree_indices is None:
+            tree_indices = range(len(self.trees))
+        return [self.leaf_value(index, row) for index in tree_indices]
+
+    def output(self, leaf_values):
+        """Booster output (prediction) for the leaf values of all trees"""
+        # fsum is exactly rounded, so the result doesn't depend on the order
+        # in which leaf values were updated
+        margin = self.base_margin + math.fsum(leaf_values)
+        return float(self.transform(margin))
+
+    def predict(self, features):
+        """Booster output walking all trees, the reference for IncrementalEvaluator"""
+        row = np.asarray(features, dtype="float32").reshape(-1).tolist()
+        return self.output(self.leaf_values(row))
+
+
+class IncrementalEvaluator:
+    """
+    Booster evaluation that re-walks only the trees affected by changed features
+
+    Keeps the feature vector and per-tree leaf values of the last evaluation of
+    up to `max_sessions` keys (least recently used are evicted).
+    """
+
+    def __init__(self, booster, max_sessions=1024):
+        self.index = TreeIndex(booster)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.trees_walked = 0
+
+    def predict(self, key, features):
+        """Booster output for one prepared feature vector of session `key`"""
+        # plain Python floats, a single row is faster to walk without NumPy
+        row = np.asarray(features, dtype="float32").reshape(-1).tolist()
+
+        with self._lock:
+            session = self._sessions.pop(key, None)
+
+        if session is None:
+            leaf_values = self.index.leaf_values(row)
+            self.trees_walked += len(leaf_values)
+        else:
+            previous, leaf_values = session
+            trees = set()
+            for feature, (value, previous_value) in enumerate(zip(row, previous)):
+                # NaN != NaN, a missing value that stays missing is unchanged
+                if value != previous_value and (value == value or previous_value == previous_value):
+                    trees.update(self.index.trees_by_feature[feature])
+            if trees:
+                leaf_values = list(leaf_values)
+                for tree_index in trees:
+                    leaf_values[tree_index] = self.index.leaf_value(tree_index, row)
+                self.trees_walked += len(trees)
+
+        with self._lock:
+            self._sessions[key] = (row, leaf_values)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+        return self.index.output(leaf_values)
+
+    def forget(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+
+class IncrementalRiskModel:
+    """Incremental evaluators for the three fracture type models of a BonoAI"""
+
+    def __init__(self, model, max_sessions=1024):
+        self.model = model
+        self.evaluators = {
+            fx_type: IncrementalEvaluator(model.models["xgb"][fx_type], max_sessions)
+            for fx_type in FX_TYPES
+        }
+
+    def predict_risks(self, key, features, times):
+        """Risks of one prepared feature vector per fracture type, one value per time"""
+        return {
+            fx_type: self.model.risks_from_predictions(
+                np.array([evaluator.predict(key, features)]), fx_type, times
+            )[0]
+            for fx_type, evaluator in self.evaluators.items()
+        }
+
+    def forget(self, key):
+        for evaluator in self.evaluators.values():
+            evaluator.forget(key)
@@ -0,0 +1,240 @@
+"""
+Replay of recorded traffic against two model configurations
+
+Re-runs historical requests through two configurations of BonoAI, a baseline
+and a candidate, one request after the other at full speed, and reports the
+differences of their outputs per request, the latency distribution of both and
+their throughput. A performance change (e.g. the compiled forest instead of the
+boosters) or a new model bundle is then approved on real traffic instead of a
+single sample patient.
+
+The traffic is read from NDJSON files (or directories of them) with one of
+these per line:
+- a RiskRequest payload (`riskHorizon`, `patientData`): risks of every
+  fracture type, compared in percentage points
+- a ShapPlotRequest payload (with `fxType`): the SHAP values of the
+  explanation, compared in log-odds (the plot itself is not rendered)
+- an audit log record (app.services.audit, NDJSON or Parquet): its prepared
+  features are scored at its horizons, the patient fields aren't in the record
+
+A configuration is `default` (the JSON boosters and pickled Cox models) or the
+path of a model store, optionally followed by the evaluator of the risks:
+`:booster` (XGBoost) or `:forest` (the store's compiled NumPy trees); without
+one the API's choice by batch size is used. Requests are timed alternately in
+both orders, each configuration runs every kind of request once before timing.
+
+Usage (from src/backend):
+    python -m app.ml.replay requests.ndjson \\
+        --baseline app/ml/models/bonoai.store:booster --candidate app/ml/models/bonoai.store:forest
+    python -m app.ml.replay /var/log/bonoai/audit --baseline old.store --candidate new.store \\
+        --tolerance 0.5 --output differences.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from app.models import RiskRequest, ShapPlotRequest, patients_to_columns
+from .risk_calculator import FX_TYPES, STORE_MAX_ROWS, BonoAI
+from .store import ModelStore
+
+# store_max_rows of each evaluator
+EVALUATORS = {"": STORE_MAX_ROWS, "booster": 0, "forest": sys.maxsize}
+
+
+class ReplayRequest:
+    """One recorded request: patient fields or prepared features, and what to compute"""
+
+    def __init__(self, source, kind, horizons, columns=None, features=None, fx_type=None):
+        self.source = source  # "<file>:<line>"
+        self.kind = kind  # "risk" or "shap"
+        self.horizons = horizons  # in years
+        self.columns = columns
+        self.features = features  # feature name -> value (audit records)
+        self.fx_type = fx_type
+
+
+def load_configuration(spec):
+    """A BonoAI for `default`, `<store>`, `<store>:booster` or `<store>:forest`"""
+    path, evaluator = spec, ""
+    if spec.rsplit(":", 1)[-1] in ("booster", "forest"):
+        path, evaluator = spec.rsplit(":", 1)
+    store = None if path in ("", "default") else ModelStore(path)
+    if evaluator == "forest" and store is None:
+        raise ValueError(f"{spec}: the compiled forest needs a model store")
+    return BonoAI(store=store, store_max_rows=EVALUATORS[evaluator])
+
+
+def _parse(record, source):
+    if "features" in record:
+        horizons = record["horizons"]
+        return ReplayRequest(source, "risk", list(horizons), features=record["features"])
+    if "fxType" in record:
+        request = ShapPlotRequest.model_validate(record)
+        kind, fx_type = "shap", request.fxType
+    else:
+        request = RiskRequest.model_validate(record)
+        kind, fx_type = "risk", None
+    columns = patients_to_columns([request.patientData])
+    return ReplayRequest(source, kind, [request.riskHorizon], columns=columns, fx_type=fx_type)
+
+
+def _files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith((".ndjson", ".jsonl", ".parquet")):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def read_traffic(paths):
+    """The replayable requests of NDJSON / Parquet files and directories, and the number skipped"""
+    requests = []
+    skipped = 0
+    for path in _files(paths):
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            records = enumerate(pq.read_table(path).to_pylist(), start=1)
+        else:
+            with open(path, encoding="utf-8") as file:
+                records = [(number, line) for number, line in enumerate(file, start=1) if line.strip()]
+        for number, record in records:
+            try:
+                if isinstance(record, str):
+                    record = json.loads(record)
+                requests.append(_parse(record, f"{path}:{number}"))
+            except (ValueError, KeyError, TypeError):
+                # not JSON, or neither a request nor an audit record
+                skipped += 1
+    return requests, skipped
+
+
+def run_request(model, request):
+    """The output of `request` on `model` as a flat array"""
+    if request.features is not None:
+        features = np.array([[request.features[name] for name in model.feature_names]], dtype="float32")
+    else:
+        dtype = "float64" if request.kind == "shap" else "float32"
+        features = model.prepare_matrix(request.columns, dtype=dtype)
+
+    if request.kind == "shap":
+        values, base_value, _, _ = model.explain(features[0], request.fx_type)
+        return np.append(values, base_value)
+    months = [horizon * 12 for horizon in request.horizons]
+    # unrounded, so differences below the API's two decimals show
+    return np.concatenate([model.predict_risks(features, fx_type, months)[0] * 100 for fx_type in FX_TYPES])
+
+
+def replay(requests, baseline, candidate):
+    """
+    Run every request on both models, returns one result per request:
+    `{"source", "kind", "baselineMs", "candidateMs", "difference"}` with the
+    largest absolute difference of the outputs
+    """
+    models = (baseline, candidate)
+    # the first SHAP explanation and prediction of a model are slower
+    for kind in ("risk", "shap"):
+        first = next((request for request in requests if request.kind == kind), None)
+        if first is not None:
+            for model in models:
+                run_request(model, first)
+
+    results = []
+    for index, request in enumerate(requests):
+        outputs, seconds = [None, None], [0.0, 0.0]
+        # alternate the order, so neither configuration always runs on warm caches
+        for which in ((0, 1) if index % 2 == 0 else (1, 0)):
+            start = time.perf_counter()
+            outputs[which] = run_request(models[which], request)
+            seconds[which] = time.perf_counter() - start
+        results.append({
+            "source": request.source,
+            "kind": request.kind,
+            "baselineMs": round(seconds[0] * 1000, 4),
+            "candidateMs": round(seconds[1] * 1000, 4),
+            "difference": float(np.max(np.abs(outputs[0] - outputs[1]))),
+        })
+    return results
+
+
+def summarize(results):
+    """Latency percentiles (ms) and throughput (requests/s) of both configurations"""
+    summary = {}
+    for name, key in (("baseline", "baselineMs"), ("candidate", "candidateMs")):
+        latencies = np.array([result[key] for result in results])
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        summary[name] = {
+            "p50": p50, "p90": p90, "p99": p99, "max": latencies.max(),
+            "throughput": len(latencies) / (latencies.sum() / 1000),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.ml.replay", description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("traffic", nargs="+", help="NDJSON / Parquet files or directories of them")
+    parser.add_argument("--baseline", default="default", help="configuration replayed first (default: default)")
+    parser.add_argument("--candidate", required=True, help="configuration compared to the baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=None,
+        help="exit with status 1 if a risk differs by more percentage points (or SHAP value by more)",
+    )
+    parser.add_argument("--output", help="NDJSON file for the result of every request")
+    parser.add_argument("--top", type=int, default=10, help="largest differences to list (default: 10)")
+    args = parser.parse_args(argv)
+
+    requests, skipped = read_traffic(args.traffic)
+    if not requests:
+        parser.error("no replayable requests found")
+    baseline = load_configuration(args.baseline)
+    candidate = load_configuration(args.candidate)
+
+    results = replay(requests, baseline, candidate)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(result) + "\n" for result in results)
+
+    n_shap = sum(result["kind"] == "shap" for result in results)
+    print(f"Replayed {len(results)} requests ({len(results) - n_shap} risk, {n_shap} SHAP), skipped {skipped}")
+    print(f"baseline:  {args.baseline} (model version {baseline.version})")
+    print(f"candidate: {args.candidate} (model version {candidate.version})\n")
+    summary = summarize(results)
+    print(f"{'':<11} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'req/s':>9}")
+    for name, stats in summary.items():
+        print(
+            f"{name:<11} {stats['p50']:7.3f}ms {stats['p90']:7.3f}ms {stats['p99']:7.3f}ms "
+            f"{stats['max']:7.3f}ms {stats['throughput']:9.0f}"
+        )
+    print(f"speed-up   {summary['baseline']['p50'] / summary['candidate']['p50']:.2f}x at p50\n")
+
+    exceeded = 0
+    for kind, unit in (("risk", "percentage points"), ("shap", "log-odds")):
+        differences = [result["difference"] for result in results if result["kind"] == kind]
+        if not differences:
+            continue
+        over = sum(difference > args.tolerance for difference in differences) if args.tolerance is not None else 0
+        exceeded += over
+        tolerance = f", {over} above {args.tolerance}" if args.tolerance is not None else ""
+        changed = sum(difference > 0 for difference in differences)
+        print(f"{kind} outputs: {changed} of {len(differences)} differ, up to {max(differences):.3g} {unit}{tolerance}")
+
+    largest = sorted(results, key=lambda result: result["difference"], reverse=True)[:args.top]
+    largest = [result for result in largest if result["difference"] > 0]
+    if largest:
+        print("\nLargest differences:")
+        for result in largest:
+            print(f"  {result['difference']:10.3g} {result['kind']:<5} {result['source']}")
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
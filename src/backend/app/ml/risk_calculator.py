@@ -1,24 +1,73 @@
 import base64
 import datetime
 import io
-import matplotlib
-import matplotlib.pyplot as plt
+import logging
 import numpy as np
-import pandas as pd
 import pickle
 import os
-import shap
+import threading
 import xgboost as xgb
+from functools import cached_property
 
-from .plots.waterfall import waterfall
+from .store import compile_models
 
-# Agg, is a non-interactive backend that can only write to files
-# for more info see: https://matplotlib.org/stable/users/explain/backends.html
-matplotlib.use("agg")
+logger = logging.getLogger(__name__)
+
+FX_TYPES = ["vertebral", "hip", "any"]
+
+# API field names that differ from the feature names used by the models
+NAME_TRANSLATIONS = {
+    "antiepileptics": "antiepileptic_drugs",
+    "tscore_total_hip": "tscore_totalHip",
+    "tbs": "tbs_ls",
+    "bisphosphonate_prior": "Bisphosphonat_prior",
+    "bisphosphonate_current": "Bisphosphonat_current",
+    "bisphosphonate_new": "Bisphosphonat_new",
+    "denosumab_prior": "Denosumab_prior",
+    "denosumab_current": "Denosumab_current",
+    "denosumab_new": "Denosumab_new",
+    "serm_prior": "SERM_prior",
+    "serm_current": "SERM_current",
+    "serm_new": "SERM_new",
+    "hrt_prior": "HRT_prior",
+    "hrt_current": "HRT_current",
+    "hrt_new": "HRT_new",
+    "teriparatide_prior": "Teriparatide_prior",
+    "teriparatide_current": "Teriparatide_current",
+    "teriparatide_new": "Teriparatide_new",
+}
+
+# Up to this many rows predictions come from the mapped model store, when
+# there is one; it is as fast as the booster for single patients, XGBoost's
+# own predictor is faster for batches
+STORE_MAX_ROWS = 8
+
+TREATMENTS = ["bisphosphonate", "denosumab", "serm", "teriparatide", "hrt"]
+
+# treatment flags in the order they appear in the patient data
+TREATMENT_FEATURES = [
+    NAME_TRANSLATIONS[f"{drug}_{status}"]
+    for drug in TREATMENTS
+    for status in ["prior", "current", "new"]
+]
+
+
+def calculate_bmi(height, weight):
+    # works on scalars as well as numpy arrays / pandas columns
+    height_m = np.asarray(height, dtype="float64") / 100
+    return np.round(np.asarray(weight, dtype="float64") / (height_m**2), 2)
 
 
 class BonoAI:
-    def __init__(self):
+    def __init__(self, store=None, nthread=None, store_max_rows=STORE_MAX_ROWS):
+        # with a ModelStore (app.ml.store) all models come from its snapshot:
+        # the boosters are deserialized from it, small predictions and the Cox
+        # step use its mapped arrays, nothing is parsed or unpickled
+        self.store = store
+        # threads of every booster prediction, None keeps XGBoost's default
+        # of all cores
+        self.nthread = nthread
+        self.store_max_rows = store_max_rows
         self.models = self.load_models()
         self.times = np.arange(12, 95, 12)
         self.id = np.random.randint(100000)
@@ -28,118 +77,183 @@ class BonoAI:
         models = {"xgb": {}, "cox": {}}
         base_path = os.path.dirname(os.path.realpath(__file__))
 
-        for fx_type in ["vertebral", "hip", "any"]:
-            xgb_model = xgb.Booster()
-            xgb_path = os.path.join(base_path, f"models/{fx_type}_xgb.json")
-            xgb_model.load_model(xgb_path)
-            models["xgb"][fx_type] = xgb_model
+        if self.store is not None:
+            # the Cox models are only needed as the arrays of the store
+            models["xgb"] = self.store.load_boosters()
+        else:
+            for fx_type in ["vertebral", "hip", "any"]:
+                xgb_model = xgb.Booster()
+                xgb_path = os.path.join(base_path, f"models/{fx_type}_xgb.json")
+                xgb_model.load_model(xgb_path)
+                models["xgb"][fx_type] = xgb_model
 
-            cox_path = os.path.join(base_path, f"models/{fx_type}_cox.pkl")
-            with open(cox_path, "rb") as file:
-                models["cox"][fx_type] = pickle.load(file)
+                cox_path = os.path.join(base_path, f"models/{fx_type}_cox.pkl")
+                with open(cox_path, "rb") as file:
+                    models["cox"][fx_type] = pickle.load(file)
 
-        print(
-            f"Models loaded in {round((datetime.datetime.now() - now).total_seconds(), 2)} seconds."
-        )
-        return models
+        if self.nthread is not None:
+            for xgb_model in models["xgb"].values():
+                xgb_model.set_param({"nthread": self.nthread})
 
-    def prepare_data(self, data):
-        patient_data = pd.Series(data, dtype="float64")
+        logger.info("Models loaded in %.2f seconds", (datetime.datetime.now() - now).total_seconds())
+        return models
 
-        # convert bool values to int
-        """ for key in patient_data.keys():
-            if type(patient_data[key]) == bool:
-                patient_data[key] = int(patient_data[key]) """
+    def prepare_matrix(self, columns, dtype="float32"):
+        # model features of many patients: `columns` maps the API field names
+        # (height and weight instead of bmi) to one array per field. The arrays
+        # are only read, so they can be views into the request buffers, and are
+        # copied once into the (n_rows, n_features) matrix for the boosters.
+        def column(name):
+            return np.asarray(columns[name], dtype="float64")
 
-        if patient_data[["hrt_prior", "hrt_current"]].sum() > 0:
-            patient_data["hrt"] = 1
-        else:
-            patient_data["hrt"] = 0
-
-        # rename features
-        name_translations = {
-            "antiepileptics": "antiepileptic_drugs",
-            "tscore_total_hip": "tscore_totalHip",
-            "tbs": "tbs_ls",
-            "bisphosphonate_prior": "Bisphosphonat_prior",
-            "bisphosphonate_current": "Bisphosphonat_current",
-            "bisphosphonate_new": "Bisphosphonat_new",
-            "denosumab_prior": "Denosumab_prior",
-            "denosumab_current": "Denosumab_current",
-            "denosumab_new": "Denosumab_new",
-            "serm_prior": "SERM_prior",
-            "serm_current": "SERM_current",
-            "serm_new": "SERM_new",
-            "hrt_prior": "HRT_prior",
-            "hrt_current": "HRT_current",
-            "hrt_new": "HRT_new",
-            "teriparatide_prior": "Teriparatide_prior",
-            "teriparatide_current": "Teriparatide_current",
-            "teriparatide_new": "Teriparatide_new",
+        treatments = {feature: api for api, feature in NAME_TRANSLATIONS.items()}
+        derived = {
+            "bmi": calculate_bmi(column("height"), column("weight")),
+            "hrt": np.nansum([column("hrt_prior"), column("hrt_current")], axis=0) > 0,
+            "min_tscore": np.fmin.reduce(
+                [column("tscore_neck"), column("tscore_total_hip"), column("tscore_ls")]
+            ),
+            "No_treatment": np.nansum(
+                [column(treatments[name]) for name in TREATMENT_FEATURES], axis=0
+            )
+            == 0,
         }
-        patient_data = patient_data.rename(name_translations)
 
-        # calculate min tscore
-        patient_data["min_tscore"] = patient_data[
-            ["tscore_neck", "tscore_totalHip", "tscore_ls"]
-        ].min()
+        n_rows = len(derived["bmi"])
+        matrix = np.empty((n_rows, len(self.feature_names)), dtype=dtype)
+        for index, name in enumerate(self.feature_names):
+            if name in derived:
+                matrix[:, index] = derived[name]
+            else:
+                matrix[:, index] = columns[treatments.get(name, name)]
+        return matrix
 
-        # add No treatment feature
-        patient_data["No_treatment"] = int(
-            patient_data.loc["Bisphosphonat_prior":"HRT_new"].sum() == 0
-        )
-        # sort features the same way as in the xgb model
-        xgb_features = self.models["xgb"]["vertebral"].feature_names
-        patient_data = patient_data[xgb_features]
+    @property
+    def feature_names(self):
+        return self.models["xgb"]["vertebral"].feature_names
+
+    @cached_property
+    def version(self):
+        # identifies the models: the model version of the store, or the same
+        # digest computed from the loaded JSON boosters and pickles
+        if self.store is not None:
+            return self.store.model_version
+        return compile_models(self)[1]["model_version"]
+
+    def predict_risks(self, features, fx_type, times):
+        # risk for every prepared row (n_rows, n_features) at every time in
+        # months, returned as an array of shape (n_rows, n_times)
+        # the boosters work in float32 anyway, and inplace_predict skips the
+        # DMatrix construction
+        features = np.ascontiguousarray(features, dtype="float32")
+        if features.ndim != 2 or features.shape[1] != len(self.feature_names):
+            raise ValueError(
+                f"Expected prepared features of shape (n, {len(self.feature_names)}), "
+                f"got {features.shape}"
+            )
+        if self.store is not None and len(features) <= self.store_max_rows:
+            xgb_pred = self.store.forest(fx_type).predict(features)
+        else:
+            xgb_pred = self.models["xgb"][fx_type].inplace_predict(features)
+        return self.risks_from_predictions(xgb_pred, fx_type, times)
 
-        self.prepared_data = patient_data
+    def risks_from_predictions(self, xgb_pred, fx_type, times):
+        # Cox step of predict_risks for booster outputs computed elsewhere
+        coefficients, baseline_times, baseline_survival = self.cox_table(fx_type)
 
-        return patient_data
+        # S(t | x) = S0(t) ** exp(x * beta), see CoxPHSurvivalAnalysis
+        risk_score = np.exp(np.dot(xgb_pred.reshape(-1, 1), coefficients))
+        baseline = self.baseline_survival(baseline_times, baseline_survival, times)
+        return 1 - np.power(baseline[np.newaxis, :], risk_score[:, np.newaxis])
 
-    def predict_risk(self, fx_type, t=24):
-        xgb_model = self.models["xgb"][fx_type]
+    def cox_table(self, fx_type):
+        # (coefficients, baseline survival step times, baseline survival) of
+        # the Cox model of a fracture type
+        if self.store is not None:
+            return self.store.cox_table(fx_type)
         cox_model = self.models["cox"][fx_type]
-        # prepared_data = self.prepare_data(data, xgb_model.feature_names)
+        step_function = cox_model._baseline_model.baseline_survival_
+        return cox_model.coef_, step_function.x, step_function.y
 
+    def shap_values(self, features, fx_type):
+        # SHAP values of the booster output for every prepared row, identical
+        # to shap.Explainer(model) (tree path dependent TreeSHAP), returned as
+        # (values of shape (n_rows, n_features), base values of shape (n_rows,))
         xgb_data = xgb.DMatrix(
-            self.prepared_data.values.reshape(1, -1),
-            feature_names=self.prepared_data.index.tolist(),
+            np.asarray(features, dtype="float32"), feature_names=self.feature_names
         )
-        xgb_pred = xgb_model.predict(xgb_data)
+        contributions = self.models["xgb"][fx_type].predict(xgb_data, pred_contribs=True)
+        return contributions[:, :-1], contributions[:, -1]
 
-        survival_function = cox_model.predict_survival_function(xgb_pred.reshape(-1, 1))
-        fracture_proba = 1 - survival_function[0](t)
+    @staticmethod
+    def baseline_survival(baseline_times, baseline_survival, times):
+        # evaluate the Breslow baseline survival step function at the given
+        # times, the same way sksurv's StepFunction does
+        times = np.clip(np.atleast_1d(times), baseline_times[0], None)
+        index = np.searchsorted(baseline_times, times, side="right") - 1
+        return baseline_survival[index]
 
-        print(fx_type, fracture_proba)
-        # shap_plot = self.create_shap_waterfall(self.prepared_data, fx_type)
-        # return {
-        #     "risk": fracture_proba,
-        #     # "shap_plot": shap_plot,
-        # }
-        return fracture_proba
+    def explain(self, features, fx_type):
+        # SHAP values of a single prepared row as the arguments of
+        # render_waterfall: (values, base value, feature values, feature names)
+        features = np.asarray(features, dtype="float64").reshape(1, -1)
+        values, base_values = self.shap_values(features, fx_type)
+        return values[0], float(base_values[0]), features[0], list(self.feature_names)
+
+
+# pyplot keeps one global current figure, so threads must not draw at the same
+# time. Separate processes each have their own pyplot and can.
+_plot_lock = threading.Lock()
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+def _checkpoint(cancelled):
+    # `cancelled` is a threading.Event set when nobody waits for the plot anymore
+    if cancelled is not None and cancelled.is_set():
+        raise RenderCancelled("SHAP plot no longer needed")
 
-    def create_shap_waterfall(self, data, fx_type):
-        now = datetime.datetime.now()
-        model = self.models["xgb"][fx_type]
-        explainer = shap.Explainer(model)
-        patient_data = pd.DataFrame(data).T
-        shap_values = explainer(patient_data)
 
+def import_plotting():
+    # SHAP and pyplot take over a second to import and only plots need them,
+    # so they are imported on first use (app.serve and the plot workers call
+    # this up front). Returns (shap, pyplot, waterfall).
+    import matplotlib
+
+    # Agg, is a non-interactive backend that can only write to files
+    # for more info see: https://matplotlib.org/stable/users/explain/backends.html
+    matplotlib.use("agg")
+    import matplotlib.pyplot as plt
+    import shap
+
+    from .plots.waterfall import waterfall
+
+    return shap, plt, waterfall
+
+
+def render_waterfall(values, base_value, data, feature_names, cancelled=None):
+    # module level, so it can also be sent to a worker process
+    shap, plt, waterfall = import_plotting()
+    explanation = shap.Explanation(
+        values=values, base_values=base_value, data=data, feature_names=feature_names
+    )
+    with _plot_lock:
+        # the request may have been abandoned while waiting for the lock
+        _checkpoint(cancelled)
         plt.clf()  # reset the matplotlib figure
-        fig = waterfall(shap_values[0], show=False)
+        fig = waterfall(explanation, show=False)
 
-        # Save the plot to a bytes buffer
+        # Save the plot to a bytes buffer, the most expensive stage
+        _checkpoint(cancelled)
         img_data = io.BytesIO()
         plt.savefig(img_data, format="png", bbox_inches="tight")
         img_data.seek(0)
 
-        # Encode the bytes as base64
-        image_base64 = base64.b64encode(img_data.getvalue()).decode("utf-8")
-
-        print(
-            f"{fx_type}: SHAP waterfall plot created in {round((datetime.datetime.now() - now).total_seconds(), 2)} seconds."
-        )
-        return image_base64
+    # Encode the bytes as base64
+    _checkpoint(cancelled)
+    return base64.b64encode(img_data.getvalue()).decode("utf-8")
 
 
 # FOR TESTING PURPOSES
@@ -0,0 +1,288 @@
+"""
+Offline bulk scoring of patient cohorts
+
+Streams a CSV or Parquet file in chunks, applies the same feature preparation
+as the API (BMI derivation, renaming, derived treatment features) and writes the
+vertebral, hip and any fracture risks for the requested horizons to CSV or
+Parquet. Chunks are scored in a process pool; at most a fixed number of chunks
+is in flight at any time, so memory stays bounded regardless of file size.
+
+Usage:
+    python -m app.ml.score cohort.parquet risks.parquet --horizons 2 5 --workers 4
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from app.models import ColumnValidationError, PatientData, validate_patient_columns
+from .risk_calculator import FX_TYPES, BonoAI
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Model inputs, in the order of the PatientData fields
+PATIENT_FIELDS = list(PatientData.model_fields)
+
+# Set in each worker process by _init_worker
+_worker_model = None
+
+
+def _init_worker():
+    """Load the models once per worker process"""
+    global _worker_model
+    # one process per core already, so keep each booster single-threaded
+    _worker_model = BonoAI(nthread=1)
+
+
+def score_features(model, features, horizons, shap=False):
+    """
+    Output columns for a matrix of prepared features
+
+    Returns a dict with one `<fxType>_risk_<horizon>y` column per fracture type
+    and horizon, as percentages rounded like the API. With `shap=True` it also
+    contains the SHAP values (`<fxType>_shap_<feature>`) and base value
+    (`<fxType>_shap_base`) of every fracture type model.
+    """
+    times = [horizon * 12 for horizon in horizons]
+
+    columns = {}
+    for fx_type in FX_TYPES:
+        predictions = model.predict_risks(features, fx_type, times)
+        for column, horizon in enumerate(horizons):
+            columns[f"{fx_type}_risk_{horizon}y"] = (predictions[:, column] * 100).round(2)
+
+    if shap:
+        for fx_type in FX_TYPES:
+            values, base_values = model.shap_values(features, fx_type)
+            for index, name in enumerate(model.feature_names):
+                columns[f"{fx_type}_shap_{name}"] = values[:, index]
+            columns[f"{fx_type}_shap_base"] = base_values
+
+    return columns
+
+
+def score_chunk(frame, horizons, model=None):
+    """
+    Score one chunk of patients, returns a DataFrame of score_features columns
+
+    The chunk is validated like a columnar batch request, a chunk with invalid
+    values (out of range, missing, NaN) raises ValueError naming the input rows
+    instead of being scored.
+    """
+    model = model or _worker_model
+    try:
+        columns, _ = validate_patient_columns(
+            {name: frame[name].to_numpy() for name in PATIENT_FIELDS}
+        )
+    except ColumnValidationError as e:
+        raise ValueError(_describe_errors(e.errors, frame.index)) from None
+    features = model.prepare_matrix(columns, dtype="float64")
+    return pd.DataFrame(score_features(model, features, horizons), index=frame.index)
+
+
+def _describe_errors(errors, index):
+    # "Invalid patient data: row 3 age: Input should be ..." with the row
+    # numbers of the input file (0-based, header excluded)
+    described = []
+    for error in errors:
+        name = error["loc"][1] if len(error["loc"]) > 1 else "columns"
+        if len(error["loc"]) > 2:
+            described.append(f"row {index[error['loc'][2]]} {name}: {error['msg']}")
+        else:
+            described.append(f"{name}: {error['msg']}")
+    return "Invalid patient data: " + "; ".join(described)
+
+
+def _file_format(path, file_format=None):
+    if file_format:
+        return file_format
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension in (".csv", ".gz", ".txt"):
+        return "csv"
+    raise ValueError(f"Cannot infer file format of {path}, use --input-format/--output-format")
+
+
+def _fill_defaults(frame):
+    """Add optional PatientData fields missing from the input with their defaults"""
+    for name, field in PatientData.model_fields.items():
+        if name in frame.columns:
+            continue
+        if field.is_required():
+            raise ValueError(f"Input is missing required column '{name}'")
+        frame[name] = field.default
+    return frame
+
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, file_format=None, keep_columns=()):
+    """Yield the input file as DataFrames of at most `chunk_size` rows"""
+    wanted = set(PATIENT_FIELDS) | set(keep_columns)
+
+    if _file_format(path, file_format) == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        columns = [name for name in parquet_file.schema_arrow.names if name in wanted]
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            frame = batch.to_pandas()
+            # number the rows across batches, like the CSV reader does
+            frame.index += offset
+            offset += len(frame)
+            yield _fill_defaults(frame)
+    else:
+        reader = pd.read_csv(
+            path, chunksize=chunk_size, usecols=lambda name: name in wanted
+        )
+        for chunk in reader:
+            yield _fill_defaults(chunk)
+
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file"""
+
+    def __init__(self, path, file_format=None):
+        self.path = path
+        self.file_format = _file_format(path, file_format)
+        self._parquet_writer = None
+        self._header_written = False
+
+    def write(self, frame):
+        if self.file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            frame.to_csv(
+                self.path,
+                mode="a" if self._header_written else "w",
+                header=not self._header_written,
+                index=False,
+            )
+            self._header_written = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def score_file(
+    input_path,
+    output_path,
+    horizons=(2,),
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    workers=None,
+    keep_columns=(),
+    input_format=None,
+    output_format=None,
+):
+    """
+    Score a whole cohort file and return the number of scored rows
+
+    Chunks are submitted to a pool of `workers` processes (all cores by
+    default) and written back in input order. With `workers=1` everything runs
+    in the current process.
+    """
+    horizons = list(horizons)
+    for horizon in horizons:
+        if not 1 <= horizon <= 7:
+            raise ValueError(f"Risk horizon must be between 1 and 7 years, got {horizon}")
+    workers = workers or os.cpu_count() or 1
+
+    chunks = read_chunks(input_path, chunk_size, input_format, keep_columns)
+    writer = ChunkWriter(output_path, output_format)
+    n_rows = 0
+
+    def write_result(chunk, risks):
+        nonlocal n_rows
+        writer.write(pd.concat([chunk[list(keep_columns)], risks], axis=1))
+        n_rows += len(chunk)
+
+    try:
+        if workers == 1:
+            model = BonoAI()
+            for chunk in chunks:
+                write_result(chunk, score_chunk(chunk, horizons, model))
+            return n_rows
+
+        # spawn instead of fork so workers don't inherit OpenMP state
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker
+        ) as pool:
+            # bound the number of chunks in memory: queued + running + writing
+            in_flight = deque()
+            for chunk in chunks:
+                # only the kept columns stay in the parent while a chunk is scored
+                in_flight.append(
+                    (chunk[list(keep_columns)], pool.submit(score_chunk, chunk, horizons))
+                )
+                if len(in_flight) >= 2 * workers:
+                    write_result(*_pop_result(in_flight))
+            while in_flight:
+                write_result(*_pop_result(in_flight))
+    finally:
+        writer.close()
+
+    return n_rows
+
+
+def _pop_result(in_flight):
+    kept, future = in_flight.popleft()
+    return kept, future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m app.ml.score",
+        description="Score a patient cohort (CSV or Parquet) with the BonoAI models.",
+    )
+    parser.add_argument("input", help="Input CSV or Parquet file with PatientData columns")
+    parser.add_argument("output", help="Output CSV or Parquet file")
+    parser.add_argument(
+        "--horizons", type=int, nargs="+", default=[2],
+        help="Risk horizons in years (1-7), default: 2",
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of worker processes, default: number of cores",
+    )
+    parser.add_argument(
+        "--keep", action="append", default=[], metavar="COLUMN",
+        help="Input column to copy to the output, e.g. a patient id (repeatable)",
+    )
+    parser.add_argument("--input-format", choices=["csv", "parquet"])
+    parser.add_argument("--output-format", choices=["csv", "parquet"])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(asctime)s %(message)s")
+    start = time.perf_counter()
+    n_rows = score_file(
+        args.input,
+        args.output,
+        horizons=args.horizons,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        keep_columns=args.keep,
+        input_format=args.input_format,
+        output_format=args.output_format,
+    )
+    elapsed = time.perf_counter() - start
+    logger.info("Scored %s patients in %.1f seconds (%.0f/s)", n_rows, elapsed, n_rows / max(elapsed, 1e-9))
+
+
+if __name__ == "__main__":
+    main()
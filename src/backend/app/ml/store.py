@@ -0,0 +1,288 @@
+"""
+Read-only, memory-mapped model store
+
+`BonoAI.load_models` parses three XGBoost JSON files and unpickles three
+sksurv models, which imports scikit-survival just to read a baseline hazard.
+The store is a single snapshot of everything inference needs instead: the
+boosters (UBJSON), the nodes of every booster as flat arrays, the Cox
+coefficients and baseline survival tables and the feature order. Workers map
+the file read-only, so its pages are held once in the page cache however many
+workers there are, and loading it is an mmap, a checksum and three booster
+deserializations run in parallel.
+
+File layout: magic, format version, header length, SHA-256 of everything
+after the preamble, a JSON header (metadata including the model version, and
+the dtype, shape and offset of every array), then the arrays, each aligned to
+64 bytes.
+
+Build it (from src/backend) with:
+    python -m app.ml.store app/ml/models/bonoai.store
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAGIC = b"BONOAIST"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+# magic, format version, header length, checksum
+_PREAMBLE = struct.Struct("<8sIQ32s")
+
+# Output transformation of the supported objectives, applied to the margin
+TRANSFORMS = {
+    "survival:aft": "exp",
+    "survival:cox": "exp",
+    "reg:squarederror": "identity",
+}
+
+
+def compile_booster(booster):
+    """Flat node arrays of all trees of a booster, and its metadata"""
+    model = json.loads(booster.save_raw(raw_format="json"))
+    learner = model["learner"]
+    objective = learner["objective"]["name"]
+    if objective not in TRANSFORMS:
+        raise ValueError(f"Unsupported objective for the model store: {objective}")
+    transform = TRANSFORMS[objective]
+    base_score = float(learner["learner_model_param"]["base_score"])
+
+    roots, left, right, feature, threshold, default_left = [], [], [], [], [], []
+    depth = 0
+    offset = 0
+    for tree in learner["gradient_booster"]["model"]["trees"]:
+        roots.append(offset)
+        tree_left = np.asarray(tree["left_children"])
+        is_leaf = tree_left == -1
+        nodes = np.arange(offset, offset + len(tree_left))
+        # leaves point to themselves, so every row can take the same number
+        # of steps whatever the depth of its leaf
+        left.append(np.where(is_leaf, nodes, tree_left + offset))
+        right.append(np.where(is_leaf, nodes, np.asarray(tree["right_children"]) + offset))
+        feature.append(tree["split_indices"])
+        # split thresholds and, for leaves, leaf values
+        threshold.append(tree["split_conditions"])
+        default_left.append(tree["default_left"])
+        depth = max(depth, _depth(tree["left_children"], tree["right_children"]))
+        offset += len(tree_left)
+
+    arrays = {
+        "roots": np.asarray(roots, dtype="int32"),
+        "left": np.concatenate(left).astype("int32"),
+        "right": np.concatenate(right).astype("int32"),
+        "feature": np.concatenate(feature).astype("int32"),
+        "threshold": np.concatenate(threshold).astype("float32"),
+        "default_left": np.concatenate(default_left).astype("bool"),
+    }
+    metadata = {
+        "objective": objective,
+        "transform": transform,
+        # the base score is stored on the output scale
+        "base_margin": float(np.log(base_score)) if transform == "exp" else base_score,
+        "depth": depth,
+    }
+    return arrays, metadata
+
+
+def _depth(left, right):
+    depth = 0
+    level = [0]
+    while level:
+        level = [child for node in level for child in (left[node], right[node]) if child != -1]
+        depth += 1 if level else 0
+    return depth
+
+
+def compile_models(bono_ai):
+    """Arrays and metadata of a store for the models of a BonoAI instance"""
+    arrays = {}
+    metadata = {"feature_names": list(bono_ai.feature_names), "models": {}}
+    for fx_type, booster in bono_ai.models["xgb"].items():
+        forest, forest_metadata = compile_booster(booster)
+        for name, array in forest.items():
+            arrays[f"{fx_type}/{name}"] = array
+        arrays[f"{fx_type}/booster"] = np.frombuffer(booster.save_raw(raw_format="ubj"), dtype="uint8")
+
+        coefficients, times, survival = bono_ai.cox_table(fx_type)
+        arrays[f"{fx_type}/cox_coef"] = np.asarray(coefficients, dtype="float64")
+        arrays[f"{fx_type}/baseline_times"] = np.asarray(times, dtype="float64")
+        arrays[f"{fx_type}/baseline_survival"] = np.asarray(survival, dtype="float64")
+        metadata["models"][fx_type] = forest_metadata
+
+    # identifies the models, whatever file they were loaded from
+    digest = hashlib.sha256()
+    for name, array in arrays.items():
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    metadata["model_version"] = digest.hexdigest()[:12]
+    return arrays, metadata
+
+
+def write_store(path, arrays, metadata):
+    """Write arrays and JSON metadata as a store file, atomically replacing `path`"""
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        table[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header = json.dumps({"metadata": metadata, "arrays": table}).encode()
+    start = -(-(_PREAMBLE.size + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    body = bytearray(start - _PREAMBLE.size + offset)
+    body[:len(header)] = header
+    for name, array in arrays.items():
+        position = start - _PREAMBLE.size + table[name]["offset"]
+        body[position:position + array.nbytes] = np.ascontiguousarray(array).tobytes()
+    checksum = hashlib.sha256(body).digest()
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header), checksum))
+        file.write(body)
+    os.replace(temporary, path)
+
+
+class ModelStore:
+    """A store file mapped read-only, its arrays are views into the mapping"""
+
+    def __init__(self, path, verify=True):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _PREAMBLE.size:
+            raise ValueError(f"{path} is not a model store")
+        magic, version, header_length, checksum = _PREAMBLE.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a model store")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has store format {version}, expected {FORMAT_VERSION}")
+        if verify and hashlib.sha256(memoryview(self._mmap)[_PREAMBLE.size:]).digest() != checksum:
+            raise ValueError(f"{path} is corrupt, its checksum doesn't match")
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        start = -(-(_PREAMBLE.size + header_length) // ALIGNMENT) * ALIGNMENT
+
+        self.path = path
+        self.metadata = header["metadata"]
+        self.arrays = {}
+        for name, entry in header["arrays"].items():
+            dtype = np.dtype(entry["dtype"])
+            count = int(np.prod(entry["shape"]))
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=start + entry["offset"]
+            ).reshape(entry["shape"])
+        self._forests = {
+            fx_type: CompiledForest(
+                {name: self.arrays[f"{fx_type}/{name}"] for name in CompiledForest.ARRAYS},
+                **metadata,
+            )
+            for fx_type, metadata in self.metadata["models"].items()
+        }
+
+    @property
+    def feature_names(self):
+        return self.metadata["feature_names"]
+
+    @property
+    def model_version(self):
+        return self.metadata["model_version"]
+
+    def load_boosters(self):
+        """The boosters of all fracture types, deserialized in parallel"""
+        import xgboost as xgb
+
+        def load(fx_type):
+            booster = xgb.Booster()
+            # the deserialization runs in XGBoost without the GIL
+            booster.load_model(bytearray(self.arrays[f"{fx_type}/booster"]))
+            return booster
+
+        fx_types = list(self.metadata["models"])
+        with ThreadPoolExecutor(max_workers=len(fx_types)) as executor:
+            return dict(zip(fx_types, executor.map(load, fx_types)))
+
+    def forest(self, fx_type):
+        return self._forests[fx_type]
+
+    def cox_table(self, fx_type):
+        return (
+            self.arrays[f"{fx_type}/cox_coef"],
+            self.arrays[f"{fx_type}/baseline_times"],
+            self.arrays[f"{fx_type}/baseline_survival"],
+        )
+
+
+class CompiledForest:
+    """
+    Booster predictions from the flat node arrays of a store
+
+    Leaf values are added in tree order in float32 like XGBoost does, so the
+    margins are identical to the booster's, outputs agree to 1 ulp.
+    """
+
+    ARRAYS = ("roots", "left", "right", "feature", "threshold", "default_left")
+
+    def __init__(self, arrays, objective, transform, base_margin, depth):
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.default_left = arrays["default_left"]
+        # children[2 * node] is the left child, children[2 * node + 1] the right
+        self.children = np.stack([arrays["left"], arrays["right"]], axis=1).reshape(-1)
+        self.objective = objective
+        self.transform = transform
+        self.base_margin = np.float32(base_margin)
+        self.depth = depth
+
+    def predict_margin(self, features):
+        """Booster margin for every row of a (n_rows, n_features) matrix"""
+        features = np.ascontiguousarray(features, dtype="float32")
+        n_rows, n_features = features.shape
+        flat = features.reshape(-1)
+        row_offsets = (np.arange(n_rows, dtype="int32") * n_features)[:, np.newaxis]
+
+        # all trees of all rows advance one level per step
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots)))
+        for _ in range(self.depth):
+            values = flat.take(self.feature.take(nodes) + row_offsets)
+            go_right = ~(values < self.threshold.take(nodes))
+            missing = np.isnan(values)
+            if missing.any():
+                # missing values go right unless the node's default is left
+                go_right ^= missing & self.default_left.take(nodes)
+            nodes = self.children.take(2 * nodes + go_right)
+
+        leaves = np.empty((n_rows, len(self.roots) + 1), dtype="float32")
+        leaves[:, 0] = self.base_margin
+        self.threshold.take(nodes, out=leaves[:, 1:])
+        return np.cumsum(leaves, axis=1, dtype="float32")[:, -1]
+
+    def predict(self, features):
+        """Booster output for every row of a (n_rows, n_features) matrix"""
+        margin = self.predict_margin(features)
+        if self.transform == "exp":
+            return np.exp(margin.astype("float64")).astype("float32")
+        return margin
+
+
+def main():
+    from .risk_calculator import BonoAI
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="store file to write")
+    args = parser.parse_args()
+
+    now = time.perf_counter()
+    arrays, metadata = compile_models(BonoAI())
+    write_store(args.path, arrays, metadata)
+    size = os.path.getsize(args.path)
+    print(f"Wrote {args.path} ({size / 1024:.0f} kB) in {time.perf_counter() - now:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
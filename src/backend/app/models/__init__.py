@@ -1,5 +1,28 @@
 """Pydantic models for request/response validation"""
-from .patient import PatientData, RiskRequest, RiskResponse, ShapPlotRequest, ShapPlotResponse
+from .patient import (
+    PatientData,
+    RiskRequest,
+    RiskResponse,
+    ShapPlotRequest,
+    ShapPlotResponse,
+    RiskBatchRequest,
+    ColumnarRiskBatchRequest,
+    RiskBatchResponse,
+    TreatmentComparisonRequest,
+    TreatmentScenario,
+    TreatmentComparisonResponse,
+    SweepAxis,
+    RiskSurfaceRequest,
+    RiskSurfaceResponse,
+)
+from .columnar import (
+    FIELD_RULES,
+    ColumnValidationError,
+    validate_patient_columns,
+    patients_to_columns,
+    read_arrow_stream,
+)
+from .jobs import JobRequest, JobStatus
 
 __all__ = [
     "PatientData",
@@ -7,4 +30,20 @@ __all__ = [
     "RiskResponse",
     "ShapPlotRequest",
     "ShapPlotResponse",
+    "RiskBatchRequest",
+    "ColumnarRiskBatchRequest",
+    "RiskBatchResponse",
+    "TreatmentComparisonRequest",
+    "TreatmentScenario",
+    "TreatmentComparisonResponse",
+    "SweepAxis",
+    "RiskSurfaceRequest",
+    "RiskSurfaceResponse",
+    "FIELD_RULES",
+    "ColumnValidationError",
+    "validate_patient_columns",
+    "patients_to_columns",
+    "read_arrow_stream",
+    "JobRequest",
+    "JobStatus",
 ]
@@ -0,0 +1,218 @@
+"""
+Vectorized validation of column-oriented patient data
+
+Batch requests can send patients as columns (one array per PatientData field)
+instead of one JSON object per patient. The checks here mirror the `Field`
+constraints of PatientData but run once per column with NumPy instead of once
+per value with Pydantic. Validated columns are returned without copying
+whenever their dtype already fits.
+"""
+import typing
+
+import numpy as np
+
+from .patient import PatientData
+
+# Stop collecting errors after this many, a broken file would otherwise produce
+# one error per row
+MAX_ERRORS = 50
+
+
+class ColumnValidationError(ValueError):
+    """Raised with a list of Pydantic-style error dicts"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} validation error(s) in patient columns")
+        self.errors = errors
+
+
+def _field_rules():
+    """Type and bounds of every PatientData field, read from its `Field` definition"""
+    rules = {}
+    for name, field in PatientData.model_fields.items():
+        rule = {
+            "kind": field.annotation,
+            "required": field.is_required(),
+            "default": field.default,
+            "ge": None,
+            "le": None,
+            "choices": None,
+        }
+        if typing.get_origin(field.annotation) is typing.Literal:
+            rule["kind"] = typing.Literal
+            rule["choices"] = list(typing.get_args(field.annotation))
+        for constraint in field.metadata:
+            if hasattr(constraint, "ge"):
+                rule["ge"] = constraint.ge
+            if hasattr(constraint, "le"):
+                rule["le"] = constraint.le
+        rules[name] = rule
+    return rules
+
+
+FIELD_RULES = _field_rules()
+
+
+class _Errors(list):
+    def add(self, name, rows, error_type, msg, values=None):
+        for row in rows[: max(MAX_ERRORS - len(self), 0)]:
+            error = {"type": error_type, "loc": ["columns", name, int(row)], "msg": msg}
+            if values is not None:
+                value = values[row].item()
+                # NaN (a null in the input) is not valid JSON
+                error["input"] = None if value != value else value
+            self.append(error)
+
+
+def _as_array(values):
+    if isinstance(values, np.ndarray):
+        return values
+    array = np.asarray(values)
+    if array.dtype == object:
+        # lists with nulls, keep them as NaN so they fail the checks below
+        try:
+            array = np.asarray(
+                [np.nan if value is None else value for value in values], dtype="float64"
+            )
+        except (TypeError, ValueError):
+            pass
+    return array
+
+
+def _check_number(name, array, rule, errors):
+    if array.dtype == bool or not np.issubdtype(array.dtype, np.number):
+        expected = "an integer" if rule["kind"] is int else "a number"
+        errors.add(name, [0], f"{rule['kind'].__name__}_type", f"Column should contain {expected}")
+        return
+
+    if np.issubdtype(array.dtype, np.floating):
+        invalid = np.flatnonzero(~np.isfinite(array))
+        errors.add(name, invalid, "finite_number", "Input should be a finite number", array)
+        if rule["kind"] is int:
+            fractional = np.flatnonzero(np.isfinite(array) & (array != np.round(array)))
+            errors.add(
+                name, fractional, "int_from_float",
+                "Input should be a valid integer, got a number with a fractional part",
+                array,
+            )
+
+    if rule["ge"] is not None:
+        rows = np.flatnonzero(array < rule["ge"])
+        errors.add(
+            name, rows, "greater_than_equal",
+            f"Input should be greater than or equal to {rule['ge']}", array,
+        )
+    if rule["le"] is not None:
+        rows = np.flatnonzero(array > rule["le"])
+        errors.add(
+            name, rows, "less_than_equal",
+            f"Input should be less than or equal to {rule['le']}", array,
+        )
+
+
+def _check_bool(name, array, errors):
+    if array.dtype == bool:
+        return
+    if np.issubdtype(array.dtype, np.number):
+        rows = np.flatnonzero((array != 0) & (array != 1))
+        errors.add(name, rows, "bool_parsing", "Input should be a valid boolean", array)
+        return
+    errors.add(name, [0], "bool_type", "Column should contain booleans")
+
+
+def validate_patient_columns(columns):
+    """
+    Validate a mapping of PatientData field name -> column of values
+
+    Returns `(columns, n_rows)` with one NumPy array per field (missing optional
+    fields filled with their default) or raises ColumnValidationError.
+    """
+    errors = _Errors()
+
+    # like PatientData, columns that are not patient fields are ignored
+    lengths = {len(values) for name, values in columns.items() if name in FIELD_RULES}
+    if len(lengths) > 1:
+        raise ColumnValidationError([{
+            "type": "value_error",
+            "loc": ["columns"],
+            "msg": f"All columns must have the same length, got {sorted(lengths)}",
+        }])
+    n_rows = lengths.pop() if lengths else 0
+
+    validated = {}
+    for name, rule in FIELD_RULES.items():
+        if name not in columns:
+            if rule["required"]:
+                errors.append({"type": "missing", "loc": ["columns", name], "msg": "Field required"})
+            else:
+                validated[name] = np.full(n_rows, rule["default"])
+            continue
+
+        array = _as_array(columns[name])
+        if array.ndim != 1:
+            errors.append(
+                {"type": "value_error", "loc": ["columns", name], "msg": "Column must be one-dimensional"}
+            )
+            continue
+
+        if rule["kind"] is typing.Literal:
+            rows = np.flatnonzero(~np.isin(array, rule["choices"]))
+            choices = " or ".join(repr(choice) for choice in rule["choices"])
+            errors.add(name, rows, "literal_error", f"Input should be {choices}", array)
+        elif rule["kind"] is bool:
+            _check_bool(name, array, errors)
+        else:
+            _check_number(name, array, rule, errors)
+        validated[name] = array
+
+    if not errors:
+        # mirrors PatientData.validate_recent_fractures
+        recent, previous = validated["recent_fracture"], validated["previous_fracture"]
+        for row in np.flatnonzero(recent > previous)[:MAX_ERRORS]:
+            errors.append({
+                "type": "value_error",
+                "loc": ["columns", "recent_fracture", int(row)],
+                "msg": f"Value error, Recent fractures ({recent[row]}) cannot exceed "
+                       f"previous fractures ({previous[row]})",
+            })
+
+    if errors:
+        raise ColumnValidationError(errors[:MAX_ERRORS])
+    return validated, n_rows
+
+
+def patients_to_columns(patients):
+    """Columns (field name -> NumPy array) of already validated PatientData objects"""
+    return {
+        name: np.array([getattr(patient, name) for patient in patients])
+        for name in PatientData.model_fields
+    }
+
+
+def read_arrow_stream(body):
+    """
+    Read an Arrow IPC stream into a mapping of column name -> NumPy array
+
+    Numeric columns without nulls are returned as zero-copy views into `body`.
+    """
+    import pyarrow as pa
+
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        if column.num_chunks > 1:
+            column = column.combine_chunks()
+        elif column.num_chunks == 1:
+            column = column.chunk(0)
+        else:
+            columns[name] = np.empty(0)
+            continue
+        if column.null_count and not pa.types.is_string(column.type):
+            # nulls become NaN and are reported by the range checks
+            columns[name] = column.cast(pa.float64()).to_numpy(zero_copy_only=False)
+        elif pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            columns[name] = column.to_numpy(zero_copy_only=True)
+        else:
+            # booleans are bit-packed and strings need decoding, both are copied
+            columns[name] = column.to_numpy(zero_copy_only=False)
+    return columns
@@ -0,0 +1,82 @@
+"""
+Pydantic models for the asynchronous cohort scoring job API
+"""
+from typing import Annotated, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+from .patient import PatientData
+
+
+class JobRequest(BaseModel):
+    """Request model for creating a cohort scoring job"""
+
+    horizons: list[Annotated[int, Field(ge=1, le=7)]] = Field(
+        default=[2],
+        min_length=1,
+        description="Time horizons for risk prediction in years (1-7)"
+    )
+    shap: bool = Field(
+        default=False,
+        description="Also compute the SHAP values of every patient for each fracture type"
+    )
+    format: Literal["parquet", "csv"] = Field(
+        default="parquet",
+        description="File format of the job result"
+    )
+    patients: Optional[list[PatientData]] = Field(
+        default=None,
+        description="Patient data, one object per patient"
+    )
+    columns: Optional[dict[str, list]] = Field(
+        default=None,
+        description="Patient data as columns, mapping each PatientData field to one value per patient"
+    )
+
+    @model_validator(mode="after")
+    def validate_patients(self) -> "JobRequest":
+        """Validate that exactly one of patients and columns is given"""
+        if (self.patients is None) == (self.columns is None):
+            raise ValueError("Provide either patients or columns")
+        return self
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "horizons": [2, 5],
+                "shap": False,
+                "format": "parquet",
+                "columns": {
+                    "age": [65, 72],
+                    "height": [165, 158],
+                    "weight": [60, 55],
+                    "tscore_neck": [-2.5, -1.0],
+                    "tscore_total_hip": [-2.0, -0.8],
+                    "tscore_ls": [-1.5, -1.2],
+                    "tbs": [1.2, 1.3],
+                },
+            }
+        }
+    )
+
+
+class JobStatus(BaseModel):
+    """Response model describing a cohort scoring job"""
+
+    id: str = Field(description="Job id")
+    status: Literal["queued", "running", "completed", "failed", "cancelled"] = Field(
+        description="Current state of the job"
+    )
+    progress: float = Field(description="Fraction of patients scored (0-1)")
+    processed: int = Field(description="Number of patients scored")
+    total: int = Field(description="Number of patients in the job")
+    horizons: list[int] = Field(description="Requested horizons in years")
+    shap: bool = Field(description="Whether SHAP values are computed")
+    format: str = Field(description="File format of the result")
+    model_version: Optional[str] = Field(default=None, description="Version of the models scoring the job")
+    error: Optional[str] = Field(default=None, description="Error message of a failed job")
+    created_at: float = Field(description="Creation time (Unix timestamp)")
+    started_at: Optional[float] = Field(default=None, description="Start time (Unix timestamp)")
+    finished_at: Optional[float] = Field(default=None, description="End time (Unix timestamp)")
+
+    # model_version is a field, not pydantic's model_ namespace
+    model_config = ConfigDict(protected_namespaces=())
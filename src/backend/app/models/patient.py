@@ -298,6 +298,9 @@ class RiskResponse(BaseModel):
     message: str = Field(
         description="Status message"
     )
+    modelVersion: str = Field(
+        description="Version of the models that calculated the response"
+    )
     risks: dict[str, float] = Field(
         description="Calculated fracture risks (vertebral, hip, any)"
     )
@@ -306,6 +309,7 @@ class RiskResponse(BaseModel):
         json_schema_extra={
             "example": {
                 "message": "Risk score successfully calculated.",
+                "modelVersion": "eec156ce4e37",
                 "risks": {
                     "vertebral": 2.15,
                     "hip": 1.45,
@@ -348,6 +352,9 @@ class ShapPlotResponse(BaseModel):
     message: str = Field(
         description="Status message"
     )
+    modelVersion: str = Field(
+        description="Version of the models that calculated the response"
+    )
     shap_plot: str = Field(
         description="Base64 encoded PNG image of SHAP waterfall plot"
     )
@@ -356,7 +363,246 @@ class ShapPlotResponse(BaseModel):
         json_schema_extra={
             "example": {
                 "message": "SHAP plot successfully created.",
+                "modelVersion": "eec156ce4e37",
                 "shap_plot": "iVBORw0KGgoAAAANSUhEUgAA..."
             }
         }
     )
+
+
+class RiskBatchRequest(BaseModel):
+    """Request model for batch risk calculation with one object per patient"""
+
+    riskHorizon: int = Field(
+        ge=1,
+        le=7,
+        description="Time horizon for risk prediction in years (1-7)"
+    )
+    patients: list[PatientData] = Field(
+        description="Patient data, one object per patient"
+    )
+
+
+class ColumnarRiskBatchRequest(BaseModel):
+    """Request model for batch risk calculation with one array per patient field"""
+
+    riskHorizon: int = Field(
+        ge=1,
+        le=7,
+        description="Time horizon for risk prediction in years (1-7)"
+    )
+    columns: dict[str, list] = Field(
+        description="Patient data as columns, mapping each PatientData field to one value per patient"
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "riskHorizon": 2,
+                "columns": {
+                    "age": [65, 72],
+                    "height": [165, 158],
+                    "weight": [60, 55],
+                    "tscore_neck": [-2.5, -1.0],
+                    "tscore_total_hip": [-2.0, -0.8],
+                    "tscore_ls": [-1.5, -1.2],
+                    "tbs": [1.2, 1.3],
+                }
+            }
+        }
+    )
+
+
+class RiskBatchResponse(BaseModel):
+    """Response model for batch risk calculation endpoint"""
+
+    message: str = Field(
+        description="Status message"
+    )
+    modelVersion: str = Field(
+        description="Version of the models that calculated the response"
+    )
+    risks: dict[str, list[float]] = Field(
+        description="Calculated fracture risks per fracture type, one value per patient in input order"
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "message": "Risk scores successfully calculated.",
+                "modelVersion": "eec156ce4e37",
+                "risks": {
+                    "vertebral": [2.15, 4.02],
+                    "hip": [1.45, 2.31],
+                    "any": [8.23, 11.7]
+                }
+            }
+        }
+    )
+
+
+class TreatmentComparisonRequest(BaseModel):
+    """Request model for the counterfactual treatment comparison endpoint"""
+
+    riskHorizon: int = Field(
+        ge=1,
+        le=7,
+        description="Time horizon for risk prediction in years (1-7)"
+    )
+    patientData: PatientData = Field(
+        description="Complete patient data, including the current treatment history"
+    )
+    rankBy: Literal["vertebral", "hip", "any"] = Field(
+        default="any",
+        description="Fracture type whose risk is used to rank the scenarios"
+    )
+
+
+class TreatmentScenario(BaseModel):
+    """Risks of one treatment scenario"""
+
+    treatment: Literal["none", "bisphosphonate", "denosumab", "serm", "teriparatide", "hrt"] = Field(
+        description=(
+            "Treatment started in this scenario, 'none' for no current or new treatment "
+            "(prior treatments as entered)"
+        )
+    )
+    risks: dict[str, float] = Field(
+        description="Fracture risks in percent (vertebral, hip, any)"
+    )
+    riskReduction: dict[str, float] = Field(
+        description="Absolute risk reduction in percentage points compared to 'none'"
+    )
+
+
+class TreatmentComparisonResponse(BaseModel):
+    """Response model for the counterfactual treatment comparison endpoint"""
+
+    message: str = Field(
+        description="Status message"
+    )
+    modelVersion: str = Field(
+        description="Version of the models that calculated the response"
+    )
+    scenarios: list[TreatmentScenario] = Field(
+        description="All scenarios, ranked from lowest to highest risk"
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "message": "Treatment comparison successfully calculated.",
+                "modelVersion": "eec156ce4e37",
+                "scenarios": [
+                    {
+                        "treatment": "denosumab",
+                        "risks": {"vertebral": 1.52, "hip": 1.01, "any": 6.12},
+                        "riskReduction": {"vertebral": 0.63, "hip": 0.44, "any": 2.11},
+                    },
+                    {
+                        "treatment": "none",
+                        "risks": {"vertebral": 2.15, "hip": 1.45, "any": 8.23},
+                        "riskReduction": {"vertebral": 0.0, "hip": 0.0, "any": 0.0},
+                    },
+                ]
+            }
+        }
+    )
+
+
+class SweepAxis(BaseModel):
+    """One input varied over an evenly spaced grid"""
+
+    feature: Literal[
+        "age",
+        "height",
+        "weight",
+        "steroid_daily_dosage",
+        "number_of_falls",
+        "previous_fracture",
+        "recent_fracture",
+        "tscore_neck",
+        "tscore_total_hip",
+        "tscore_ls",
+        "tbs",
+    ] = Field(
+        description="Numeric PatientData field to vary"
+    )
+    start: float = Field(
+        description="First grid value"
+    )
+    stop: float = Field(
+        description="Last grid value (inclusive)"
+    )
+    steps: int = Field(
+        ge=2,
+        le=100,
+        default=20,
+        description="Number of grid points (2-100); integer fields keep only distinct whole numbers"
+    )
+
+
+class RiskSurfaceRequest(BaseModel):
+    """Request model for the partial-dependence sweep endpoint"""
+
+    riskHorizon: int = Field(
+        ge=1,
+        le=7,
+        description="Time horizon for risk prediction in years (1-7)"
+    )
+    patientData: PatientData = Field(
+        description="Complete patient data, the swept inputs are replaced by the grid values"
+    )
+    axes: list[SweepAxis] = Field(
+        min_length=1,
+        max_length=2,
+        description="One or two inputs to vary"
+    )
+
+    @field_validator("axes")
+    @classmethod
+    def validate_distinct_axes(cls, v: list[SweepAxis]) -> list[SweepAxis]:
+        """Validate that the two axes vary different inputs"""
+        if len({axis.feature for axis in v}) != len(v):
+            raise ValueError("Each input can only be swept along one axis")
+        return v
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "riskHorizon": 5,
+                "patientData": {
+                    "sex": "female",
+                    "age": 65,
+                    "height": 165,
+                    "weight": 60,
+                    "tscore_neck": -2.5,
+                    "tscore_total_hip": -2.0,
+                    "tscore_ls": -1.5,
+                    "tbs": 1.2,
+                },
+                "axes": [
+                    {"feature": "age", "start": 50, "stop": 90, "steps": 41},
+                    {"feature": "tscore_neck", "start": -4, "stop": 0, "steps": 41},
+                ],
+            }
+        }
+    )
+
+
+class RiskSurfaceResponse(BaseModel):
+    """Response model for the partial-dependence sweep endpoint"""
+
+    message: str = Field(
+        description="Status message"
+    )
+    modelVersion: str = Field(
+        description="Version of the models that calculated the response"
+    )
+    axes: dict[str, list[float]] = Field(
+        description="Grid values of every swept input, in axis order"
+    )
+    risks: dict[str, list] = Field(
+        description="Risk in percent per fracture type, a list over the first axis "
+                    "(of lists over the second axis for two inputs)"
+    )
@@ -0,0 +1,154 @@
+"""
+Pre-forking production server
+
+`uvicorn --workers N` starts N fresh interpreters that each import the whole
+stack and load their own models. This entry point imports the application
+(models, the incremental tree index, SHAP and matplotlib with its colormaps)
+once in a parent process and forks the workers from it, so they share those
+pages copy-on-write. Before forking the heap is frozen (`gc.freeze`): the
+garbage collector would otherwise write to the header of every object it
+scans and copy the shared pages into each worker.
+
+Nothing runs the models in the parent, XGBoost's OpenMP runtime is only
+started in the workers. The parent restarts workers that die and stops them
+on SIGTERM / SIGINT.
+
+Usage (from src/backend):
+    python -m app.serve --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from app.logs import stop_logging
+
+logger = logging.getLogger("app.serve")
+
+# a worker dying sooner than this after its start is restarted after a delay,
+# so a broken deployment doesn't fork in a tight loop
+MIN_WORKER_LIFETIME = 5
+
+
+def preload(freeze=True):
+    """Import the application with its models, return the ASGI app"""
+    # no collections while importing, the freeze below moves everything
+    # allocated so far out of the collector's reach anyway
+    gc.disable()
+    from app.main import app
+    from app.ml.risk_calculator import import_plotting
+
+    # imported on first use otherwise, i.e. once per worker
+    import_plotting()
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
+        logger.info("Froze %s objects before forking", gc.get_freeze_count())
+    return app
+
+
+def bind(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level):
+    """Serve `app` on the inherited socket until SIGTERM / SIGINT"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    # uvicorn's records (and access log) go through the app's logging queue
+    config = uvicorn.Config(app, log_level=log_level, log_config=None, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks the workers and keeps `workers` of them running"""
+
+    def __init__(self, app, sock, workers, log_level):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.children = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                run_worker(self.app, self.sock, self.log_level)
+                status = 0
+            finally:
+                # os._exit skips atexit, which would write the queued records
+                stop_logging()
+                os._exit(status)
+        self.children[pid] = time.monotonic()
+        logger.info("Started worker %s", pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning("Worker %s exited with status %s", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not self.stopping:
+                self.spawn()
+        logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+        help="worker processes (default: $WEB_CONCURRENCY or 1)",
+    )
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument(
+        "--no-gc-freeze", dest="freeze", action="store_false",
+        help="don't freeze the heap before forking (to measure its effect)",
+    )
+    args = parser.parse_args()
+
+    # the inference runtime settings share the cores among the workers
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    app = preload(freeze=args.freeze)
+    sock = bind(args.host, args.port)
+    logger.info("Listening on %s:%s with %s workers", args.host, args.port, args.workers)
+    Supervisor(app, sock, args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
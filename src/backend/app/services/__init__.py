@@ -0,0 +1 @@
+"""Background services: job queue and other in-process runtime components"""
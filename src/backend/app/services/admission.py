@@ -0,0 +1,94 @@
+"""
+Admission control for expensive endpoint classes
+
+Each endpoint class (SHAP plots, bulk scoring) has a limit of requests handled
+at once and a bounded queue in front of it. A request that finds the queue
+full is rejected right away instead of adding to an ever growing latency; the
+middleware turns that into `503 Service Unavailable` with `Retry-After`.
+"""
+import asyncio
+import threading
+from collections import deque
+
+from .metrics import metrics
+
+in_flight_gauge = metrics.gauge(
+    "bonoai_admission_in_flight", "Requests being handled per endpoint class", labels=("endpoint_class",)
+)
+queued_gauge = metrics.gauge(
+    "bonoai_admission_queued", "Requests waiting for admission per endpoint class", labels=("endpoint_class",)
+)
+admitted_total = metrics.counter(
+    "bonoai_admission_admitted_total", "Admitted requests per endpoint class", labels=("endpoint_class",)
+)
+shed_total = metrics.counter(
+    "bonoai_admission_shed_total", "Requests rejected with 503 per endpoint class", labels=("endpoint_class",)
+)
+
+
+class Overloaded(Exception):
+    """Raised when both the concurrency limit and the queue of a class are full"""
+
+
+class ConcurrencyLimiter:
+    """At most `max_concurrency` holders, at most `max_queued` waiting in FIFO order"""
+
+    def __init__(self, name, max_concurrency, max_queued):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        in_flight_gauge.set(self.active, endpoint_class=self.name)
+        queued_gauge.set(len(self._waiters), endpoint_class=self.name)
+
+    async def acquire(self):
+        """Wait for a slot, raises Overloaded if the queue is full"""
+        with self._lock:
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+                self._update_gauges()
+                admitted_total.inc(endpoint_class=self.name)
+                return
+            if len(self._waiters) >= self.max_queued:
+                shed_total.inc(endpoint_class=self.name)
+                raise Overloaded(f"Too many {self.name} requests")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._update_gauges()
+
+        try:
+            # resolved by release(), which hands its slot over
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    self._update_gauges()
+                    raise
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the cancellation
+                self.release()
+            raise
+        admitted_total.inc(endpoint_class=self.name)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                self._update_gauges()
+                waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+                return
+            self.active -= 1
+            self._update_gauges()
+
+    def _hand_over(self, waiter):
+        if waiter.cancelled():
+            # the waiting request is gone, pass the slot on
+            self.release()
+        else:
+            waiter.set_result(None)
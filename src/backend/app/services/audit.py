@@ -0,0 +1,252 @@
+"""
+Asynchronous audit log of every prediction
+
+For clinical traceability every prediction is recorded with a hash of its
+input, the prepared features, the model version, the risks and the latency of
+the request that computed it. Writing on the request path would add file I/O
+to every request, so `record()` only appends references to the arrays the
+request already has to an in-memory queue and returns. A background thread
+turns them into records (hashing the inputs there) and appends them in
+batches, every `flush_interval` seconds or once `batch_size` records are
+queued, to NDJSON or Parquet files in `directory`. A file is closed and the
+next one started after `max_file_bytes` or `rotate_interval` seconds; every
+worker process writes its own files.
+
+Predictions are queued while fewer than `max_queued` records wait, so the
+queue exceeds it by at most one request (a batch larger than `max_queued` is
+still recorded). Beyond that the predictions are not recorded and counted in
+`bonoai_audit_records_total{result="dropped"}` instead of slowing the requests
+down. Background work that can afford to wait (cohort jobs) passes `wait` to
+`record()` and waits for the writer instead. `shutdown()` writes everything queued
+and closes the current file.
+"""
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.logs import request_id_var
+from .metrics import metrics
+from .singleflight import request_key
+
+logger = logging.getLogger(__name__)
+
+FILE_FORMATS = {"ndjson": ".ndjson", "parquet": ".parquet"}
+
+records_total = metrics.counter(
+    "bonoai_audit_records_total", "Predictions handed to the audit log", labels=("result",)
+)
+
+
+class _Entry:
+    """The predictions of one request (or streamed chunk) waiting to be written"""
+
+    def __init__(self, endpoint, model, horizons, columns, features, risks, latency):
+        self.timestamp = time.time()
+        self.request_id = request_id_var.get()
+        self.endpoint = endpoint
+        # the feature names are read from the boosters when writing, off the
+        # request path
+        self.model = model
+        self.horizons = list(horizons)
+        self.columns = columns
+        self.features = features
+        self.risks = risks
+        self.latency = latency
+        self.size = len(features)
+
+    def records(self):
+        timestamp = datetime.datetime.fromtimestamp(self.timestamp, datetime.timezone.utc).isoformat()
+        names = list(self.columns)
+        inputs = [np.asarray(self.columns[name]).tolist() for name in names]
+        feature_names = self.model.feature_names
+        features = np.asarray(self.features, dtype="float64").tolist()
+        risks = {
+            fx_type: np.asarray(values, dtype="float64").reshape(self.size, -1).tolist()
+            for fx_type, values in self.risks.items()
+        }
+        latency_ms = round(self.latency * 1000, 3)
+        for row in range(self.size):
+            yield {
+                "timestamp": timestamp,
+                "endpoint": self.endpoint,
+                "requestId": self.request_id,
+                "modelVersion": self.model.version,
+                # SHA-256 of the canonical JSON of the patient fields
+                "inputHash": request_key(dict(zip(names, (values[row] for values in inputs)))),
+                "features": dict(zip(feature_names, features[row])),
+                "horizons": self.horizons,
+                "risks": {fx_type: values[row] for fx_type, values in risks.items()},
+                "latencyMs": latency_ms,
+            }
+
+
+class AuditLog:
+    """Records predictions in batches on a background thread, `directory=""` disables it"""
+
+    def __init__(
+        self,
+        directory="",
+        file_format="ndjson",
+        max_queued=10000,
+        batch_size=1000,
+        flush_interval=1.0,
+        max_file_bytes=64 * 1024 * 1024,
+        rotate_interval=3600,
+    ):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown audit log format '{file_format}', use one of {list(FILE_FORMATS)}")
+        self.directory = directory
+        self.file_format = file_format
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.rotate_interval = rotate_interval
+        self._entries = collections.deque()
+        self._queued = 0  # records in self._entries
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+        # the file being appended to
+        self._path = None
+        self._opened_at = None
+        self._file = None  # file object (NDJSON) or ParquetWriter
+        metrics.gauge(
+            "bonoai_audit_queued", "Predictions waiting to be written to the audit log",
+            function=lambda: self._queued,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    @property
+    def path(self):
+        """The file currently appended to, None between files"""
+        return self._path
+
+    def record(self, endpoint, model, horizons, columns, features, risks, latency, wait=0):
+        """
+        Queue the predictions of `len(features)` patients without blocking
+
+        `columns` maps every patient field to its values, `features` are the
+        prepared features (n_patients, n_features) and `risks` maps every
+        fracture type to the risk percentages (n_patients, len(horizons)).
+        The arrays are written later and must not be modified. Returns False
+        if `max_queued` records were waiting and the predictions were dropped,
+        with `wait` only if they were still waiting after `wait` seconds.
+        """
+        if not self.enabled:
+            return True
+        entry = _Entry(endpoint, model, horizons, columns, features, risks, latency)
+        with self._lock:
+            if self._queued >= self.max_queued and wait:
+                self._wakeup.set()
+                self._not_full.wait_for(lambda: self._queued < self.max_queued, wait)
+            # a whole request or nothing, also one larger than max_queued
+            if self._queued >= self.max_queued:
+                records_total.inc(entry.size, result="dropped")
+                return False
+            self._entries.append(entry)
+            self._queued += entry.size
+            if self._queued >= self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def _take(self):
+        with self._lock:
+            entries, self._entries = self._entries, collections.deque()
+            self._queued = 0
+            self._not_full.notify_all()
+            return entries
+
+    def flush(self):
+        """Write everything queued, returns the number of records written"""
+        entries = self._take()
+        records = [record for entry in entries for record in entry.records()]
+        if not records:
+            return 0
+        try:
+            self._write(records)
+        except Exception as e:
+            records_total.inc(len(records), result="failed")
+            logger.error("Audit log write to %s failed: %s", self._path, e, exc_info=True)
+            self._close()
+            return 0
+        records_total.inc(len(records), result="written")
+        return len(records)
+
+    def _write(self, records):
+        if self._file is not None and (
+            os.path.getsize(self._path) >= self.max_file_bytes
+            or time.monotonic() - self._opened_at >= self.rotate_interval
+        ):
+            self._close()
+
+        if self.file_format == "parquet":
+            import pyarrow as pa
+
+            table = pa.Table.from_pylist(records)
+            if self._file is not None and not self._file.schema.equals(table.schema):
+                # e.g. a model version with other features
+                self._close()
+            if self._file is None:
+                import pyarrow.parquet as pq
+
+                self._file = pq.ParquetWriter(self._open(), table.schema)
+            self._file.write_table(table)
+        else:
+            if self._file is None:
+                self._file = open(self._open(), "a", encoding="utf-8")
+            self._file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+            self._file.flush()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self._path = os.path.join(
+            self.directory, f"audit-{stamp}-{os.getpid()}{FILE_FORMATS[self.file_format]}"
+        )
+        self._opened_at = time.monotonic()
+        return self._path
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception as e:
+                logger.error("Could not close audit log %s: %s", self._path, e, exc_info=True)
+        self._file = None
+        self._path = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        """Start the background thread writing the queued predictions"""
+        if not self.enabled or self._worker is not None:
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._worker.start()
+
+    def shutdown(self, timeout=10):
+        """Stop the background thread, write what is still queued and close the file"""
+        if self._worker is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._worker.join(timeout=timeout)
+            self._worker = None
+        self.flush()
+        self._close()
@@ -0,0 +1,96 @@
+"""
+Client disconnects and request deadlines
+
+A SHAP plot takes most of a second to render. When the frontend aborts the
+request (the user navigated away) or the client's deadline has passed, nobody
+reads the response; `run_cancellable` cancels the work instead of finishing
+it. Clients set a deadline with the `X-Deadline-Ms` header, the time in
+milliseconds they are willing to wait for the response.
+"""
+import asyncio
+import math
+import time
+
+from starlette.datastructures import Headers
+from starlette.requests import ClientDisconnect
+
+from .metrics import metrics
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+abandoned_total = metrics.counter(
+    "bonoai_requests_abandoned_total",
+    "Requests whose work was cancelled, by reason (disconnect, deadline)",
+    labels=("endpoint", "reason"),
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline of a request passed before its response was ready"""
+
+
+def request_deadline(scope):
+    """
+    Monotonic time by which the response is due, None without a deadline
+
+    Counts from the first call for a request (in the admission middleware,
+    before the request queues) and is kept in the request state for later
+    calls. Raises ValueError for an invalid header value.
+    """
+    state = scope.setdefault("state", {})
+    if "deadline" not in state:
+        value = Headers(scope=scope).get(DEADLINE_HEADER)
+        deadline = None
+        if value is not None:
+            try:
+                milliseconds = float(value)
+            except ValueError:
+                milliseconds = math.nan
+            if not 0 < milliseconds < math.inf:
+                raise ValueError(f"{DEADLINE_HEADER} must be a positive number of milliseconds")
+            deadline = time.monotonic() + milliseconds / 1000
+        state["deadline"] = deadline
+    return state["deadline"]
+
+
+def remaining(deadline):
+    """Seconds left until `deadline`, None without one"""
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+async def _disconnected(request):
+    # once the body is read, receive() returns only when the client is gone
+    # (or the response is complete)
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_cancellable(request, awaitable, deadline=None, endpoint=""):
+    """
+    Await `awaitable`, cancelling it when the client disconnects or the deadline passes
+
+    Raises ClientDisconnect or DeadlineExceeded after the cancellation. The
+    request body must have been read already.
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_disconnected(request))
+    try:
+        done, _ = await asyncio.wait(
+            {task, watcher}, timeout=remaining(deadline), return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+
+    if task in done:
+        return task.result()
+    if watcher in done:
+        abandoned_total.inc(endpoint=endpoint, reason="disconnect")
+        raise ClientDisconnect()
+    abandoned_total.inc(endpoint=endpoint, reason="deadline")
+    raise DeadlineExceeded(f"Deadline of {DEADLINE_HEADER} exceeded")
@@ -0,0 +1,289 @@
+"""
+In-process job queue for long-running cohort scoring
+
+Jobs are queued in memory and processed by a small pool of worker threads, so
+no external broker is needed. Results are spooled chunk by chunk to a local
+file in `JOBS_DIR`. The job status is mirrored to a JSON file next to the
+result, which lets every uvicorn worker on the same host answer status and
+result requests, and cancellation is signalled with a marker file that the
+owning worker checks between chunks.
+
+Finished jobs are kept for `retention` seconds, then their status and result
+files are removed (checked whenever a job is submitted or finishes), or
+earlier with `remove()`.
+
+With an `audit_log`, every scored chunk is recorded like a batch request, under
+the request id of the request that submitted the job. A job waits up to
+AUDIT_WAIT seconds for room in the audit queue instead of dropping records.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.logs import request_id_var
+from app.ml.risk_calculator import FX_TYPES
+from app.ml.score import ChunkWriter, score_features
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("queued", "running")
+
+# seconds a job waits for the audit log writer before a chunk's records are
+# dropped
+AUDIT_WAIT = 30
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has reached its configured depth"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when a cancellation was requested"""
+
+
+class Job:
+    """A queued cohort scoring job and its options"""
+
+    def __init__(self, columns, n_patients, horizons, shap, file_format, model):
+        self.id = uuid.uuid4().hex
+        self.columns = columns
+        self.n_patients = n_patients
+        self.horizons = horizons
+        self.shap = shap
+        self.format = file_format
+        self.model = model
+        # the model is released when the job ends, its version is kept
+        self.model_version = model.version
+        self.request_id = request_id_var.get()
+        self.status = "queued"
+        self.processed = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.processed / self.n_patients if self.n_patients else 1.0,
+            "processed": self.processed,
+            "total": self.n_patients,
+            "horizons": self.horizons,
+            "shap": self.shap,
+            "format": self.format,
+            "model_version": self.model_version,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Queue and worker pool for scoring jobs"""
+
+    def __init__(
+        self, directory, max_concurrency=1, max_queued=16, chunk_size=5000, retention=86400, audit_log=None
+    ):
+        self.directory = directory
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.retention = retention  # seconds, 0 keeps finished jobs
+        self.audit_log = audit_log
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _path(self, job_id, extension):
+        # job ids are generated hex strings, anything else can't be a job
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        return os.path.join(self.directory, f"{job_id}.{extension}")
+
+    def result_path(self, job_id, file_format):
+        return self._path(job_id, file_format)
+
+    def _start_workers(self):
+        with self._lock:
+            if self._workers:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            for index in range(self.max_concurrency):
+                worker = threading.Thread(
+                    target=self._work, name=f"job-worker-{index}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, columns, n_patients, horizons, shap, file_format, model):
+        """Queue a job, raises QueueFullError if too many jobs are waiting"""
+        self._start_workers()
+        self.purge()
+        job = Job(columns, n_patients, horizons, shap, file_format, model)
+        self._jobs[job.id] = job
+        self._save_status(job)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            del self._jobs[job.id]
+            os.remove(self._path(job.id, "json"))
+            raise QueueFullError(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+        logger.info("Job %s queued for %s patients", job.id, n_patients)
+        return job
+
+    def get(self, job_id) -> Optional[dict]:
+        """Status of a job, also for jobs owned by another worker process"""
+        if job_id in self._jobs:
+            return self._jobs[job_id].to_dict()
+        try:
+            with open(self._path(job_id, "json")) as file:
+                return json.load(file)
+        except (KeyError, FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def cancel(self, job_id) -> Optional[dict]:
+        """Request cancellation of a queued or running job"""
+        status = self.get(job_id)
+        if status is None or status["status"] not in ACTIVE_STATES:
+            return status
+        # picked up by the owning worker before its next chunk
+        open(self._path(job_id, "cancel"), "w").close()
+        job = self._jobs.get(job_id)
+        with self._lock:
+            if job is not None and job.status == "queued":
+                self._finish(job, "cancelled")
+        return self.get(job_id)
+
+    def remove(self, job_id) -> Optional[dict]:
+        """Delete a finished job and its files, returns its last status"""
+        status = self.get(job_id)
+        if status is None or status["status"] in ACTIVE_STATES:
+            return status
+        self._jobs.pop(job_id, None)
+        for extension in ("json", status["format"], "cancel"):
+            try:
+                os.remove(self._path(job_id, extension))
+            except FileNotFoundError:
+                pass
+        return status
+
+    def purge(self, now=None):
+        """Remove the jobs finished more than `retention` seconds ago, also those of other processes"""
+        if not self.retention:
+            return
+        cutoff = (now or time.time()) - self.retention
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            status = self.get(name[:-len(".json")])
+            finished_at = None if status is None else status["finished_at"]
+            if finished_at is not None and finished_at < cutoff:
+                self.remove(status["id"])
+                logger.info("Job %s removed after the retention period", status["id"])
+
+    def shutdown(self, timeout=None):
+        """Cancel all active jobs of this process and stop the workers"""
+        for job in list(self._jobs.values()):
+            if job.status in ACTIVE_STATES:
+                self.cancel(job.id)
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+            # the job's log and audit records carry the id of its request
+            token = request_id_var.set(job.request_id)
+            try:
+                self._run(job)
+                self._finish(job, "completed")
+            except JobCancelled:
+                self._finish(job, "cancelled")
+            except Exception as e:
+                logger.error("Job %s failed: %s", job.id, e, exc_info=True)
+                job.error = str(e)
+                self._finish(job, "failed")
+            finally:
+                request_id_var.reset(token)
+            self.purge()
+
+    def _run(self, job):
+        job.started_at = time.time()
+        self._save_status(job)
+
+        # spool to a temporary file, the result only appears once complete
+        result_path = self.result_path(job.id, job.format)
+        partial_path = f"{result_path}.partial"
+        writer = ChunkWriter(partial_path, job.format)
+        try:
+            for start in range(0, job.n_patients, self.chunk_size):
+                if os.path.exists(self._path(job.id, "cancel")):
+                    raise JobCancelled()
+                chunk_start = time.perf_counter()
+                stop = min(start + self.chunk_size, job.n_patients)
+                chunk = {name: values[start:stop] for name, values in job.columns.items()}
+                features = job.model.prepare_matrix(chunk)
+                scores = score_features(job.model, features, job.horizons, job.shap)
+                writer.write(pd.DataFrame(scores))
+                if self.audit_log is not None:
+                    risks = {
+                        fx_type: np.column_stack(
+                            [scores[f"{fx_type}_risk_{horizon}y"] for horizon in job.horizons]
+                        )
+                        for fx_type in FX_TYPES
+                    }
+                    self.audit_log.record(
+                        "jobs", job.model, job.horizons, chunk, features, risks,
+                        time.perf_counter() - chunk_start, wait=AUDIT_WAIT,
+                    )
+                job.processed = stop
+                self._save_status(job)
+        except BaseException:
+            writer.close()
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        writer.close()
+        os.replace(partial_path, result_path)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        # the input is no longer needed, only the status is kept
+        job.columns = None
+        job.model = None
+        self._save_status(job)
+        cancel_path = self._path(job.id, "cancel")
+        if os.path.exists(cancel_path):
+            os.remove(cancel_path)
+        logger.info("Job %s %s after %s patients", job.id, status, job.processed)
+
+    def _save_status(self, job):
+        path = self._path(job.id, "json")
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(job.to_dict(), file)
+        os.replace(temporary_path, path)
@@ -0,0 +1,99 @@
+"""
+Worker lanes for off-loop work of different cost
+
+Risk predictions take well under a millisecond, a SHAP waterfall plot close to
+a second. In one shared thread pool a burst of plots occupies every thread and
+risk predictions wait behind them. Each lane here is a separate, fixed-size
+thread pool, so the explanation lane can be saturated while the risk lane
+still has its own threads free.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import metrics
+from .profiler import endpoint_var, profiler
+
+busy_gauge = metrics.gauge("bonoai_lane_busy", "Busy threads per worker lane", labels=("lane",))
+queued_gauge = metrics.gauge("bonoai_lane_queued", "Tasks waiting per worker lane", labels=("lane",))
+
+
+class Lane:
+    """A named, fixed-size thread pool for one class of work"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._busy = 0
+        self._update_gauges()
+
+    def _get_executor(self):
+        # created on first use, and again after a shutdown (a new lifespan)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=f"lane-{self.name}"
+                )
+            return self._executor
+
+    def _update_gauges(self):
+        busy_gauge.set(self._busy, lane=self.name)
+        queued_gauge.set(self._queued, lane=self.name)
+
+    def _call(self, function, endpoint):
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+            self._update_gauges()
+        if endpoint is not None:
+            profiler.thread_tags[threading.get_ident()] = endpoint
+        try:
+            return function()
+        finally:
+            if endpoint is not None:
+                profiler.thread_tags.pop(threading.get_ident(), None)
+            with self._lock:
+                self._busy -= 1
+                self._update_gauges()
+
+    def submit(self, function, *args, **kwargs):
+        """Queue `function(*args, **kwargs)` in this lane, returns a concurrent.futures.Future"""
+        # like run_in_threadpool, keep context variables (e.g. the request id)
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, function, *args, **kwargs)
+        executor = self._get_executor()
+        with self._lock:
+            self._queued += 1
+            self._update_gauges()
+        # the sampling profiler attributes the lane thread to the request's endpoint
+        endpoint = endpoint_var.get() if profiler.active else None
+        future = executor.submit(self._call, call, endpoint)
+        future.add_done_callback(self._unqueue)
+        return future
+
+    def _unqueue(self, future):
+        # a task cancelled before it started never reaches _call
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+                self._update_gauges()
+
+    async def run(self, function, *args, **kwargs):
+        """Run `function(*args, **kwargs)` in this lane and await its result"""
+        future = self.submit(function, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
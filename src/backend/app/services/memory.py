@@ -0,0 +1,28 @@
+"""
+Memory use of worker processes
+
+The resident set size (RSS) counts pages shared with other processes in full.
+Workers forked from a preloaded parent share most of their pages, so the
+unique set size (USS, pages only this process maps) and the proportional set
+size (PSS, shared pages split between the processes mapping them) show what
+each worker really costs.
+"""
+
+
+def memory_usage(pid="self"):
+    """RSS, PSS and USS of a process in bytes, None where /proc doesn't provide them"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            lines = file.readlines()
+    except OSError:
+        return None
+
+    fields = {}
+    for line in lines[1:]:
+        name, value = line.split(":", 1)
+        fields[name] = int(value.split()[0]) * 1024  # reported in kB
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
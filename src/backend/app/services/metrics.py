@@ -0,0 +1,92 @@
+"""
+In-process metrics in the Prometheus text format
+
+A deliberately small registry (counters and gauges with optional labels)
+instead of a client library dependency. Values are per worker process; the
+`/metrics` endpoint renders them for scraping.
+"""
+import threading
+
+
+class Metric:
+    """A counter or gauge, optionally with labels"""
+
+    def __init__(self, name, help_text, kind, labels=(), function=None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        if self.function is not None:
+            return self.function()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.function is not None:
+            lines.append(f"{self.name} {self.function()}")
+            return lines
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        for key, value in values:
+            label_text = ",".join(f'{name}="{label}"' for name, label in zip(self.labels, key))
+            lines.append(f"{self.name}{{{label_text}}} {value}" if label_text else f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    """Named metrics of this process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, help_text, kind, labels, function=None):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Metric(name, help_text, kind, labels, function)
+                self._metrics[name] = metric
+            elif function is not None:
+                # re-registered by a new owner, e.g. a replaced queue
+                metric.function = function
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(name, help_text, "counter", labels)
+
+    def gauge(self, name, help_text, labels=(), function=None):
+        """A gauge, read from `function()` at render time if given"""
+        return self._register(name, help_text, "gauge", labels, function)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+metrics = Registry()
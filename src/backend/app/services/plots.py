@@ -0,0 +1,87 @@
+"""
+Process pool for rendering SHAP waterfall plots
+
+Rendering a waterfall plot takes most of a SHAP plot request and is pure Python
+(matplotlib layout and Agg drawing), so threads cannot render several plots at
+the same time. Worker processes can: with one worker per fracture type, the
+three plots of a patient take about as long as the slowest one. The workers
+only draw; SHAP values are computed in the API process and sent as arrays.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from app.ml.risk_calculator import import_plotting, render_waterfall
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up():
+    """Runs once in each worker, imports matplotlib and SHAP before the first plot"""
+    import_plotting()
+    return True
+
+
+class PlotPool:
+    """Render waterfall plots in worker processes, or in the threads of `lane` with `workers=0`"""
+
+    def __init__(self, workers=3, lane=None):
+        self.workers = workers
+        self.lane = lane
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the workers in the background, so the first request doesn't wait for them"""
+        if self.workers:
+            self._get_executor()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn instead of fork so workers don't inherit OpenMP state
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                for _ in range(self.workers):
+                    self._executor.submit(_warm_up)
+                logger.info("Started %s plot worker processes", self.workers)
+            return self._executor
+
+    async def render(self, explanation):
+        """
+        Base64 PNG waterfall plot of an explanation from BonoAI.explain
+
+        Cancelling the call drops a plot still waiting for a worker. A plot
+        rendering in a thread also stops at its next checkpoint, a worker
+        process finishes the plot it started.
+        """
+        if not self.workers:
+            cancelled = threading.Event()
+            try:
+                return await self.lane.run(render_waterfall, *explanation, cancelled=cancelled)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        future = self._get_executor().submit(render_waterfall, *explanation)
+        return await asyncio.wrap_future(future)
+
+    def submit(self, explanation):
+        """
+        Start rendering a plot from a thread, returns a concurrent.futures.Future
+
+        For background threads outside the event loop (the SHAP prefetcher), so
+        their plots share the workers or the lane with the requests' plots.
+        """
+        if not self.workers:
+            return self.lane.submit(render_waterfall, *explanation)
+        return self._get_executor().submit(render_waterfall, *explanation)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
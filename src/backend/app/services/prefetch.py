@@ -0,0 +1,207 @@
+"""
+Speculative SHAP precomputation after a risk request
+
+The UI asks for the SHAP plots of a patient right after its risks. After a
+`/api/getRisk/` response the prefetcher queues the explanation (and, by
+default, the plot) of every fracture type for that patient on a background
+thread. A following `/api/getShapPlot/` for the same patient then takes the
+result from a bounded cache, or waits for a computation that already started.
+
+Prefetching is best effort: queued work is dropped while the server is busier
+than `max_load` requests, and work that is still queued when the plot is
+requested is cancelled and done by the request itself. Plots are rendered by
+the `plot_pool` that renders the requests' plots (see app.services.plots), one
+prefetch at a time, so prefetching never holds more than one of its workers. Every entry belongs to
+the model that computed it: a request served by another model version (see
+app.services.registry) doesn't use it.
+"""
+import asyncio
+import hashlib
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional
+
+from app.ml.risk_calculator import FX_TYPES
+from app.models import patients_to_columns
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+scheduled_total = metrics.counter(
+    "bonoai_prefetch_scheduled_total", "SHAP explanations queued for prefetching"
+)
+hits_total = metrics.counter(
+    "bonoai_prefetch_hits_total", "SHAP plot requests answered by a prefetched explanation"
+)
+misses_total = metrics.counter(
+    "bonoai_prefetch_misses_total", "SHAP plot requests without a usable prefetched explanation"
+)
+dropped_total = metrics.counter(
+    "bonoai_prefetch_dropped_total",
+    "Prefetches not computed: queue full, evicted, server under load or taken over by a request",
+    labels=("reason",),
+)
+wasted_total = metrics.counter(
+    "bonoai_prefetch_wasted_total", "Prefetched explanations evicted without being used"
+)
+wasted_seconds_total = metrics.counter(
+    "bonoai_prefetch_wasted_seconds_total", "Time spent computing prefetches that were never used"
+)
+
+
+class _Entry:
+    def __init__(self, model):
+        self.model = model
+        self.future = Future()
+        self.seconds = 0.0
+        self.used = False
+
+
+class ShapPrefetcher:
+    """Background computation of SHAP explanations into a bounded LRU cache"""
+
+    def __init__(self, model=None, enabled=True, render=True, plot_pool=None, max_entries=128,
+                 max_queued=48, max_load=2, load=None):
+        if render and plot_pool is None:
+            raise ValueError("Rendering prefetched plots needs a plot_pool")
+        self.model = model
+        self.enabled = enabled
+        self.render = render
+        self.plot_pool = plot_pool
+        self.max_entries = max_entries
+        self.max_load = max_load
+        self.load = load or (lambda: 0)
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+        metrics.gauge(
+            "bonoai_prefetch_cache_entries", "Prefetched or queued SHAP explanations in the cache",
+            function=lambda: len(self._entries),
+        )
+
+    @staticmethod
+    def key(patient, fx_type):
+        # the plot doesn't depend on the risk horizon, only on the patient
+        return hashlib.sha256(patient.model_dump_json().encode()).hexdigest(), fx_type
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="shap-prefetch", daemon=True)
+                self._worker.start()
+
+    def schedule(self, patient, model=None):
+        """Queue the explanations of all fracture types of a patient"""
+        model = model or self.model
+        self._start_worker()
+        for fx_type in FX_TYPES:
+            key = self.key(patient, fx_type)
+            with self._lock:
+                previous = self._entries.get(key)
+                if previous is not None and previous.model is model:
+                    self._entries.move_to_end(key)
+                    continue
+                if previous is not None:
+                    # computed by a model version that is no longer served
+                    previous.future.cancel()
+                entry = _Entry(model)
+                self._entries[key] = entry
+                self._evict()
+            try:
+                self._queue.put_nowait((key, patient, fx_type, entry))
+            except queue.Full:
+                self._discard(key, entry, "queue_full")
+                continue
+            scheduled_total.inc()
+
+    async def get(self, patient, fx_type, model=None) -> Optional[dict]:
+        """
+        Prefetched `{"explanation": ..., "plot": ...}` of a patient by `model`, or None
+
+        Waits for a prefetch that is already running. A prefetch that is still
+        queued is cancelled, the caller computes the explanation itself.
+        """
+        key = self.key(patient, fx_type)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.model is not (model or self.model):
+            misses_total.inc()
+            return None
+        if entry.future.cancel():
+            self._discard(key, entry, "requested")
+            misses_total.inc()
+            return None
+        try:
+            result = await asyncio.wrap_future(entry.future)
+        except Exception:
+            misses_total.inc()
+            return None
+        entry.used = True
+        hits_total.inc()
+        return result
+
+    def _discard(self, key, entry, reason):
+        entry.future.cancel()
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        dropped_total.inc(reason=reason)
+
+    def _evict(self):
+        # called with the lock held
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            if entry.future.cancel():
+                dropped_total.inc(reason="evicted")
+            elif entry.future.done() and not entry.used:
+                wasted_total.inc()
+                wasted_seconds_total.inc(entry.seconds)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._prefetch(*item)
+            finally:
+                self._queue.task_done()
+
+    def _prefetch(self, key, patient, fx_type, entry):
+        if entry.future.cancelled():
+            return
+        if self.load() > self.max_load:
+            self._discard(key, entry, "load")
+            return
+        if not entry.future.set_running_or_notify_cancel():
+            return
+        start = time.perf_counter()
+        try:
+            features = entry.model.prepare_matrix(patients_to_columns([patient]), dtype="float64")
+            explanation = entry.model.explain(features[0], fx_type)
+            plot = None
+            # requests' plots go first: the plot is skipped (and rendered by the
+            # request) if the server got busy meanwhile. It waits for the plot,
+            # a single prefetch renders at a time.
+            if self.render and self.load() <= self.max_load:
+                plot = self.plot_pool.submit(explanation).result()
+            entry.future.set_result({"explanation": explanation, "plot": plot})
+        except Exception as e:
+            logger.warning("SHAP prefetch for %s failed: %s", fx_type, e)
+            entry.future.set_exception(e)
+        entry.seconds = time.perf_counter() - start
+
+    def join(self):
+        """Wait until all queued prefetches were processed"""
+        self._queue.join()
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout=5)
+            self._worker = None
@@ -0,0 +1,179 @@
+"""
+In-process sampling profiler
+
+py-spy can't be attached to the hosted instances, so a worker can profile
+itself: for `seconds` a background thread reads the Python stacks of all other
+threads of the process (`sys._current_frames()`) every `interval` seconds and
+counts them in the collapsed format of flamegraph.pl and speedscope, one
+`frame;frame;...;frame count` line per distinct stack. Threads waiting (for a
+lock, a queue, the event loop's select) aren't counted unless `idle` is set.
+
+Every stack starts with two tags: the endpoint the thread works for and the
+pipeline stage. The event loop thread's endpoint is the route handler on its
+stack; a lane thread's is the one of the request that queued its task, which
+Lane records while a profile runs. The stage is the innermost model or
+framework step on the stack (validate, prepare, predict, explain, render,
+serialize, audit), or else the thread's name (`lane-risk`, `audit-log`).
+
+When no profile runs nothing is sampled or recorded: lanes check one
+attribute per task. Plots rendered by the plot worker processes aren't seen.
+"""
+import collections
+import contextvars
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+# the path of the request being handled, set by app.middleware.RequestIdMiddleware
+endpoint_var = contextvars.ContextVar("endpoint", default=None)
+
+# innermost frame (module, qualified name) -> pipeline stage
+STAGES = {
+    ("fastapi.routing", "serialize_response"): "serialize",
+    ("fastapi.dependencies.utils", "request_body_to_args"): "validate",
+    ("app.ml.risk_calculator", "BonoAI.prepare_matrix"): "prepare",
+    ("app.ml.risk_calculator", "BonoAI.predict_risks"): "predict",
+    ("app.ml.risk_calculator", "BonoAI.shap_values"): "explain",
+    ("app.ml.risk_calculator", "render_waterfall"): "render",
+    ("app.services.audit", "AuditLog.record"): "audit",
+    ("app.services.audit", "AuditLog._write"): "audit",
+}
+
+# innermost frames of a thread that is waiting, not working
+IDLE_FRAMES = {
+    ("threading", "Condition.wait"),
+    ("threading", "Event.wait"),
+    ("threading", "Thread._wait_for_tstate_lock"),
+    ("queue", "Queue.get"),
+    ("selectors", "EpollSelector.select"),
+    ("selectors", "_PollLikeSelector.select"),
+    ("selectors", "KqueueSelector.select"),
+    ("selectors", "SelectSelector.select"),
+    # uvloop's loop runs in C, its idle thread's innermost frame is asyncio.run's
+    ("asyncio.runners", "Runner.run"),
+    ("concurrent.futures.thread", "_worker"),
+}
+
+# "lane-risk_0" -> "lane-risk", "ThreadPoolExecutor-0_1" -> "ThreadPoolExecutor",
+# "Thread-3 (worker)" -> "Thread"
+_THREAD_NUMBER = re.compile(r"([-_]\d+)+( \(.*\))?$")
+
+
+class ProfileRunning(Exception):
+    """Raised when a profile is requested while another one runs"""
+
+
+class StackSampler:
+    """Samples the stacks of all threads of the process for a while"""
+
+    def __init__(self):
+        self.active = False
+        # thread id -> endpoint of the lane task it runs, while active
+        self.thread_tags = {}
+        self._route_codes = {}  # code of a route handler -> path
+        self._codes = {}  # code -> see _code_info
+        self._lock = threading.Lock()
+
+    def set_routes(self, routes):
+        """Recognize the handlers of `routes` (FastAPI's app.routes) on the stacks"""
+        self._route_codes = {
+            route.endpoint.__code__: route.path
+            for route in routes
+            if hasattr(getattr(route, "endpoint", None), "__code__")
+        }
+
+    def start(self, seconds, interval=0.01, idle=False):
+        """Profile in a background thread, the Future's result is the profile (see `_run`)"""
+        with self._lock:
+            if self.active:
+                raise ProfileRunning("A profile is already running")
+            self.active = True
+        future = Future()
+        threading.Thread(
+            target=self._run, args=(future, seconds, interval, idle), name="profiler", daemon=True
+        ).start()
+        return future
+
+    def _code_info(self, frame):
+        # (collapsed name, stage, whether it means waiting) of the frame's code
+        code = frame.f_code
+        info = self._codes.get(code)
+        if info is None:
+            name = (frame.f_globals.get("__name__", "?"), getattr(code, "co_qualname", code.co_name))
+            info = (f"{name[0]}:{name[1]}", STAGES.get(name), name in IDLE_FRAMES)
+            self._codes[code] = info
+        return info
+
+    def _sample(self, frame, thread_name, endpoint, idle):
+        # (endpoint, stage, codes from the innermost frame), None for an idle thread
+        codes = []
+        stage = None
+        while frame is not None:
+            _, code_stage, waiting = self._code_info(frame)
+            if not codes and waiting and not idle:
+                return None
+            if stage is None:
+                stage = code_stage
+            if endpoint is None:
+                endpoint = self._route_codes.get(frame.f_code)
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        return endpoint or "(none)", stage or thread_name, tuple(codes)
+
+    def _collapse(self, sample):
+        endpoint, stage, codes = sample
+        return ";".join([endpoint, stage, *(self._codes[code][0] for code in reversed(codes))])
+
+    def _run(self, future, seconds, interval, idle):
+        own = threading.get_ident()
+        counts = collections.Counter()
+        n_samples = 0
+        start = time.monotonic()
+        next_sample = start
+        error = None
+        try:
+            while next_sample < start + seconds:
+                thread_names = {
+                    thread.ident: _THREAD_NUMBER.sub("", thread.name) for thread in threading.enumerate()
+                }
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        sample = self._sample(
+                            frame, thread_names.get(ident, "thread"), self.thread_tags.get(ident), idle
+                        )
+                        if sample is not None:
+                            counts[sample] += 1
+                    # don't keep the frames alive while sleeping
+                    del frame
+                n_samples += 1
+                next_sample += interval
+                time.sleep(max(0.0, next_sample - time.monotonic()))
+        except Exception as e:
+            error = e
+        finally:
+            self.thread_tags.clear()
+            self.active = False
+        if error is not None:
+            future.set_exception(error)
+            return
+        # different code objects can have the same name (two lambdas of one
+        # function, a reloaded module): their counts add up
+        stacks = collections.Counter()
+        for sample, count in counts.items():
+            stacks[self._collapse(sample)] += count
+        future.set_result({
+            "seconds": round(time.monotonic() - start, 3),
+            "interval": interval,
+            "samples": n_samples,
+            "stacks": stacks,
+        })
+
+
+def collapsed(stacks):
+    """The stack counts as collapsed-format text, most frequent first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = StackSampler()
@@ -0,0 +1,274 @@
+"""
+Versioned model registry with hot reload
+
+The models used to be a module-level BonoAI built at import, so a new model
+meant a redeploy. The registry serves the newest valid model bundle (a store
+file built with `python -m app.ml.store`, see app.ml.store) of a directory
+and polls it for new bundles on a background thread. A new bundle is loaded
+and checked off the request path: it must score a canned cohort with finite
+risks between 0 and 1 that don't decrease with the horizon, its compiled
+forest must agree with its boosters, its SHAP values must add up to the
+booster margin and, with `max_drift`, its risks may not differ from the active
+version's by more than that many percentage points. The prediction and SHAP
+paths are warmed by the check, registered warmers (e.g. the incremental
+evaluators of the live endpoint) run next, and only then the active version
+is swapped. The version loaded at import is checked by `start()`, in every
+worker before it serves, and replaced by the next valid bundle if it fails.
+
+The swap replaces a single reference. Requests read `registry.model` once and
+keep using that model, so requests in flight finish on the version they
+started with and none are dropped; the old version is released when the last
+of them completes. Removing the newest bundle rolls back to the previous one
+at the next poll, a bundle that failed its checks is retried once its file
+changes.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from app.ml.risk_calculator import FX_TYPES, BonoAI
+from app.ml.store import ModelStore
+from app.models import PatientData, patients_to_columns
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_SUFFIX = ".store"
+
+reloads_total = metrics.counter(
+    "bonoai_model_reloads_total", "Model bundles loaded by the registry", labels=("result",)
+)
+
+# Patients covering the input ranges the models see in practice, more than
+# STORE_MAX_ROWS so the checks run the boosters as well as the compiled forests
+_BASE_PATIENT = {
+    "sex": "female", "age": 65, "height": 165, "weight": 60,
+    "tscore_neck": -2.5, "tscore_total_hip": -2.0, "tscore_ls": -1.5, "tbs": 1.2,
+}
+CANNED_COHORT = [
+    PatientData(**{**_BASE_PATIENT, **changes})
+    for changes in [
+        {},
+        {"age": 52, "tscore_neck": -1.0, "tscore_total_hip": -0.8, "tscore_ls": -1.2},
+        {"age": 58, "weight": 48, "tbs": 1.05},
+        {"age": 71, "previous_fracture": 2, "recent_fracture": 1},
+        {"age": 76, "number_of_falls": 3, "falling_test_abnormal": True, "immobility": True},
+        {"age": 82, "tscore_neck": -3.6, "tscore_total_hip": -3.3, "tscore_ls": -3.9, "tbs": 1.0},
+        {"age": 88, "height": 150, "weight": 42, "previous_fracture": 3, "recent_fracture": 0},
+        {"age": 67, "corticosteroids": True, "steroid_daily_dosage": 10, "rheumatoid_arthritis": True},
+        {"age": 63, "hip_fracture_parents": True, "osteoporotic_fracture_parents": True},
+        {"age": 69, "bisphosphonate_current": True, "previous_fracture": 1},
+        {"age": 74, "denosumab_new": True, "tscore_neck": -3.0},
+        {"age": 61, "aromatase_inhibitors": True, "early_menopause": True},
+        {"age": 79, "teriparatide_current": True, "previous_fracture": 2, "recent_fracture": 2},
+        {"age": 56, "hrt_current": True, "tscore_ls": -2.2},
+        {"age": 72, "sex": "male", "height": 178, "weight": 80, "copd": True, "nicotin": True},
+        {"age": 84, "type_1_diabetes": True, "alcohol": True, "decrease_in_height": True},
+    ]
+]
+
+# Horizons the risks of the cohort are checked at, in months
+CHECK_TIMES = np.arange(12, 85, 12)
+
+
+class BundleRejected(Exception):
+    """Raised when a model bundle fails the checks before activation"""
+
+
+def check_model(model, reference=None, max_drift=0.0):
+    """
+    Run a model on the canned cohort and raise BundleRejected if it fails
+
+    Returns the cohort risks per fracture type (n_patients, n_times), and the
+    largest difference to the `reference` risks in percentage points (None
+    without a reference).
+    """
+    features = model.prepare_matrix(patients_to_columns(CANNED_COHORT))
+    risks = {fx_type: model.predict_risks(features, fx_type, CHECK_TIMES) for fx_type in FX_TYPES}
+    for fx_type in FX_TYPES:
+        fx_risks = risks[fx_type]
+        if not np.all(np.isfinite(fx_risks)) or fx_risks.min() < 0 or fx_risks.max() > 1:
+            raise BundleRejected(f"{fx_type} risks of the canned cohort are not probabilities")
+        if np.any(np.diff(fx_risks, axis=1) < 0):
+            raise BundleRejected(f"{fx_type} risks of the canned cohort decrease with the horizon")
+
+        booster = model.models["xgb"][fx_type]
+        output = booster.inplace_predict(features)
+        if model.store is not None:
+            forest = model.store.forest(fx_type).predict(features)
+            if not np.allclose(forest, output, rtol=1e-6, atol=0):
+                raise BundleRejected(f"{fx_type} compiled forest disagrees with its booster")
+
+        values, base_values = model.shap_values(features, fx_type)
+        margin = booster.inplace_predict(features, predict_type="margin")
+        if not np.allclose(values.sum(axis=1) + base_values, margin, rtol=1e-4, atol=1e-4):
+            raise BundleRejected(f"{fx_type} SHAP values don't add up to the booster margin")
+
+    drift = None
+    if reference is not None:
+        drift = 100 * max(float(np.max(np.abs(risks[fx] - reference[fx]))) for fx in FX_TYPES)
+        if max_drift and drift > max_drift:
+            raise BundleRejected(
+                f"risks of the canned cohort differ by {drift:.2f} percentage points "
+                f"from the active version, more than {max_drift}"
+            )
+    return risks, drift
+
+
+class ModelRegistry:
+    """The active model version and the bundles of a directory that can replace it"""
+
+    def __init__(self, directory="", default=None, interval=30, max_drift=0.0, load=None):
+        self.directory = directory
+        self.interval = interval
+        self.max_drift = max_drift
+        self.activated_at = None
+        self._active = None
+        self._source = None  # (path, mtime, size) of the active bundle
+        self._reference = None  # cohort risks of the active version
+        self._rejected = set()
+        self._warmers = []
+        self._default = default or BonoAI
+        # builds the model of a bundle path, e.g. with the inference runtime settings
+        self._load_bundle = load or (lambda path: BonoAI(store=ModelStore(path)))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
+
+        # the newest bundle that loads, or the default models without a bundle
+        # (e.g. in development). The checks run in verify(), in the worker: they
+        # run the boosters, and XGBoost's OpenMP runtime doesn't survive the
+        # fork of app.serve's workers.
+        for source in self.bundles():
+            try:
+                self._activate(self._load_bundle(source[0]), source)
+                break
+            except Exception as e:
+                self._reject(source, e)
+        if self._active is None:
+            self._activate(self._default(), None)
+
+        metrics.gauge(
+            "bonoai_model_activated_timestamp_seconds", "When the active model version was activated",
+            function=lambda: self.activated_at,
+        )
+
+    @property
+    def model(self):
+        """The active model, read it once per request"""
+        return self._active
+
+    @property
+    def version(self):
+        return self._active.version
+
+    def add_warmer(self, function):
+        """Call `function(model)` for the active and every new version before it is activated"""
+        self._warmers.append(function)
+        function(self._active)
+
+    def bundles(self):
+        """(path, mtime, size) of the bundles in the directory, newest first"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(BUNDLE_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                found.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        return sorted(found, key=lambda source: (source[1], source[0]), reverse=True)
+
+    def verify(self):
+        """Check the active version on the canned cohort, replace it if it fails"""
+        with self._lock:
+            if self._reference is not None:
+                return
+            try:
+                self._reference, _ = check_model(self._active)
+                return
+            except Exception as e:
+                if self._source is None:
+                    raise
+                self._reject(self._source, e)
+        if not self.poll():
+            model = self._default()
+            self._reference, _ = check_model(model)
+            self._activate(model, None)
+
+    def poll(self):
+        """Activate the newest valid bundle if it isn't active, returns whether it swapped"""
+        with self._lock:
+            for source in self.bundles():
+                if source in self._rejected:
+                    continue
+                if source == self._source:
+                    return False
+                try:
+                    return self._load(source)
+                except Exception as e:
+                    self._reject(source, e)
+            return False
+
+    def _reject(self, source, error):
+        logger.warning("Model bundle %s rejected: %s", source[0], error)
+        self._rejected.add(source)
+        reloads_total.inc(result="rejected")
+
+    def _load(self, source):
+        start = time.perf_counter()
+        model = self._load_bundle(source[0])
+        if self._reference is not None and model.version == self._active.version:
+            # the same models in another file
+            self._source = source
+            return False
+
+        risks, drift = check_model(model, self._reference, self.max_drift)
+        for warm in self._warmers:
+            warm(model)
+        self._reference = risks
+        self._activate(model, source)
+        reloads_total.inc(result="activated")
+        if drift is None:
+            logger.info(
+                "Model version %s from %s activated after %.2f seconds",
+                model.version, source[0], time.perf_counter() - start,
+            )
+        else:
+            logger.info(
+                "Model version %s from %s activated after %.2f seconds, "
+                "risks differ by up to %.2f percentage points",
+                model.version, source[0], time.perf_counter() - start, drift,
+            )
+        return True
+
+    def _activate(self, model, source):
+        # a single reference assignment, requests that already read
+        # `self.model` keep their version
+        self._active = model
+        self._source = source
+        self.activated_at = time.time()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Model registry poll failed: %s", e, exc_info=True)
+
+    def start(self):
+        """Check the active version and poll the directory every `interval` seconds"""
+        self.verify()
+        if not self.directory or self._worker is not None:
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+        self._worker.start()
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._stop.set()
+            self._worker.join(timeout=5)
+            self._worker = None
@@ -0,0 +1,76 @@
+"""
+Thread configuration of the inference libraries
+
+XGBoost runs every booster prediction on all cores by default, and OpenBLAS
+(NumPy, SciPy) starts one thread per core. Multiplied by the worker processes
+of app.serve and the threads of the worker lanes this is many more runnable
+threads than cores: they preempt each other and spin in OpenMP / OpenBLAS
+barriers, which shows up as tail latency under load. The inference runtime
+settings (app.config) give every worker process its share of the cores; they
+are applied whenever models are loaded, and the values in effect are logged at
+startup and exported as the `bonoai_inference_runtime` gauge.
+"""
+import json
+import logging
+import os
+
+from threadpoolctl import threadpool_info, threadpool_limits
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# read by OpenBLAS / MKL when they are loaded, i.e. by processes started later
+# such as the spawned plot workers
+BLAS_ENV_VARS = ("OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+runtime_gauge = metrics.gauge(
+    "bonoai_inference_runtime", "Effective inference runtime configuration of this worker",
+    labels=("setting",),
+)
+
+
+def available_cores():
+    """Cores this process may run on (its CPU affinity, e.g. in a container)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def limit_blas_threads(threads):
+    """Limit the BLAS libraries of this process and its future children, 0 keeps their default"""
+    if threads <= 0:
+        return
+    for name in BLAS_ENV_VARS:
+        os.environ[name] = str(threads)
+    threadpool_limits(limits=threads, user_api="blas")
+
+
+def blas_threads():
+    """Threads of the BLAS libraries loaded in this process (the largest pool)"""
+    return max((pool["num_threads"] for pool in threadpool_info() if pool["user_api"] == "blas"), default=0)
+
+
+def booster_threads(booster):
+    """Threads an XGBoost booster predicts with"""
+    config = json.loads(booster.save_config())
+    nthread = int(config["learner"]["generic_param"]["nthread"])
+    # 0 is OpenMP's default: OMP_NUM_THREADS or all cores
+    return nthread if nthread > 0 else int(os.getenv("OMP_NUM_THREADS", available_cores()))
+
+
+def effective_runtime(model, **configured):
+    """The thread counts `model` runs with in this process, and the `configured` sizes"""
+    return {
+        "cpu_count": available_cores(),
+        "xgb_nthread": max(booster_threads(booster) for booster in model.models["xgb"].values()),
+        "blas_threads": blas_threads(),
+        **configured,
+    }
+
+
+def report_runtime(values):
+    """Log the inference runtime and export it as gauges"""
+    for setting, value in values.items():
+        runtime_gauge.set(value, setting=setting)
+    logger.info("Inference runtime: %s", ", ".join(f"{name}={value}" for name, value in values.items()))
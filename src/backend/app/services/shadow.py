@@ -0,0 +1,196 @@
+"""
+Shadow evaluation of a candidate model on live traffic
+
+A retrained model is tried on real requests before it replaces the served
+one. After a `/api/getRisk/` response was sent, a sampled fraction
+(`sample_rate`) of the requests is queued for the candidate model, which
+scores the same patient on a background thread. The candidate's risks are
+compared with the ones the client got: the deltas per fracture type, the rank
+correlation of both over the last `window` samples and the latencies of both,
+each timed from the patient fields to the risks (feature preparation and
+prediction).
+Nothing the candidate computes reaches a client.
+
+The shadow thread may use at most `max_cpu_share` of one core: every
+evaluation is charged the CPU time the thread spent on it, the budget refills
+with wall-clock time, and samples arriving while it is used up are dropped.
+The candidate's boosters are single-threaded, so that CPU time is all it
+costs. Samples are also dropped while more than `max_load` requests are in
+progress or `max_queued` samples wait. (A lower OS priority for the thread
+made request latency worse: descheduled while holding the GIL, it blocks the
+event loop.)
+"""
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from app.ml.risk_calculator import FX_TYPES
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+samples_total = metrics.counter(
+    "bonoai_shadow_samples_total",
+    "getRisk requests sampled for the shadow model: evaluated, or dropped (queue_full, cpu_budget, load, failed)",
+    labels=("result",),
+)
+cpu_seconds_total = metrics.counter(
+    "bonoai_shadow_cpu_seconds_total", "CPU time spent by the shadow model"
+)
+
+
+class ShadowEvaluator:
+    """Scores sampled requests with a candidate model in the background and compares the risks"""
+
+    def __init__(self, candidate=None, sample_rate=0.1, max_cpu_share=0.1, max_queued=64,
+                 max_load=4, load=None, window=1000):
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.max_cpu_share = max_cpu_share
+        self.max_load = max_load
+        self.load = load or (lambda: 0)
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._worker = None
+        # seconds of CPU time the shadow thread may still spend, at most one
+        # second's share so an idle period doesn't allow a long burst
+        self._budget = max_cpu_share
+        self._refilled_at = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.candidate is not None and self.sample_rate > 0
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="shadow-eval", daemon=True)
+                self._worker.start()
+
+    def sample(self):
+        """Whether a request is shadowed, true for `sample_rate` of them"""
+        return self.enabled and random.random() < self.sample_rate
+
+    async def schedule(self, model, columns, risk_horizon, risks, latency):
+        """
+        Queue a served prediction for the candidate without blocking
+
+        `columns` are the patient fields as scored by `model`, `risks` the
+        percentages sent to the client and `latency` the seconds `model` took
+        to prepare the features and predict them (not the whole request). A
+        coroutine, so a background task runs it on the event loop instead of
+        handing it to a thread.
+        """
+        self._start_worker()
+        try:
+            self._queue.put_nowait((model.version, columns, risk_horizon, risks, latency))
+        except queue.Full:
+            samples_total.inc(result="queue_full")
+
+    def _refill(self):
+        now = time.monotonic()
+        self._budget = min(
+            self.max_cpu_share, self._budget + (now - self._refilled_at) * self.max_cpu_share
+        )
+        self._refilled_at = now
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._evaluate(*item)
+            finally:
+                self._queue.task_done()
+
+    def _evaluate(self, served_version, columns, risk_horizon, risks, latency):
+        self._refill()
+        if self._budget <= 0:
+            samples_total.inc(result="cpu_budget")
+            return
+        if self.load() > self.max_load:
+            samples_total.inc(result="load")
+            return
+
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        try:
+            features = self.candidate.prepare_matrix(columns)
+            # rounded like the served risks
+            candidate_risks = {
+                fx_type: round(
+                    float(self.candidate.predict_risks(features, fx_type, [risk_horizon * 12])[0, 0]) * 100, 2
+                )
+                for fx_type in FX_TYPES
+            }
+        except Exception as e:
+            logger.warning("Shadow evaluation failed: %s", e)
+            samples_total.inc(result="failed")
+            return
+        finally:
+            cpu = time.thread_time() - cpu_start
+            self._budget -= cpu
+            cpu_seconds_total.inc(cpu)
+
+        samples_total.inc(result="evaluated")
+        with self._lock:
+            self._samples.append({
+                "served_version": served_version,
+                "served": risks,
+                "candidate": candidate_risks,
+                "served_latency": latency,
+                "candidate_latency": time.perf_counter() - start,
+            })
+
+    def report(self):
+        """Comparison of the candidate with the served risks over the recent samples"""
+        with self._lock:
+            samples = list(self._samples)
+        report = {
+            "enabled": self.enabled,
+            "candidateVersion": None if self.candidate is None else self.candidate.version,
+            "sampleRate": self.sample_rate,
+            "maxCpuShare": self.max_cpu_share,
+            "samples": len(samples),
+            "servedVersions": sorted({sample["served_version"] for sample in samples}),
+            "cpuSeconds": round(cpu_seconds_total.value(), 4),
+            "risks": {},
+            "latencyMs": {},
+        }
+        if not samples:
+            return report
+
+        for fx_type in FX_TYPES:
+            served = np.array([sample["served"][fx_type] for sample in samples])
+            candidate = np.array([sample["candidate"][fx_type] for sample in samples])
+            delta = candidate - served
+            # undefined for fewer than two samples or constant risks
+            correlation = pd.Series(served).corr(pd.Series(candidate), method="spearman")
+            report["risks"][fx_type] = {
+                "meanDelta": round(float(delta.mean()), 4),
+                "meanAbsDelta": round(float(np.abs(delta).mean()), 4),
+                "maxAbsDelta": round(float(np.abs(delta).max()), 4),
+                "rankCorrelation": None if np.isnan(correlation) else round(float(correlation), 4),
+            }
+        for name, key in (("served", "served_latency"), ("candidate", "candidate_latency")):
+            p50, p99 = np.percentile([sample[key] for sample in samples], [50, 99]) * 1000
+            report["latencyMs"][name] = {"p50": round(float(p50), 3), "p99": round(float(p99), 3)}
+        return report
+
+    def join(self):
+        """Wait until all queued samples were processed"""
+        self._queue.join()
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout=5)
+            self._worker = None
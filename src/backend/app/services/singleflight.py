@@ -0,0 +1,82 @@
+"""
+Single-flight deduplication of identical concurrent computations
+
+Double clicks, React strict-mode double effects and retries send identical
+requests at the same time. The first caller of a key starts the computation as
+a separate task, and callers arriving while it runs await the same task
+instead of repeating the work. Results are not cached: once the computation
+finished, the next caller of the key starts a new one.
+
+A caller that is cancelled (e.g. its client disconnected) does not cancel the
+shared computation while other callers still wait for it. Only when the last
+waiting caller is gone is the computation cancelled, and it is removed first,
+so a later caller never receives a cancelled result.
+"""
+import asyncio
+import hashlib
+import json
+
+from .metrics import metrics
+
+computations_total = metrics.counter(
+    "bonoai_singleflight_computations_total",
+    "Computations started by the first caller of a key",
+    labels=("endpoint",),
+)
+shared_total = metrics.counter(
+    "bonoai_singleflight_shared_total",
+    "Callers that awaited an identical computation already in flight (computations saved)",
+    labels=("endpoint",),
+)
+
+
+def request_key(*parts) -> str:
+    """Canonical hash of JSON-serializable request parts"""
+    text = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Share one in-flight computation among concurrent callers of the same key"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    def in_flight(self):
+        return len(self._calls)
+
+    async def do(self, key, function, *args):
+        """Result of `await function(*args)`, computed once for concurrent callers"""
+        # a task can only be awaited on its own event loop
+        key = (asyncio.get_running_loop(), key)
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(function(*args)))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            computations_total.inc(endpoint=self.name)
+        else:
+            shared_total.inc(endpoint=self.name)
+
+        call.waiters += 1
+        try:
+            # shielded, so a cancelled caller leaves the task running for the others
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,68 @@
+"""
+Warm-up of the request paths before a worker reports ready
+
+The first SHAP plot of a fresh worker takes several times as long as later
+ones: SHAP and matplotlib are imported, the font cache is loaded and the
+first Agg renderer is created. The first risk request starts the lane
+threads. The warm-up runs representative requests (steps) once at startup;
+`/ready` answers 503 until they completed, so a load balancer health check
+on it routes traffic only to warm workers while `/health` reports liveness.
+"""
+import logging
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Runs named warm-up steps once and records how long each took"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.status = "pending" if enabled else "skipped"
+        self.steps = {}  # step name -> seconds
+        self.seconds = None
+        self.error = None
+        metrics.gauge(
+            "bonoai_ready", "1 once the warm-up of this worker completed",
+            function=lambda: int(self.ready),
+        )
+        metrics.gauge(
+            "bonoai_warmup_seconds", "Duration of the warm-up of this worker",
+            function=lambda: self.seconds or 0,
+        )
+
+    @property
+    def ready(self):
+        return self.status in ("ready", "skipped")
+
+    async def run(self, steps):
+        """Await every `(name, step)` of `steps` in order, `step()` returns an awaitable"""
+        if not self.enabled:
+            return
+        self.status = "running"
+        start = time.perf_counter()
+        try:
+            for name, step in steps:
+                step_start = time.perf_counter()
+                await step()
+                self.steps[name] = round(time.perf_counter() - step_start, 4)
+        except Exception as e:
+            self.status = "failed"
+            self.error = f"{name}: {str(e)}"
+            logger.error("Warm-up step %s failed: %s", name, e, exc_info=True)
+            return
+        finally:
+            self.seconds = round(time.perf_counter() - start, 4)
+        self.status = "ready"
+        logger.info("Warm-up completed in %.2f seconds: %s", self.seconds, self.steps)
+
+    def report(self):
+        return {
+            "status": self.status,
+            "seconds": self.seconds,
+            "steps": dict(self.steps),
+            "error": self.error,
+        }
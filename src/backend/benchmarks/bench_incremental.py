@@ -0,0 +1,82 @@
+"""
+Benchmark of incremental re-scoring on single-field edits
+
+Simulates a form session: one patient is scored, then one field at a time is
+changed and the patient re-scored. Compares the booster's own single-row
+prediction, a full walk of all trees and the incremental evaluator, for every
+fracture type model.
+
+Usage (from src/backend):
+    python -m benchmarks.bench_incremental --edits 2000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.ml.incremental import IncrementalEvaluator
+from app.ml.risk_calculator import FX_TYPES, BonoAI
+
+PATIENT = {
+    "age": 65, "sex": "female", "height": 165, "weight": 60, "tscore_neck": -2.5,
+    "tscore_total_hip": -2.0, "tscore_ls": -2.8, "tbs": 1.2, "recent_fracture": 0,
+    "previous_fracture": 0, "number_of_falls": 0,
+}
+
+# single-field edits a clinician typically makes, cycled through
+EDITS = [
+    ("age", [58, 63, 71, 77, 84]),
+    ("weight", [52, 58, 67, 74]),
+    ("tscore_neck", [-3.2, -2.8, -1.9, -1.1]),
+    ("tscore_ls", [-3.5, -2.2, -1.4]),
+    ("number_of_falls", [0, 1, 3]),
+    ("denosumab_current", [True, False]),
+]
+
+
+def edited_vectors(model, n_edits):
+    from app.models import PatientData
+
+    patient = PatientData(**PATIENT).model_dump()
+    vectors = []
+    for step in range(n_edits):
+        name, values = EDITS[step % len(EDITS)]
+        patient[name] = values[(step // len(EDITS)) % len(values)]
+        vectors.append(model.prepare_matrix({key: [value] for key, value in patient.items()})[0])
+    return vectors
+
+
+def measure(function, vectors):
+    start = time.perf_counter()
+    for features in vectors:
+        function(features)
+    return (time.perf_counter() - start) / len(vectors) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--edits", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    model = BonoAI()
+    vectors = edited_vectors(model, args.edits)
+
+    print(f"{'model':<10} {'trees':>5} {'xgboost':>12} {'full walk':>12} {'incremental':>12} {'trees/edit':>11}")
+    for fx_type in FX_TYPES:
+        booster = model.models["xgb"][fx_type]
+        evaluator = IncrementalEvaluator(booster)
+        evaluator.predict("session", vectors[0])
+        evaluator.trees_walked = 0
+
+        xgboost = measure(lambda features: booster.inplace_predict(features[np.newaxis]), vectors)
+        full = measure(evaluator.index.predict, vectors)
+        incremental = measure(lambda features: evaluator.predict("session", features), vectors)
+
+        print(
+            f"{fx_type:<10} {len(evaluator.index.trees):>5} {xgboost:>9.1f} us {full:>9.1f} us "
+            f"{incremental:>9.1f} us {evaluator.trees_walked / len(vectors):>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark of per-worker memory: uvicorn --workers vs. the preloading server
+
+Starts the API with `uvicorn --workers N` and with `python -m app.serve
+--workers N` (with and without the GC freeze), sends every server the same
+requests (risk predictions and SHAP plots) and reports the RSS, PSS and unique
+memory (USS) of each worker process.
+
+Usage (from src/backend):
+    python -m benchmarks.bench_memory --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from app.services.memory import memory_usage
+
+PATIENT = {
+    "age": 65, "sex": "female", "height": 165, "weight": 60, "tscore_neck": -2.5,
+    "tscore_total_hip": -2.0, "tscore_ls": -2.8, "tbs": 1.2, "recent_fracture": 0,
+    "previous_fracture": 0, "number_of_falls": 0,
+}
+
+SERVERS = {
+    "uvicorn --workers": ["-m", "uvicorn", "app.main:app", "--log-level", "warning"],
+    "app.serve, no freeze": ["-m", "app.serve", "--log-level", "warning", "--no-gc-freeze"],
+    "app.serve": ["-m", "app.serve", "--log-level", "warning"],
+}
+
+
+def post(port, path, body):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}", data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.read()
+
+
+def wait_until_up(port, timeout=120):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                stat = file.read()
+            with open(f"/proc/{entry}/cmdline") as file:
+                cmdline = file.read()
+        except OSError:
+            continue
+        # the parent pid follows the parenthesised command name
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid and "resource_tracker" not in cmdline:
+            found.append(int(entry))
+    return sorted(found)
+
+
+def measure(arguments, workers, port, requests):
+    env = {**os.environ, "PLOT_WORKERS": "0", "PREFETCH_ENABLED": "false"}
+    server = subprocess.Popen(
+        [sys.executable, *arguments, "--port", str(port), "--workers", str(workers)], env=env,
+    )
+    try:
+        wait_until_up(port)
+        # every worker should see some traffic, connections are spread by the kernel
+        for i in range(requests):
+            patient = {**PATIENT, "age": 50 + i % 40}
+            post(port, "/api/getRisk/", {"riskHorizon": 5, "patientData": patient})
+            if i % 10 == 0:
+                post(port, "/api/getShapPlot/", {"riskHorizon": 5, "patientData": patient, "fxType": "hip"})
+        time.sleep(1)
+        parent = memory_usage(server.pid)
+        return parent, [memory_usage(pid) for pid in children(server.pid)]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="getRisk requests per server")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    mb = 1024 * 1024
+    for name, arguments in SERVERS.items():
+        parent, workers = measure(arguments, args.workers, args.port, args.requests)
+        print(f"\n{name} ({len(workers)} workers)")
+        print(f"{'process':<10} {'RSS':>8} {'PSS':>8} {'USS':>8}")
+        print(f"{'parent':<10} {parent['rss'] / mb:6.0f}MB {parent['pss'] / mb:6.0f}MB {parent['uss'] / mb:6.0f}MB")
+        for index, usage in enumerate(workers):
+            print(f"{f'worker {index}':<10} {usage['rss'] / mb:6.0f}MB {usage['pss'] / mb:6.0f}MB {usage['uss'] / mb:6.0f}MB")
+        total = parent["pss"] + sum(usage["pss"] for usage in workers)
+        print(f"total PSS {total / mb:.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
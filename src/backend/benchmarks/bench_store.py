@@ -0,0 +1,99 @@
+"""
+Benchmark of loading the model snapshot vs. the JSON boosters and pickles
+
+Model loading: each variant runs in a fresh interpreter that has already
+imported NumPy and XGBoost, and reports the time to construct BonoAI, the
+unique memory (USS) it adds and whether scikit-survival was imported.
+
+Cold start: starts `uvicorn app.main:app` and measures the time from process
+start until the first /api/getRisk/ request is answered.
+
+Usage (from src/backend):
+    python -m app.ml.store /tmp/bonoai.store
+    python -m benchmarks.bench_store /tmp/bonoai.store
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+VARIANT = """
+import json, sys, time
+import numpy, xgboost
+from app.services.memory import memory_usage
+from app.ml.risk_calculator import BonoAI
+from app.ml.store import ModelStore
+
+path = sys.argv[1]
+before = memory_usage()["uss"]
+start = time.perf_counter()
+model = BonoAI(store=ModelStore(path) if path else None)
+seconds = time.perf_counter() - start
+model.predict_risks(numpy.zeros((1, len(model.feature_names))), "hip", [24])
+modules = sum(name.startswith("sksurv") for name in sys.modules)
+print(json.dumps({"seconds": seconds, "uss": memory_usage()["uss"] - before, "modules": modules}))
+"""
+
+REQUEST = json.dumps({
+    "riskHorizon": 5,
+    "patientData": {
+        "age": 65, "sex": "female", "height": 165, "weight": 60, "tscore_neck": -2.5,
+        "tscore_total_hip": -2.0, "tscore_ls": -2.8, "tbs": 1.2, "recent_fracture": 0,
+        "previous_fracture": 0, "number_of_falls": 0,
+    },
+}).encode()
+
+
+def load_models(path):
+    result = subprocess.run(
+        [sys.executable, "-c", VARIANT, path], capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def cold_start(path, port):
+    env = {**os.environ, "MODEL_STORE": path, "PLOT_WORKERS": "0", "LOG_LEVEL": "WARNING"}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{port}/api/getRisk/", data=REQUEST,
+                headers={"Content-Type": "application/json"},
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).read()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("store", help="store file built with python -m app.ml.store")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    variants = (("JSON + pickle", ""), ("snapshot", args.store))
+    print(f"{'models from':<16} {'BonoAI()':>10} {'added USS':>10} {'sksurv':>7} {'first request':>14}")
+    for name, path in variants:
+        best = min((load_models(path) for _ in range(args.repeat)), key=lambda result: result["seconds"])
+        first_request = min(cold_start(path, args.port) for _ in range(args.repeat))
+        print(
+            f"{name:<16} {best['seconds'] * 1000:8.1f}ms {best['uss'] / 2**20:8.1f}MB "
+            f"{'yes' if best['modules'] else 'no':>7} {first_request:12.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark of the inference runtime thread settings under multi-worker serving
+
+Starts `python -m app.serve --workers N` once per thread configuration
+(XGB_NTHREAD, BLAS_THREADS), waits for /ready and runs concurrent clients
+against it: single-patient /api/getRisk/ requests and /api/getRiskBatch/
+requests large enough to run the boosters. Reports the throughput and latency
+percentiles of both, and the values the workers export as
+`bonoai_inference_runtime`.
+
+The configurations: the library defaults (every booster and BLAS call on all
+cores, 0 for both settings), the default settings (cores / workers booster
+threads, one BLAS thread) and everything single-threaded. The difference
+shows on machines with several cores; on a single core all three are the same.
+
+Usage (from src/backend):
+    python -m benchmarks.bench_threads --workers 2 --duration 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from benchmarks.bench_memory import PATIENT
+
+CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def configurations(workers):
+    return {
+        "library defaults": {"XGB_NTHREAD": "0", "BLAS_THREADS": "0"},
+        "cores / workers": {"XGB_NTHREAD": str(max(1, CORES // workers)), "BLAS_THREADS": "1"},
+        "single-threaded": {"XGB_NTHREAD": "1", "BLAS_THREADS": "1"},
+    }
+
+
+def post(port, path, body):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}", data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return response.read()
+
+
+def wait_until_ready(port, timeout=180):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def runtime_gauges(port):
+    text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5).read().decode()
+    values = {}
+    for line in text.splitlines():
+        if line.startswith("bonoai_inference_runtime{"):
+            setting = line.split('"')[1]
+            values[setting] = int(float(line.rsplit(" ", 1)[1]))
+    return values
+
+
+def client(port, path, body, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        post(port, path, body)
+        latencies.append(time.perf_counter() - start)
+
+
+def measure(env, args):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--log-level", "warning",
+         "--port", str(args.port), "--workers", str(args.workers)],
+        env={**os.environ, "WARMUP_SHAP": "false", "PREFETCH_ENABLED": "false", **env},
+    )
+    try:
+        wait_until_ready(args.port)
+        runtime = runtime_gauges(args.port)
+        single = {"riskHorizon": 5, "patientData": PATIENT}
+        batch = {
+            "riskHorizon": 5,
+            "patients": [{**PATIENT, "age": 50 + i % 40, "weight": 45 + i % 30} for i in range(args.batch_size)],
+        }
+        stop = threading.Event()
+        latencies = {"getRisk": [], "getRiskBatch": []}
+        threads = [
+            threading.Thread(target=client, args=(args.port, "/api/getRisk/", single, stop, latencies["getRisk"]))
+            for _ in range(args.risk_clients)
+        ] + [
+            threading.Thread(
+                target=client, args=(args.port, "/api/getRiskBatch/", batch, stop, latencies["getRiskBatch"])
+            )
+            for _ in range(args.batch_clients)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return runtime, latencies
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per configuration")
+    parser.add_argument("--risk-clients", type=int, default=8)
+    parser.add_argument("--batch-clients", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=256, help="patients per getRiskBatch request")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    print(f"{CORES} cores, {args.workers} workers, {args.risk_clients} getRisk and "
+          f"{args.batch_clients} getRiskBatch clients ({args.batch_size} patients) for {args.duration:.0f}s")
+    for name, env in configurations(args.workers).items():
+        runtime, latencies = measure(env, args)
+        print(f"\n{name}: xgb_nthread={runtime.get('xgb_nthread')}, blas_threads={runtime.get('blas_threads')}")
+        print(f"{'endpoint':<14} {'req/s':>8} {'p50':>9} {'p99':>9}")
+        for endpoint, values in latencies.items():
+            if not values:
+                continue
+            p50, p99 = np.percentile(values, [50, 99]) * 1000
+            print(f"{endpoint:<14} {len(values) / args.duration:8.1f} {p50:7.1f}ms {p99:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
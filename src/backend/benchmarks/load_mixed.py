@@ -0,0 +1,110 @@
+"""
+Load test of getRisk latency under a mixed workload
+
+Probes /api/getRisk/ at a steady rate, first alone and then while a number of
+clients keep requesting SHAP plots back to back. With the default worker
+lanes SHAP traffic saturates the explanation lane only; `--shared` runs both
+through one pool of the same total size for comparison. SHAP admission limits
+are lifted, so only the lanes separate the two kinds of work.
+
+The app runs in-process (httpx with the ASGI transport), plots are rendered in
+threads (PLOT_WORKERS=0).
+
+Usage (from src/backend):
+    python -m benchmarks.load_mixed --probes 200 --shap-clients 6
+    python -m benchmarks.load_mixed --probes 200 --shap-clients 6 --shared
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+import numpy as np
+
+from app.api import endpoints
+from app.main import app, shap_limiter
+from app.services.lanes import Lane
+
+PATIENT = {
+    "age": 65, "sex": "female", "height": 165, "weight": 60, "tscore_neck": -2.5,
+    "tscore_total_hip": -2.0, "tscore_ls": -2.8, "tbs": 1.2, "recent_fracture": 0,
+    "previous_fracture": 0, "number_of_falls": 0,
+}
+
+
+async def probe_risk(client, probes, interval):
+    latencies = []
+    for i in range(probes):
+        # distinct patients, so single-flight doesn't share results
+        request = {"riskHorizon": 5, "patientData": {**PATIENT, "age": 50 + i % 50}}
+        start = time.perf_counter()
+        response = await client.post("/api/getRisk/", json=request)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+        await asyncio.sleep(interval)
+    return np.array(latencies) * 1000
+
+
+async def flood_shap(client, stop, client_id):
+    plots = 0
+    while not stop.is_set():
+        request = {
+            "riskHorizon": 5,
+            "patientData": {**PATIENT, "weight": 50 + client_id, "age": 50 + plots % 50},
+            "fxType": "hip",
+        }
+        response = await client.post("/api/getShapPlot/", json=request)
+        assert response.status_code == 200, response.text
+        plots += 1
+    return plots
+
+
+async def run(probes, interval, shap_clients):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        # warm up the models and the plotting code
+        await probe_risk(client, 5, 0)
+        await client.post("/api/getShapPlot/", json={"riskHorizon": 5, "patientData": PATIENT, "fxType": "hip"})
+
+        alone = await probe_risk(client, probes, interval)
+
+        stop = asyncio.Event()
+        flood = [asyncio.ensure_future(flood_shap(client, stop, i)) for i in range(shap_clients)]
+        await asyncio.sleep(1)
+        start = time.perf_counter()
+        mixed = await probe_risk(client, probes, interval)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        plots = sum(await asyncio.gather(*flood))
+    return alone, mixed, plots / (elapsed + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--probes", type=int, default=200, help="getRisk requests per phase")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between getRisk requests")
+    parser.add_argument("--shap-clients", type=int, default=6, help="concurrent SHAP plot clients")
+    parser.add_argument("--shared", action="store_true", help="one pool for risk and SHAP work")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    endpoints.plot_pool.workers = 0
+    shap_limiter.max_concurrency = args.shap_clients
+    if args.shared:
+        shared = Lane("shared", endpoints.risk_lane.workers + endpoints.explain_lane.workers)
+        endpoints.risk_lane = shared
+        endpoints.plot_pool.lane = shared
+
+    alone, mixed, plot_rate = asyncio.run(run(args.probes, args.interval, args.shap_clients))
+
+    print(f"pools: {'shared' if args.shared else 'lanes'}, {args.shap_clients} SHAP clients")
+    print(f"{'getRisk':<14} {'p50':>9} {'p99':>9} {'max':>9}")
+    for name, latencies in (("alone", alone), ("with SHAP", mixed)):
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{name:<14} {p50:7.1f}ms {p99:7.1f}ms {latencies.max():7.1f}ms")
+    print(f"SHAP plots/s during the mixed phase: {plot_rate:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,7 @@ echo "Installing dependencies..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+echo "Building model store..."
+python -m app.ml.store app/ml/models/bonoai.store
+
 echo "Build completed successfully!"
@@ -0,0 +1,94 @@
+"""
+Tests for admission control (app.services.admission, AdmissionMiddleware)
+"""
+import asyncio
+
+import pytest
+
+from app.services.admission import ConcurrencyLimiter, Overloaded, shed_total
+from tests.test_api import VALID_PATIENT_DATA
+
+
+class TestConcurrencyLimiter:
+    """Tests for ConcurrencyLimiter"""
+
+    def test_queue_then_shed(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queued=1)
+            await limiter.acquire()
+            queued = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            assert len(limiter._waiters) == 1
+
+            with pytest.raises(Overloaded):
+                await limiter.acquire()
+
+            # the slot is handed to the queued request
+            limiter.release()
+            await queued
+            assert limiter.active == 1
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queued=2)
+            await limiter.acquire()
+            first = asyncio.create_task(limiter.acquire())
+            second = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+
+            first.cancel()
+            await asyncio.sleep(0)
+            assert len(limiter._waiters) == 1
+
+            limiter.release()
+            await second
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+    def test_slot_of_cancelled_handover_is_passed_on(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queued=2)
+            await limiter.acquire()
+            first = asyncio.create_task(limiter.acquire())
+            second = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+
+            # cancelled after release() picked it, before it resumed
+            limiter.release()
+            first.cancel()
+            await second
+            assert limiter.active == 1
+            limiter.release()
+            assert limiter.active == 0
+
+        asyncio.run(scenario())
+
+
+def test_overloaded_shap_requests_are_shed(monkeypatch):
+    """Beyond the limits SHAP requests get 503, getRisk and /health still work"""
+    from fastapi.testclient import TestClient
+
+    from app.config import settings
+    from app.main import app, shap_limiter
+
+    monkeypatch.setattr(shap_limiter, "max_concurrency", 0)
+    monkeypatch.setattr(shap_limiter, "max_queued", 0)
+    client = TestClient(app)
+    shed = shed_total.value(endpoint_class="shap")
+    request = {"riskHorizon": 2, "patientData": VALID_PATIENT_DATA}
+
+    response = client.post("/api/getShapPlot/", json={**request, "fxType": "hip"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(settings.ADMISSION_RETRY_AFTER)
+    assert client.post("/api/getRiskExplained/", json=request).status_code == 503
+    assert shed_total.value(endpoint_class="shap") == shed + 2
+
+    assert client.post("/api/getRisk/", json=request).status_code == 200
+    assert client.get("/health").status_code == 200
+    assert 'bonoai_admission_shed_total{endpoint_class="shap"}' in client.get("/metrics").text
@@ -320,6 +320,533 @@ class TestGetShapPlotEndpoint:
             assert response.status_code == 200
 
 
+class TestGetRiskExplainedEndpoint:
+    """Tests for POST /api/getRiskExplained/ endpoint"""
+
+    @staticmethod
+    def read_events(response):
+        import json
+
+        events = []
+        for block in response.text.strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append((fields["event"], json.loads(fields["data"])))
+        return events
+
+    @pytest.mark.parametrize("workers", [0, 2])
+    def test_risks_then_three_plots(self, client, monkeypatch, workers):
+        """Risks come first, then one plot per fracture type, then done"""
+        from app.api import endpoints
+        from app.services.plots import PlotPool
+
+        pool = PlotPool(workers=workers, lane=endpoints.explain_lane)
+        monkeypatch.setattr(endpoints, "plot_pool", pool)
+        request = {"riskHorizon": 2, "patientData": VALID_PATIENT_DATA}
+        response = client.post("/api/getRiskExplained/", json=request)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = self.read_events(response)
+        assert [event for event, _ in events] == ["risks", "shap", "shap", "shap", "done"]
+        assert events[0][1]["risks"] == client.post("/api/getRisk/", json=request).json()["risks"]
+
+        plots = {data["fxType"]: data for event, data in events if event == "shap"}
+        assert set(plots) == {"vertebral", "hip", "any"}
+        expected = client.post(
+            "/api/getShapPlot/", json={**request, "fxType": "hip"}
+        ).json()["shap_plot"]
+        assert plots["hip"]["shap_plot"] == expected
+        assert len(plots["hip"]["shapValues"]) == 47
+        pool.shutdown()
+
+    def test_invalid_patient(self, client):
+        """The patient is validated before the stream starts"""
+        response = client.post(
+            "/api/getRiskExplained/",
+            json={"riskHorizon": 2, "patientData": {**VALID_PATIENT_DATA, "age": 121}},
+        )
+        assert response.status_code == 422
+
+
+class TestGetRiskBatchEndpoint:
+    """Tests for POST /api/getRiskBatch/ endpoint"""
+
+    @staticmethod
+    def _patients():
+        return [
+            {**VALID_PATIENT_DATA, "age": age, "hrt_prior": age > 70}
+            for age in [55, 65, 75, 85]
+        ]
+
+    @staticmethod
+    def _columns(patients):
+        return {name: [patient[name] for patient in patients] for name in patients[0]}
+
+    def _single_risks(self, client, patient):
+        response = client.post(
+            "/api/getRisk/", json={"riskHorizon": 3, "patientData": patient}
+        )
+        return response.json()["risks"]
+
+    def test_all_formats_match_single_risk(self, client):
+        """Row, column and Arrow input give the same risks as /api/getRisk/"""
+        import io
+        import pyarrow as pa
+
+        patients = self._patients()
+        table = pa.table(self._columns(patients))
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        responses = [
+            client.post(
+                "/api/getRiskBatch/", json={"riskHorizon": 3, "patients": patients}
+            ),
+            client.post(
+                "/api/getRiskBatch/",
+                json={"riskHorizon": 3, "columns": self._columns(patients)},
+            ),
+            client.post(
+                "/api/getRiskBatch/?riskHorizon=3",
+                content=sink.getvalue(),
+                headers={"content-type": "application/vnd.apache.arrow.stream"},
+            ),
+        ]
+
+        for response in responses:
+            assert response.status_code == 200
+            risks = response.json()["risks"]
+            for index, patient in enumerate(patients):
+                for fx_type, risk in self._single_risks(client, patient).items():
+                    assert risks[fx_type][index] == pytest.approx(risk)
+
+    @pytest.mark.parametrize(
+        "field,value",
+        [
+            ("age", 121),
+            ("height", 99),
+            ("weight", 301),
+            ("tscore_neck", -10.1),
+            ("tbs", 10.1),
+            ("steroid_daily_dosage", 2.5),
+            ("sex", "other"),
+            ("hip_fracture_parents", 3),
+            ("recent_fracture", 1),
+        ],
+    )
+    def test_column_validation_mirrors_patient_data(self, client, field, value):
+        """Columnar range checks reject the same values as PatientData"""
+        patients = self._patients()
+        patients[2] = {**patients[2], field: value}
+
+        row_response = client.post(
+            "/api/getRiskBatch/", json={"riskHorizon": 3, "patients": patients}
+        )
+        column_response = client.post(
+            "/api/getRiskBatch/",
+            json={"riskHorizon": 3, "columns": self._columns(patients)},
+        )
+
+        assert row_response.status_code == 422
+        assert column_response.status_code == 422
+        assert column_response.json()["detail"][0]["loc"] == ["body", "columns", field, 2]
+
+    def test_missing_required_column(self, client):
+        """Required PatientData fields must be present as columns"""
+        columns = self._columns(self._patients())
+        del columns["tscore_ls"]
+
+        response = client.post(
+            "/api/getRiskBatch/", json={"riskHorizon": 3, "columns": columns}
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", "columns", "tscore_ls"]
+
+    def test_arrow_requires_risk_horizon(self, client):
+        """Arrow input needs riskHorizon as query parameter"""
+        response = client.post(
+            "/api/getRiskBatch/",
+            content=b"",
+            headers={"content-type": "application/vnd.apache.arrow.stream"},
+        )
+        assert response.status_code == 422
+
+
+class TestGetRiskStreamEndpoint:
+    """Tests for POST /api/getRiskStream/ endpoint"""
+
+    def test_stream_scores_every_line(self, client, monkeypatch):
+        """Every NDJSON line gets a result line, in order, across chunks"""
+        import json
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "STREAM_CHUNK_SIZE", 3)
+        patients = [{**VALID_PATIENT_DATA, "age": age} for age in range(60, 67)]
+        patients[4] = {**VALID_PATIENT_DATA, "age": 121}
+
+        def body():
+            for patient in patients:
+                yield (json.dumps(patient) + "\n").encode()
+
+        with client.stream(
+            "POST",
+            "/api/getRiskStream/?riskHorizon=2",
+            content=body(),
+            headers={"content-type": "application/x-ndjson"},
+        ) as response:
+            assert response.status_code == 200
+            results = [json.loads(line) for line in response.iter_lines() if line]
+
+        assert [result["index"] for result in results] == list(range(7))
+        assert results[4]["detail"][0]["loc"] == ["age"]
+
+        expected = client.post(
+            "/api/getRisk/", json={"riskHorizon": 2, "patientData": patients[0]}
+        ).json()["risks"]
+        assert results[0]["risks"] == pytest.approx(expected)
+
+    def test_overlong_line_is_reported(self, client):
+        """A line over the length limit gets an error result and isn't buffered"""
+        import asyncio
+        import json
+        from app.api.endpoints import NDJSON_MAX_LINE_BYTES, _ndjson_lines
+
+        class ChunkedRequest:
+            def __init__(self, chunks):
+                self.chunks = chunks
+
+            async def stream(self):
+                for chunk in self.chunks:
+                    yield chunk
+
+        async def lines(chunks, max_line_bytes):
+            return [line async for line in _ndjson_lines(ChunkedRequest(chunks), max_line_bytes)]
+
+        chunks = [b"ab", b"c\nde", b"fghij", b"k\n\nxy", b"z\n", b"0123456"]
+        assert asyncio.run(lines(chunks, 6)) == [b"abc", None, b"xyz", None]
+        assert asyncio.run(lines(chunks, 100)) == [b"abc", b"defghijk", b"xyz", b"0123456"]
+
+        line = (json.dumps(VALID_PATIENT_DATA) + "\n").encode()
+
+        def body():
+            yield line
+            for _ in range(NDJSON_MAX_LINE_BYTES // 1000 + 1):
+                yield b" " * 1000
+            yield b"{}\n"
+            yield line
+
+        with client.stream(
+            "POST", "/api/getRiskStream/?riskHorizon=2", content=body(),
+            headers={"content-type": "application/x-ndjson"},
+        ) as response:
+            results = [json.loads(result) for result in response.iter_lines() if result]
+
+        assert [result["index"] for result in results] == [0, 1, 2]
+        assert "risks" in results[0] and "risks" in results[2]
+        assert results[1]["detail"][0]["type"] == "line_too_long"
+
+    def test_stream_requires_risk_horizon(self, client):
+        """riskHorizon query parameter is required"""
+        response = client.post("/api/getRiskStream/", content=b"{}\n")
+        assert response.status_code == 422
+
+
+class TestJobsEndpoints:
+    """Tests for the /api/jobs endpoints"""
+
+    @staticmethod
+    def _wait_for_completion(client, job_id):
+        import time
+
+        for _ in range(100):
+            status = client.get(f"/api/jobs/{job_id}").json()
+            if status["status"] not in ("queued", "running"):
+                return status
+            time.sleep(0.05)
+        raise AssertionError("Job did not finish")
+
+    def test_job_lifecycle(self, client):
+        """A job is queued, completes and its Parquet result matches /api/getRisk/"""
+        import io
+        import pandas as pd
+
+        patients = [{**VALID_PATIENT_DATA, "age": age} for age in [60, 70, 80]]
+        response = client.post(
+            "/api/jobs", json={"patients": patients, "horizons": [1, 4], "shap": True}
+        )
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        status = self._wait_for_completion(client, job_id)
+        assert status["status"] == "completed"
+        assert status["progress"] == 1.0
+
+        response = client.get(f"/api/jobs/{job_id}/result")
+        assert response.status_code == 200
+        result = pd.read_parquet(io.BytesIO(response.content))
+        assert len(result) == 3
+
+        expected = client.post(
+            "/api/getRisk/", json={"riskHorizon": 4, "patientData": patients[1]}
+        ).json()["risks"]
+        for fx_type, risk in expected.items():
+            assert result.loc[1, f"{fx_type}_risk_4y"] == pytest.approx(risk)
+        assert "any_shap_age" in result.columns
+        assert "any_shap_base" in result.columns
+
+    def test_csv_format_and_columns(self, client):
+        """Column-oriented input and CSV output"""
+        columns = {name: [value, value] for name, value in VALID_PATIENT_DATA.items()}
+        response = client.post("/api/jobs", json={"columns": columns, "format": "csv"})
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        assert self._wait_for_completion(client, job_id)["status"] == "completed"
+        response = client.get(f"/api/jobs/{job_id}/result")
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.startswith("vertebral_risk_2y,")
+
+        # deleting a finished job removes it with its result
+        assert client.delete(f"/api/jobs/{job_id}").json()["status"] == "completed"
+        assert client.get(f"/api/jobs/{job_id}").status_code == 404
+        assert client.get(f"/api/jobs/{job_id}/result").status_code == 404
+
+    def test_invalid_jobs(self, client):
+        """Invalid job requests are rejected"""
+        # neither patients nor columns
+        assert client.post("/api/jobs", json={"horizons": [2]}).status_code == 422
+        # invalid horizon
+        response = client.post(
+            "/api/jobs", json={"patients": [VALID_PATIENT_DATA], "horizons": [8]}
+        )
+        assert response.status_code == 422
+        # invalid column value
+        columns = {name: [value] for name, value in VALID_PATIENT_DATA.items()}
+        columns["age"] = [-1]
+        assert client.post("/api/jobs", json={"columns": columns}).status_code == 422
+
+    def test_unknown_job(self, client):
+        """Unknown job ids return 404"""
+        assert client.get("/api/jobs/doesnotexist").status_code == 404
+        assert client.get("/api/jobs/doesnotexist/result").status_code == 404
+        assert client.delete("/api/jobs/doesnotexist").status_code == 404
+
+
+class TestGetTreatmentComparisonEndpoint:
+    """Tests for POST /api/getTreatmentComparison/ endpoint"""
+
+    def test_scenarios_match_single_risk(self, client):
+        """Every scenario equals /api/getRisk/ with that treatment started"""
+        response = client.post(
+            "/api/getTreatmentComparison/",
+            json={"riskHorizon": 5, "patientData": VALID_PATIENT_DATA},
+        )
+        assert response.status_code == 200
+        scenarios = response.json()["scenarios"]
+
+        treatments = [scenario["treatment"] for scenario in scenarios]
+        assert sorted(treatments) == sorted(
+            ["none", "bisphosphonate", "denosumab", "serm", "teriparatide", "hrt"]
+        )
+
+        for scenario in scenarios:
+            patient = dict(VALID_PATIENT_DATA)
+            if scenario["treatment"] != "none":
+                patient[f"{scenario['treatment']}_new"] = True
+            expected = client.post(
+                "/api/getRisk/", json={"riskHorizon": 5, "patientData": patient}
+            ).json()["risks"]
+            assert scenario["risks"] == pytest.approx(expected)
+
+    def test_patient_on_treatment(self, client):
+        """Scenarios replace the current treatment instead of adding to it"""
+        treated = {**VALID_PATIENT_DATA, "denosumab_current": True, "bisphosphonate_new": True}
+        response = client.post(
+            "/api/getTreatmentComparison/", json={"riskHorizon": 5, "patientData": treated}
+        )
+        assert response.status_code == 200
+        scenarios = {scenario["treatment"]: scenario for scenario in response.json()["scenarios"]}
+
+        untreated = client.post(
+            "/api/getTreatmentComparison/", json={"riskHorizon": 5, "patientData": VALID_PATIENT_DATA}
+        ).json()["scenarios"]
+        for scenario in untreated:
+            assert scenarios[scenario["treatment"]]["risks"] == scenario["risks"]
+
+        # "none" stops every current and new treatment
+        stopped = {**treated, "denosumab_current": False, "bisphosphonate_new": False}
+        expected = client.post(
+            "/api/getRisk/", json={"riskHorizon": 5, "patientData": stopped}
+        ).json()["risks"]
+        assert scenarios["none"]["risks"] == pytest.approx(expected)
+        assert scenarios["none"]["riskReduction"] == {"vertebral": 0.0, "hip": 0.0, "any": 0.0}
+
+    def test_ranking(self, client):
+        """Scenarios are ranked by the requested fracture type"""
+        for rank_by in ["vertebral", "hip", "any"]:
+            response = client.post(
+                "/api/getTreatmentComparison/",
+                json={"riskHorizon": 2, "patientData": VALID_PATIENT_DATA, "rankBy": rank_by},
+            )
+            risks = [scenario["risks"][rank_by] for scenario in response.json()["scenarios"]]
+            assert risks == sorted(risks)
+
+        response = client.post(
+            "/api/getTreatmentComparison/",
+            json={"riskHorizon": 2, "patientData": VALID_PATIENT_DATA, "rankBy": "wrist"},
+        )
+        assert response.status_code == 422
+
+
+class TestGetRiskSurfaceEndpoint:
+    """Tests for POST /api/getRiskSurface/ endpoint"""
+
+    def test_two_axis_surface(self, client):
+        """Grid points equal /api/getRisk/ with the swept inputs replaced"""
+        response = client.post(
+            "/api/getRiskSurface/",
+            json={
+                "riskHorizon": 5,
+                "patientData": VALID_PATIENT_DATA,
+                "axes": [
+                    {"feature": "age", "start": 60, "stop": 80, "steps": 5},
+                    {"feature": "tscore_neck", "start": -4, "stop": 0, "steps": 3},
+                ],
+            },
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["axes"] == {"age": [60, 65, 70, 75, 80], "tscore_neck": [-4, -2, 0]}
+
+        for fx_type in ["vertebral", "hip", "any"]:
+            assert len(data["risks"][fx_type]) == 5
+            assert all(len(row) == 3 for row in data["risks"][fx_type])
+
+        # min_tscore and BMI are re-derived for every point
+        patient = {**VALID_PATIENT_DATA, "age": 75, "tscore_neck": -4.0}
+        expected = client.post(
+            "/api/getRisk/", json={"riskHorizon": 5, "patientData": patient}
+        ).json()["risks"]
+        for fx_type, risk in expected.items():
+            assert data["risks"][fx_type][3][0] == pytest.approx(risk)
+
+    def test_integer_inputs_use_whole_numbers(self, client):
+        """Integer inputs are swept over distinct whole numbers"""
+        response = client.post(
+            "/api/getRiskSurface/",
+            json={
+                "riskHorizon": 2,
+                "patientData": VALID_PATIENT_DATA,
+                "axes": [{"feature": "number_of_falls", "start": 0, "stop": 3, "steps": 7}],
+            },
+        )
+        assert response.status_code == 200
+        assert response.json()["axes"] == {"number_of_falls": [0, 1, 2, 3]}
+
+    def test_invalid_sweeps(self, client):
+        """Out of range grids, unknown inputs and duplicate axes are rejected"""
+        invalid_axes = [
+            [{"feature": "age", "start": 100, "stop": 130, "steps": 4}],
+            [{"feature": "hip_fracture_parents", "start": 0, "stop": 1}],
+            [{"feature": "age", "start": 50, "stop": 90, "steps": 101}],
+            [{"feature": "tbs", "start": 1, "stop": 2}, {"feature": "tbs", "start": 1, "stop": 2}],
+            [],
+        ]
+        for axes in invalid_axes:
+            response = client.post(
+                "/api/getRiskSurface/",
+                json={"riskHorizon": 2, "patientData": VALID_PATIENT_DATA, "axes": axes},
+            )
+            assert response.status_code == 422
+
+
+class TestLiveRiskWebSocket:
+    """Tests for the /api/liveRisk/ WebSocket"""
+
+    def test_deltas_update_risks(self, client):
+        """Changed fields are applied to the patient and risks for all horizons pushed"""
+        with client.websocket_connect("/api/liveRisk/") as websocket:
+            websocket.send_json({"seq": 1, "patientData": VALID_PATIENT_DATA})
+            first = websocket.receive_json()
+            assert first["seq"] == 1
+            assert first["horizons"] == [1, 2, 3, 4, 5, 6, 7]
+            assert first["modelVersion"] == client.get("/health").json()["modelVersion"]
+
+            websocket.send_json({"seq": 2, "changes": {"age": 78, "tscore_neck": -3.0}})
+            update = websocket.receive_json()
+
+        assert update["seq"] == 2
+        assert "detail" not in update
+        patient = {**VALID_PATIENT_DATA, "age": 78, "tscore_neck": -3.0}
+        for horizon in [2, 5]:
+            expected = client.post(
+                "/api/getRisk/", json={"riskHorizon": horizon, "patientData": patient}
+            ).json()["risks"]
+            for fx_type, risk in expected.items():
+                assert update["risks"][fx_type][horizon - 1] == pytest.approx(risk, abs=0.01)
+        assert update["risks"]["any"] != first["risks"]["any"]
+
+    def test_burst_is_debounced(self, client, monkeypatch):
+        """Changes arriving within the debounce window give a single update"""
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "LIVE_DEBOUNCE_MS", 300)
+        with client.websocket_connect("/api/liveRisk/") as websocket:
+            websocket.send_json({"seq": 1, "patientData": VALID_PATIENT_DATA})
+            for seq, age in enumerate([66, 67, 68], start=2):
+                websocket.send_json({"seq": seq, "changes": {"age": age}})
+            update = websocket.receive_json()
+            websocket.send_json({"seq": 5, "changes": {"weight": 61}})
+            assert websocket.receive_json()["seq"] == 5
+
+        assert update["seq"] == 4
+        expected = client.post(
+            "/api/getRisk/",
+            json={"riskHorizon": 2, "patientData": {**VALID_PATIENT_DATA, "age": 68}},
+        ).json()["risks"]
+        assert update["risks"]["hip"][1] == pytest.approx(expected["hip"], abs=0.01)
+
+    def test_invalid_changes(self, client):
+        """Invalid deltas are reported and can be fixed by the next change"""
+        with client.websocket_connect("/api/liveRisk/") as websocket:
+            websocket.send_json({"changes": {"age": 70}})
+            assert websocket.receive_json()["detail"][0]["loc"] == ["patientData"]
+
+            websocket.send_json({"patientData": VALID_PATIENT_DATA})
+            assert "risks" in websocket.receive_json()
+
+            websocket.send_json({"changes": {"recent_fracture": 2}})
+            invalid = websocket.receive_json()
+            assert "risks" not in invalid
+            assert invalid["detail"][0]["type"] == "value_error"
+
+            websocket.send_json({"changes": {"previous_fracture": 2, "shoe_size": 38}})
+            fixed = websocket.receive_json()
+            assert "risks" in fixed
+            assert fixed["detail"][0]["loc"] == ["changes", "shoe_size"]
+
+            websocket.send_text("not json")
+            assert websocket.receive_json()["detail"][0]["type"] == "json_invalid"
+
+    def test_binary_frame_closes_session(self, client):
+        """A binary frame closes the session with 1003 and frees its state"""
+        from starlette.websockets import WebSocketDisconnect
+
+        from app.api.live import live_models
+
+        with client.websocket_connect("/api/liveRisk/") as websocket:
+            websocket.send_json({"seq": 1, "patientData": VALID_PATIENT_DATA})
+            evaluator = live_models[websocket.receive_json()["modelVersion"]].evaluators["hip"]
+            n_sessions = len(evaluator._sessions)
+
+            websocket.send_bytes(b"\x00\x01")
+            with pytest.raises(WebSocketDisconnect) as disconnect:
+                websocket.receive_json()
+        assert disconnect.value.code == 1003
+        assert len(evaluator._sessions) == n_sessions - 1
+
+
 class TestHealthCheck:
     """Tests for health check endpoint"""
 
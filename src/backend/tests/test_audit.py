@@ -0,0 +1,180 @@
+"""
+Tests for the asynchronous prediction audit log (app.services.audit)
+"""
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ml.risk_calculator import BonoAI
+from app.models import patients_to_columns
+from app.services.audit import AuditLog, records_total
+from app.services.registry import CANNED_COHORT
+from app.services.singleflight import request_key
+from tests.test_api import VALID_PATIENT_DATA
+
+
+@pytest.fixture(scope="module")
+def model():
+    return BonoAI()
+
+
+def record_cohort(audit_log, model, patients, endpoint="test", wait=0):
+    columns = patients_to_columns(patients)
+    features = model.prepare_matrix(columns)
+    risks = {
+        fx_type: model.predict_risks(features, fx_type, [24, 60]) * 100
+        for fx_type in ("vertebral", "hip", "any")
+    }
+    return audit_log.record(endpoint, model, [2, 5], columns, features, risks, 0.0125, wait=wait)
+
+
+def read_ndjson(directory):
+    return [
+        json.loads(line)
+        for path in sorted(directory.glob("audit-*.ndjson"))
+        for line in path.read_text().splitlines()
+    ]
+
+
+def test_records_are_written_in_batches(tmp_path, model):
+    audit_log = AuditLog(str(tmp_path))
+    assert record_cohort(audit_log, model, CANNED_COHORT[:3])
+    assert record_cohort(audit_log, model, CANNED_COHORT[3:4])
+    # nothing is written on the request path
+    assert list(tmp_path.iterdir()) == []
+
+    assert audit_log.flush() == 4
+    records = read_ndjson(tmp_path)
+    assert len(records) == 4
+    first = records[0]
+    assert first["endpoint"] == "test"
+    assert first["modelVersion"] == model.version
+    assert first["inputHash"] == request_key(CANNED_COHORT[0].model_dump())
+    assert list(first["features"]) == model.feature_names
+    assert first["horizons"] == [2, 5]
+    assert len(first["risks"]["hip"]) == 2
+    assert first["latencyMs"] == 12.5
+    audit_log.shutdown()
+
+
+def test_full_queue_drops_and_counts(tmp_path, model):
+    audit_log = AuditLog(str(tmp_path), max_queued=4)
+    dropped = records_total.value(result="dropped")
+    assert record_cohort(audit_log, model, CANNED_COHORT[:3])
+    # accepted while fewer than max_queued records wait
+    assert record_cohort(audit_log, model, CANNED_COHORT[3:5])
+    assert not record_cohort(audit_log, model, CANNED_COHORT[5:7])
+    assert records_total.value(result="dropped") == dropped + 2
+    assert audit_log.flush() == 5
+    # room again once written
+    assert record_cohort(audit_log, model, CANNED_COHORT[5:7])
+
+
+def test_batch_larger_than_the_queue_is_recorded(tmp_path, model):
+    audit_log = AuditLog(str(tmp_path), max_queued=4)
+    patients = CANNED_COHORT * 3
+    assert len(patients) > 4
+    assert record_cohort(audit_log, model, patients)
+    # nothing more until it is written
+    assert not record_cohort(audit_log, model, CANNED_COHORT[:1])
+    assert audit_log.flush() == len(patients)
+    assert len(read_ndjson(tmp_path)) == len(patients)
+
+
+def test_record_waits_for_room(tmp_path, model):
+    audit_log = AuditLog(str(tmp_path), max_queued=2, flush_interval=60)
+    assert record_cohort(audit_log, model, CANNED_COHORT[:2])
+    assert not record_cohort(audit_log, model, CANNED_COHORT[2:3], wait=0.05)
+
+    # the writer is woken up and makes room
+    audit_log.start()
+    try:
+        assert record_cohort(audit_log, model, CANNED_COHORT[2:3], wait=10)
+    finally:
+        audit_log.shutdown()
+    assert len(read_ndjson(tmp_path)) == 3
+
+
+def test_parquet_files_rotate(tmp_path, model):
+    import pyarrow.parquet as pq
+
+    audit_log = AuditLog(str(tmp_path), file_format="parquet", max_file_bytes=1)
+    record_cohort(audit_log, model, CANNED_COHORT[:2])
+    audit_log.flush()
+    record_cohort(audit_log, model, CANNED_COHORT[2:5])
+    audit_log.flush()
+    audit_log.shutdown()
+
+    paths = sorted(tmp_path.glob("audit-*.parquet"))
+    assert len(paths) == 2
+    assert [pq.read_table(path).num_rows for path in paths] == [2, 3]
+    table = pq.read_table(paths[1]).to_pylist()
+    assert table[0]["inputHash"] == request_key(CANNED_COHORT[2].model_dump())
+
+
+def test_background_flush_and_shutdown(tmp_path, model):
+    audit_log = AuditLog(str(tmp_path), batch_size=2, flush_interval=60)
+    audit_log.start()
+    try:
+        # a full batch wakes the writer up before the interval
+        record_cohort(audit_log, model, CANNED_COHORT[:2])
+        deadline = time.monotonic() + 10
+        while len(read_ndjson(tmp_path)) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        record_cohort(audit_log, model, CANNED_COHORT[2:3])
+    finally:
+        audit_log.shutdown()
+    # the rest is written on shutdown
+    assert len(read_ndjson(tmp_path)) == 3
+    assert audit_log.path is None
+
+
+def test_api_predictions_are_recorded(tmp_path, monkeypatch):
+    from app.api import endpoints
+    from app.api.jobs import job_manager
+    from app.main import app
+
+    audit_log = AuditLog(str(tmp_path))
+    monkeypatch.setattr(endpoints, "audit_log", audit_log)
+    monkeypatch.setattr(job_manager, "audit_log", audit_log)
+    client = TestClient(app)
+
+    response = client.post("/api/getRisk/", json={"riskHorizon": 5, "patientData": VALID_PATIENT_DATA})
+    assert response.status_code == 200
+    batch = {"riskHorizon": 2, "patients": [VALID_PATIENT_DATA, {**VALID_PATIENT_DATA, "age": 70}]}
+    assert client.post("/api/getRiskBatch/", json=batch).status_code == 200
+    comparison = {"riskHorizon": 2, "patientData": VALID_PATIENT_DATA}
+    assert client.post("/api/getTreatmentComparison/", json=comparison).status_code == 200
+    surface = {
+        "riskHorizon": 2,
+        "patientData": VALID_PATIENT_DATA,
+        "axes": [{"feature": "age", "start": 60, "stop": 80, "steps": 3}],
+    }
+    assert client.post("/api/getRiskSurface/", json=surface).status_code == 200
+    job = client.post(
+        "/api/jobs", json={"patients": [VALID_PATIENT_DATA] * 2, "horizons": [1, 4]},
+        headers={"X-Request-ID": "job-1"},
+    ).json()
+    deadline = time.monotonic() + 10
+    while job_manager.get(job["id"])["status"] != "completed":
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    audit_log.shutdown()
+
+    records = read_ndjson(tmp_path)
+    assert [record["endpoint"] for record in records] == (
+        ["getRisk", "getRiskBatch", "getRiskBatch"] + ["getTreatmentComparison"] * 6
+        + ["getRiskSurface"] * 3 + ["jobs"] * 2
+    )
+    assert records[-1]["horizons"] == [1, 4]
+    assert len(records[-1]["risks"]["hip"]) == 2
+    assert records[-1]["requestId"] == "job-1"
+    risk = records[0]
+    assert risk["horizons"] == [5]
+    assert risk["risks"] == {fx_type: [value] for fx_type, value in response.json()["risks"].items()}
+    assert risk["modelVersion"] == response.json()["modelVersion"]
+    assert risk["inputHash"] == records[1]["inputHash"] != records[2]["inputHash"]
+    assert risk["latencyMs"] > 0
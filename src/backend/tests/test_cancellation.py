@@ -0,0 +1,151 @@
+"""
+Tests for cancelling abandoned work (app.services.cancellation)
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from app.services.cancellation import (
+    DeadlineExceeded,
+    abandoned_total,
+    request_deadline,
+    run_cancellable,
+)
+from tests.test_api import VALID_PATIENT_DATA
+
+
+class FakeRequest:
+    """A request whose client disconnects when `gone` is set"""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+
+    async def receive(self):
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+
+def scope_with(headers):
+    return {"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+
+
+def test_request_deadline_parses_and_keeps_the_header():
+    assert request_deadline(scope_with({})) is None
+
+    scope = scope_with({"X-Deadline-Ms": "1500"})
+    deadline = request_deadline(scope)
+    assert deadline is not None
+    assert request_deadline(scope) == deadline
+
+    for value in ("soon", "0", "-5", "nan", "inf"):
+        with pytest.raises(ValueError):
+            request_deadline(scope_with({"X-Deadline-Ms": value}))
+
+
+class TestRunCancellable:
+    """Tests for run_cancellable"""
+
+    def test_returns_result(self):
+        async def scenario():
+            async def work():
+                return 42
+            return await run_cancellable(FakeRequest(), work())
+
+        assert asyncio.run(scenario()) == 42
+
+    def test_disconnect_cancels_work(self):
+        async def scenario():
+            request = FakeRequest()
+            work = asyncio.ensure_future(asyncio.sleep(10))
+            asyncio.get_running_loop().call_later(0.01, request.gone.set)
+            with pytest.raises(ClientDisconnect):
+                await run_cancellable(request, work, endpoint="test")
+            await asyncio.sleep(0)
+            assert work.cancelled()
+
+        disconnects = abandoned_total.value(endpoint="test", reason="disconnect")
+        asyncio.run(scenario())
+        assert abandoned_total.value(endpoint="test", reason="disconnect") == disconnects + 1
+
+    def test_deadline_cancels_work(self):
+        async def scenario():
+            work = asyncio.ensure_future(asyncio.sleep(10))
+            with pytest.raises(DeadlineExceeded):
+                await run_cancellable(FakeRequest(), work, deadline=time.monotonic() + 0.01)
+            await asyncio.sleep(0)
+            assert work.cancelled()
+
+        asyncio.run(scenario())
+
+
+def test_render_stops_at_checkpoint():
+    """A cancelled render raises before drawing"""
+    from app.ml.risk_calculator import RenderCancelled, render_waterfall
+
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(RenderCancelled):
+        render_waterfall([0.1, -0.2], 0.5, [1.0, 2.0], ["a", "b"], cancelled=cancelled)
+
+
+def test_cancelled_plot_signals_render_thread(monkeypatch):
+    """Cancelling PlotPool.render sets the event the render thread checks"""
+    from app.services import plots
+    from app.services.lanes import Lane
+
+    started = threading.Event()
+    events = []
+
+    def render(*explanation, cancelled):
+        events.append(cancelled)
+        started.set()
+        cancelled.wait(5)
+        return "plot"
+
+    monkeypatch.setattr(plots, "render_waterfall", render)
+
+    async def scenario():
+        lane = Lane("test-plots", 1)
+        pool = plots.PlotPool(workers=0, lane=lane)
+        task = asyncio.ensure_future(pool.render(([], 0.0, [], [])))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        lane.shutdown()
+
+    asyncio.run(scenario())
+    assert events[0].is_set()
+
+
+@pytest.fixture(scope="module")
+def client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    return TestClient(app)
+
+
+class TestDeadlineHeader:
+    """Tests for X-Deadline-Ms on the SHAP endpoints"""
+
+    request = {"riskHorizon": 2, "patientData": VALID_PATIENT_DATA, "fxType": "hip"}
+
+    def test_invalid_deadline(self, client):
+        response = client.post("/api/getShapPlot/", json=self.request, headers={"X-Deadline-Ms": "soon"})
+        assert response.status_code == 400
+
+    def test_expired_deadline(self, client):
+        response = client.post("/api/getShapPlot/", json=self.request, headers={"X-Deadline-Ms": "1"})
+        assert response.status_code == 504
+
+    def test_deadline_while_queued(self, client, monkeypatch):
+        from app.main import shap_limiter
+
+        monkeypatch.setattr(shap_limiter, "max_concurrency", 0)
+        response = client.post("/api/getShapPlot/", json=self.request, headers={"X-Deadline-Ms": "50"})
+        assert response.status_code == 504
+        assert not shap_limiter._waiters
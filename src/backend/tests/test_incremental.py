@@ -0,0 +1,118 @@
+"""
+Tests for the incremental tree evaluator (app.ml.incremental)
+"""
+import numpy as np
+import pytest
+
+from app.ml.incremental import IncrementalEvaluator, IncrementalRiskModel, TreeIndex
+from app.ml.risk_calculator import FX_TYPES, BonoAI
+from tests.test_api import VALID_PATIENT_DATA
+
+
+@pytest.fixture(scope="module")
+def model():
+    return BonoAI()
+
+
+def prepare(model, **changes):
+    patient = {**VALID_PATIENT_DATA, **changes}
+    return model.prepare_matrix({name: [value] for name, value in patient.items()})[0]
+
+
+class TestTreeIndex:
+    """Tests for TreeIndex"""
+
+    @pytest.mark.parametrize("fx_type", FX_TYPES)
+    def test_matches_booster(self, model, fx_type):
+        """Walking all trees gives the booster's prediction"""
+        booster = model.models["xgb"][fx_type]
+        index = TreeIndex(booster)
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            features = prepare(
+                model, age=int(rng.integers(50, 90)), tscore_neck=float(rng.uniform(-4, 1)),
+                tbs=float(rng.uniform(1, 1.5)), denosumab_current=bool(rng.integers(2)),
+            )
+            expected = booster.inplace_predict(features[np.newaxis])[0]
+            assert index.predict(features) == pytest.approx(expected, rel=1e-5)
+
+    def test_missing_values(self, model):
+        """NaN features follow the default direction like in XGBoost"""
+        booster = model.models["xgb"]["hip"]
+        features = prepare(model)
+        features[model.feature_names.index("tbs_ls")] = np.nan
+        expected = booster.inplace_predict(features[np.newaxis])[0]
+        assert TreeIndex(booster).predict(features) == pytest.approx(expected, rel=1e-5)
+
+    def test_trees_by_feature(self, model):
+        """Every tree is indexed under the features it splits on"""
+        index = TreeIndex(model.models["xgb"]["vertebral"])
+        indexed = {tree for trees in index.trees_by_feature for tree in trees}
+        assert indexed == set(range(len(index.trees)))
+
+
+class TestIncrementalEvaluator:
+    """Tests for IncrementalEvaluator"""
+
+    @pytest.mark.parametrize(
+        "changes",
+        [
+            {"age": 81},
+            {"tscore_neck": -3.1},
+            {"weight": 52},
+            {"hrt_current": True},
+            {"previous_fracture": 2, "recent_fracture": 1},
+        ],
+    )
+    def test_single_edits_equal_full_evaluation(self, model, changes):
+        """Re-walking only the affected trees gives exactly the full evaluation"""
+        evaluator = IncrementalEvaluator(model.models["xgb"]["any"])
+        evaluator.predict("patient", prepare(model))
+        walked = evaluator.trees_walked
+
+        features = prepare(model, **changes)
+        assert evaluator.predict("patient", features) == evaluator.index.predict(features)
+        assert evaluator.trees_walked - walked < len(evaluator.index.trees)
+
+    def test_unchanged_walks_no_trees(self, model):
+        """Repeating the last features of a key is answered from the cache"""
+        evaluator = IncrementalEvaluator(model.models["xgb"]["hip"])
+        features = prepare(model)
+        first = evaluator.predict("patient", features)
+        walked = evaluator.trees_walked
+        assert evaluator.predict("patient", features.copy()) == first
+        assert evaluator.trees_walked == walked
+
+    def test_sessions_are_independent_and_evicted(self, model):
+        """Each key has its own cache, the least recently used key is evicted"""
+        evaluator = IncrementalEvaluator(model.models["xgb"]["hip"], max_sessions=2)
+        young, old = prepare(model, age=55), prepare(model, age=85)
+        assert evaluator.predict("a", young) == evaluator.index.predict(young)
+        assert evaluator.predict("b", old) == evaluator.index.predict(old)
+        evaluator.predict("c", young)
+
+        walked = evaluator.trees_walked
+        evaluator.predict("a", young)
+        assert evaluator.trees_walked - walked == len(evaluator.index.trees)
+
+    def test_unsupported_objective(self):
+        """Boosters with other output transformations are rejected"""
+        import xgboost as xgb
+
+        data = xgb.DMatrix(np.array([[0.0], [1.0]]), label=[0, 1])
+        booster = xgb.train({"objective": "binary:logistic"}, data, num_boost_round=1)
+        with pytest.raises(ValueError, match="binary:logistic"):
+            TreeIndex(booster)
+
+
+def test_incremental_risk_model(model):
+    """Risks of the incremental model equal BonoAI.predict_risks"""
+    incremental = IncrementalRiskModel(model)
+    times = model.times
+    incremental.predict_risks("patient", prepare(model), times)
+
+    features = prepare(model, age=79)
+    risks = incremental.predict_risks("patient", features, times)
+    for fx_type in FX_TYPES:
+        expected = model.predict_risks(features[np.newaxis], fx_type, times)[0]
+        np.testing.assert_allclose(risks[fx_type], expected, rtol=1e-5)
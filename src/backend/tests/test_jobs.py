@@ -0,0 +1,130 @@
+"""
+Tests for the in-process job queue (app.services.jobs)
+"""
+import threading
+import time
+
+import pytest
+
+from app.ml.risk_calculator import BonoAI
+from app.models import PatientData, patients_to_columns
+from app.services.jobs import JobManager, QueueFullError
+from tests.test_api import VALID_PATIENT_DATA
+
+
+class BlockingModel:
+    """Wraps BonoAI and blocks every chunk until released"""
+
+    def __init__(self):
+        self.model = BonoAI()
+        self.feature_names = self.model.feature_names
+        self.release = threading.Event()
+
+    def prepare_matrix(self, columns):
+        self.release.wait(5)
+        return self.model.prepare_matrix(columns)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def _columns(n_patients):
+    return patients_to_columns(
+        [PatientData(**VALID_PATIENT_DATA) for _ in range(n_patients)]
+    )
+
+
+def _wait_for(manager, job_id, states, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = manager.get(job_id)
+        if status["status"] in states:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {status['status']}")
+
+
+class TestJobManager:
+    """Tests for JobManager"""
+
+    def test_cancel_running_job(self, tmp_path):
+        """A running job stops at the next chunk and leaves no result file"""
+        model = BlockingModel()
+        manager = JobManager(str(tmp_path), chunk_size=1)
+        job = manager.submit(_columns(3), 3, [2], False, "csv", model)
+
+        _wait_for(manager, job.id, ["running"])
+        manager.cancel(job.id)
+        model.release.set()
+
+        status = _wait_for(manager, job.id, ["cancelled"])
+        assert status["processed"] < 3
+        assert not (tmp_path / f"{job.id}.csv").exists()
+        manager.shutdown()
+
+    def test_cancel_queued_job(self, tmp_path):
+        """Queued jobs are cancelled immediately and never run"""
+        model = BlockingModel()
+        manager = JobManager(str(tmp_path), max_concurrency=1, chunk_size=1)
+        running = manager.submit(_columns(1), 1, [2], False, "csv", model)
+        queued = manager.submit(_columns(1), 1, [2], False, "csv", model)
+
+        assert manager.cancel(queued.id)["status"] == "cancelled"
+        model.release.set()
+
+        assert _wait_for(manager, running.id, ["completed"])["processed"] == 1
+        assert manager.get(queued.id)["processed"] == 0
+        manager.shutdown()
+
+    def test_queue_depth_is_capped(self, tmp_path):
+        """Submitting beyond the queue depth raises QueueFullError"""
+        model = BlockingModel()
+        manager = JobManager(str(tmp_path), max_concurrency=1, max_queued=1)
+        running = manager.submit(_columns(1), 1, [2], False, "csv", model)
+        _wait_for(manager, running.id, ["running"])
+        manager.submit(_columns(1), 1, [2], False, "csv", model)
+
+        with pytest.raises(QueueFullError):
+            manager.submit(_columns(1), 1, [2], False, "csv", model)
+        model.release.set()
+        manager.shutdown()
+
+    def test_status_from_other_process(self, tmp_path):
+        """A second manager on the same directory sees the job status"""
+        manager = JobManager(str(tmp_path))
+        job = manager.submit(_columns(2), 2, [2], False, "parquet", BonoAI())
+        _wait_for(manager, job.id, ["completed"])
+
+        assert JobManager(str(tmp_path)).get(job.id)["status"] == "completed"
+        manager.shutdown()
+
+    def test_finished_jobs_expire(self, tmp_path):
+        """Finished jobs and their files are removed after the retention period"""
+        manager = JobManager(str(tmp_path), retention=60)
+        job = manager.submit(_columns(2), 2, [2], False, "csv", BonoAI())
+        _wait_for(manager, job.id, ["completed"])
+        assert (tmp_path / f"{job.id}.csv").exists()
+
+        manager.purge(now=time.time() + 30)
+        assert manager.get(job.id)["status"] == "completed"
+        manager.purge(now=time.time() + 61)
+        assert manager.get(job.id) is None
+        assert list(tmp_path.iterdir()) == []
+        manager.shutdown()
+
+    def test_remove_finished_job(self, tmp_path):
+        """Only finished jobs can be removed, with their result file"""
+        model = BlockingModel()
+        manager = JobManager(str(tmp_path), chunk_size=1)
+        job = manager.submit(_columns(1), 1, [2], False, "parquet", model)
+        _wait_for(manager, job.id, ["running"])
+        assert manager.remove(job.id)["status"] == "running"
+        model.release.set()
+        _wait_for(manager, job.id, ["completed"])
+
+        assert manager.remove(job.id)["status"] == "completed"
+        assert manager.get(job.id) is None
+        assert not (tmp_path / f"{job.id}.parquet").exists()
+        # the status file of another process is removed too
+        assert JobManager(str(tmp_path)).get(job.id) is None
+        manager.shutdown()
@@ -0,0 +1,74 @@
+"""
+Tests for worker lanes (app.services.lanes)
+"""
+import asyncio
+import contextvars
+import threading
+
+from app.services.lanes import Lane, busy_gauge, queued_gauge
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class TestLane:
+    """Tests for Lane"""
+
+    def test_runs_in_lane_thread_with_context(self):
+        async def scenario():
+            lane = Lane("test-context", 1)
+            request_id.set("abc")
+
+            def work(value, offset=0):
+                return threading.current_thread().name, request_id.get(), value + offset
+
+            name, seen_id, result = await lane.run(work, 40, offset=2)
+            lane.shutdown()
+            return name, seen_id, result
+
+        name, seen_id, result = asyncio.run(scenario())
+        assert name.startswith("lane-test-context")
+        assert seen_id == "abc"
+        assert result == 42
+
+    def test_saturated_lane_does_not_block_other_lane(self):
+        """Risk work finishes while every explanation thread is busy"""
+        async def scenario():
+            risk = Lane("test-risk", 1)
+            explain = Lane("test-explain", 1)
+            release = threading.Event()
+
+            blocked = [asyncio.ensure_future(explain.run(release.wait)) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            assert busy_gauge.value(lane="test-explain") == 1
+            assert queued_gauge.value(lane="test-explain") == 2
+
+            assert await asyncio.wait_for(risk.run(sum, [1, 2, 3]), timeout=1) == 6
+
+            release.set()
+            await asyncio.gather(*blocked)
+            assert busy_gauge.value(lane="test-explain") == 0
+            assert queued_gauge.value(lane="test-explain") == 0
+            risk.shutdown()
+            explain.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_cancelled_queued_task_is_not_run(self):
+        async def scenario():
+            lane = Lane("test-cancel", 1)
+            release = threading.Event()
+            calls = []
+
+            running = asyncio.ensure_future(lane.run(release.wait))
+            queued = asyncio.ensure_future(lane.run(calls.append, 1))
+            await asyncio.sleep(0.05)
+            queued.cancel()
+            await asyncio.sleep(0)
+            assert queued_gauge.value(lane="test-cancel") == 0
+
+            release.set()
+            await running
+            lane.shutdown()
+            return calls
+
+        assert asyncio.run(scenario()) == []
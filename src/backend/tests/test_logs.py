@@ -0,0 +1,108 @@
+"""
+Tests for the queued structured logging and request ids (app.logs)
+"""
+import io
+import json
+import logging
+import queue
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.logs import (
+    NonBlockingQueueHandler, SamplingFilter, dropped_total, parse_sample_rates, request_id_var,
+    setup_logging, stop_logging,
+)
+from app.main import app
+from app.ml.risk_calculator import BonoAI, render_waterfall
+from app.models import patients_to_columns
+from app.services.registry import CANNED_COHORT
+from tests.test_api import VALID_PATIENT_DATA
+
+
+@pytest.fixture
+def log_output():
+    """Log to a buffer, parsed into the JSON records after stop_logging()"""
+    output = io.StringIO()
+    setup_logging("INFO", stream=output)
+    yield lambda: [json.loads(line) for line in output.getvalue().splitlines()]
+    stop_logging()
+    setup_logging(
+        settings.LOG_LEVEL, settings.LOG_FORMAT, parse_sample_rates(settings.LOG_SAMPLE_RATES),
+        settings.LOG_QUEUE_SIZE,
+    )
+
+
+def test_records_are_json_lines(log_output):
+    logger = logging.getLogger("app.test")
+    token = request_id_var.set("abc")
+    try:
+        logger.info("Scored %s patients", 3, extra={"batch": 7})
+    finally:
+        request_id_var.reset(token)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.error("Failed", exc_info=True)
+    logger.debug("not logged at INFO")
+    stop_logging()
+
+    scored, failed = log_output()
+    assert scored["message"] == "Scored 3 patients"
+    assert scored["level"] == "INFO"
+    assert scored["logger"] == "app.test"
+    assert scored["request_id"] == "abc"
+    assert scored["batch"] == 7
+    assert scored["time"].endswith("+00:00")
+    assert "request_id" not in failed
+    assert "ValueError: boom" in failed["exc_info"]
+
+
+def test_request_id_header_and_records(log_output):
+    client = TestClient(app)
+    response = client.get("/health")
+    assert len(response.headers["X-Request-ID"]) == 32
+    assert client.get("/health", headers={"X-Request-ID": "x" * 65}).headers["X-Request-ID"] != "x" * 65
+
+    response = client.post(
+        "/api/getRisk/",
+        json={"riskHorizon": 5, "patientData": VALID_PATIENT_DATA},
+        headers={"X-Request-ID": "frontend-42"},
+    )
+    assert response.headers["X-Request-ID"] == "frontend-42"
+    stop_logging()
+    records = [record for record in log_output() if record["logger"] == "app.api.endpoints"]
+    assert [record["request_id"] for record in records] == ["frontend-42", "frontend-42"]
+
+
+def test_sampling_keeps_warnings():
+    sampler = SamplingFilter(parse_sample_rates("app.api=0, uvicorn.access=1"))
+    dropped = dropped_total.value(reason="sampled")
+
+    def kept(name, level):
+        return sampler.filter(logging.LogRecord(name, level, "", 0, "message", (), None))
+
+    assert not kept("app.api.endpoints", logging.INFO)
+    assert kept("app.api.endpoints", logging.WARNING)
+    assert kept("app.apis", logging.INFO)
+    assert kept("uvicorn.access", logging.INFO)
+    assert dropped_total.value(reason="sampled") == dropped + 1
+
+
+def test_full_queue_drops_records():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    dropped = dropped_total.value(reason="queue_full")
+    for _ in range(3):
+        handler.emit(logging.LogRecord("app.test", logging.INFO, "", 0, "%s", ([1.5, 2.5],), None))
+    assert dropped_total.value(reason="queue_full") == dropped + 2
+    # formatted by the listener, not when logging
+    assert handler.queue.get_nowait().args == ([1.5, 2.5],)
+
+
+def test_inference_writes_nothing_to_stdout(capsys):
+    model = BonoAI()
+    features = model.prepare_matrix(patients_to_columns([CANNED_COHORT[0]]), dtype="float64")
+    render_waterfall(*model.explain(features[0], "hip"))
+    TestClient(app).post("/api/getRisk/", json={"riskHorizon": 5, "patientData": VALID_PATIENT_DATA})
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,171 @@
+"""
+Tests for speculative SHAP prefetching (app.services.prefetch)
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.ml.risk_calculator import BonoAI
+from app.models import PatientData
+from app.services.prefetch import ShapPrefetcher, dropped_total, hits_total, wasted_total
+from tests.test_api import VALID_PATIENT_DATA
+
+
+@pytest.fixture(scope="module")
+def model():
+    return BonoAI()
+
+
+class BlockingModel:
+    """Wraps BonoAI and blocks every explanation until released"""
+
+    def __init__(self, model):
+        self.model = model
+        self.release = threading.Event()
+
+    def explain(self, features, fx_type):
+        self.release.wait(5)
+        return self.model.explain(features, fx_type)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def _patient(**changes):
+    return PatientData(**{**VALID_PATIENT_DATA, **changes})
+
+
+class TestShapPrefetcher:
+    """Tests for ShapPrefetcher"""
+
+    def test_hit_after_schedule(self, model):
+        """A scheduled explanation is returned to the following request"""
+        prefetcher = ShapPrefetcher(model, render=False)
+        patient = _patient(age=71)
+        hits = hits_total.value()
+
+        prefetcher.schedule(patient)
+        prefetcher.join()
+        result = asyncio.run(prefetcher.get(patient, "hip"))
+        prefetcher.shutdown()
+
+        features = model.prepare_matrix({k: [v] for k, v in patient.model_dump().items()}, "float64")
+        values, base_value, _, _ = model.explain(features[0], "hip")
+        assert result["plot"] is None
+        assert result["explanation"][1] == base_value
+        assert list(result["explanation"][0]) == list(values)
+        assert hits_total.value() == hits + 1
+
+    def test_plots_render_in_the_plot_lane(self, model):
+        """Prefetched plots are rendered in the plot pool's lane, not the prefetch thread"""
+        from app.services.lanes import Lane
+        from app.services.plots import PlotPool
+
+        lane = Lane("test-explain", 1)
+        rendered = []
+        submit = lane.submit
+
+        def counting_submit(function, *args, **kwargs):
+            rendered.append(function)
+            return submit(function, *args, **kwargs)
+
+        lane.submit = counting_submit
+        patient = _patient(age=73)
+        prefetcher = ShapPrefetcher(model, plot_pool=PlotPool(workers=0, lane=lane))
+        prefetcher.schedule(patient)
+        prefetcher.join()
+        result = asyncio.run(prefetcher.get(patient, "hip"))
+        prefetcher.shutdown()
+        assert result["plot"]
+        assert len(rendered) == 3
+
+        # the server got busy after the explanation: no plot, the request renders it
+        loads = iter([0])
+        busy = ShapPrefetcher(
+            model, plot_pool=PlotPool(workers=0, lane=lane), max_load=0, load=lambda: next(loads, 1)
+        )
+        busy.schedule(patient)
+        busy.join()
+        assert asyncio.run(busy.get(patient, "vertebral"))["plot"] is None
+        busy.shutdown()
+        lane.shutdown()
+        assert len(rendered) == 3
+
+        with pytest.raises(ValueError):
+            ShapPrefetcher(model)
+
+    def test_other_patient_misses(self, model):
+        """Explanations are only used for the exact same patient"""
+        prefetcher = ShapPrefetcher(model, render=False)
+        prefetcher.schedule(_patient(age=71))
+        assert asyncio.run(prefetcher.get(_patient(age=72), "hip")) is None
+        prefetcher.shutdown()
+
+    def test_dropped_under_load(self, model):
+        """Queued work is dropped while the server is busy"""
+        blocking = BlockingModel(model)
+        prefetcher = ShapPrefetcher(blocking, render=False, max_load=0, load=lambda: 1)
+        dropped = dropped_total.value(reason="load")
+
+        prefetcher.schedule(_patient())
+        prefetcher.shutdown()
+        assert dropped_total.value(reason="load") == dropped + 3
+
+    def test_queued_work_is_taken_over(self, model):
+        """A request cancels a prefetch that has not started yet"""
+        blocking = BlockingModel(model)
+        prefetcher = ShapPrefetcher(blocking, render=False)
+        patient = _patient()
+
+        prefetcher.schedule(patient)
+        vertebral = prefetcher._entries[prefetcher.key(patient, "vertebral")].future
+        while not vertebral.running():
+            time.sleep(0.01)
+        # vertebral is being computed, hip and any are still queued
+        assert asyncio.run(prefetcher.get(patient, "any")) is None
+        blocking.release.set()
+        assert asyncio.run(prefetcher.get(patient, "vertebral")) is not None
+        prefetcher.shutdown()
+
+    def test_unused_results_count_as_wasted(self, model):
+        """Evicting a computed but unused explanation is counted as wasted"""
+        prefetcher = ShapPrefetcher(model, render=False, max_entries=3)
+        wasted = wasted_total.value()
+
+        prefetcher.schedule(_patient(age=60))
+        prefetcher.join()
+        asyncio.run(prefetcher.get(_patient(age=60), "any"))
+        prefetcher.schedule(_patient(age=61))
+        prefetcher.shutdown()
+        assert wasted_total.value() == wasted + 2
+
+
+def test_get_shap_plot_uses_prefetch(monkeypatch):
+    """getShapPlot after getRisk is answered from the prefetched plot"""
+    from fastapi.testclient import TestClient
+
+    from app.api import endpoints
+    from app.main import app
+
+    client = TestClient(app)
+    prefetcher = ShapPrefetcher(plot_pool=endpoints.plot_pool)
+    monkeypatch.setattr(endpoints, "shap_prefetcher", prefetcher)
+    request = {"riskHorizon": 2, "patientData": {**VALID_PATIENT_DATA, "age": 77}}
+    hits = hits_total.value()
+
+    assert client.post("/api/getRisk/", json=request).status_code == 200
+    prefetcher.join()
+    response = client.post("/api/getShapPlot/", json={**request, "fxType": "vertebral"})
+    assert response.status_code == 200
+    assert hits_total.value() == hits + 1
+
+    prefetcher.enabled = False
+    uncached = client.post("/api/getShapPlot/", json={**request, "fxType": "vertebral"})
+    assert uncached.json()["shap_plot"] == response.json()["shap_plot"]
+    prefetcher.shutdown()
+
+    metrics = client.get("/metrics").text
+    assert "bonoai_prefetch_hits_total" in metrics
+    assert "bonoai_requests_in_progress 0" in metrics
@@ -0,0 +1,107 @@
+"""
+Tests for the in-process sampling profiler (app.services.profiler)
+"""
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.ml.risk_calculator import BonoAI
+from app.models import patients_to_columns
+from app.services.lanes import Lane
+from app.services.profiler import StackSampler, collapsed, endpoint_var, profiler
+from app.services.registry import CANNED_COHORT
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_busy_threads_are_sampled():
+    stop, waiting = threading.Event(), threading.Event()
+    threads = [
+        threading.Thread(target=spin, args=(stop,), name="spinner-1"),
+        threading.Thread(target=waiting.wait, name="waiter"),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        busy = StackSampler().start(0.2, interval=0.005).result()
+        everything = StackSampler().start(0.05, interval=0.005, idle=True).result()
+    finally:
+        stop.set()
+        waiting.set()
+        for thread in threads:
+            thread.join()
+
+    assert busy["samples"] >= 10
+    spinning = [stack for stack in busy["stacks"] if stack.endswith("test_profiler:spin")]
+    assert spinning == ["(none);spinner;threading:Thread._bootstrap;threading:Thread._bootstrap_inner;"
+                        "threading:Thread.run;tests.test_profiler:spin"]
+    assert not any(stack.startswith("(none);waiter;") for stack in busy["stacks"])
+    assert any(stack.startswith("(none);waiter;") for stack in everything["stacks"])
+    assert collapsed(busy["stacks"]).splitlines()[0].endswith(f" {busy['stacks'][spinning[0]]}")
+
+
+def test_stacks_of_the_same_name_add_up():
+    stop = threading.Event()
+    # two code objects, both named test_stacks_of_the_same_name_add_up.<locals>.<lambda>
+    targets = [lambda: spin(stop), lambda: spin(stop)]
+    threads = [threading.Thread(target=target, name=f"spinner-{index}") for index, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    try:
+        profile = StackSampler().start(0.1, interval=0.005).result()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    spinning = [stack for stack in profile["stacks"] if stack.endswith("<lambda>;tests.test_profiler:spin")]
+    assert len(spinning) == 1
+    assert profile["stacks"][spinning[0]] > profile["samples"]
+
+
+def test_lane_threads_carry_the_endpoint():
+    model = BonoAI()
+    features = model.prepare_matrix(patients_to_columns(CANNED_COHORT))
+    lane = Lane("test", 1)
+
+    def predict(seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            model.predict_risks(features, "hip", [60])
+
+    async def request():
+        endpoint_var.set("/api/test/")
+        await lane.run(predict, 0.3)
+
+    # lanes tag their threads only while the shared profiler runs
+    future = profiler.start(0.2, interval=0.005)
+    try:
+        asyncio.run(request())
+        stacks = future.result()["stacks"]
+    finally:
+        lane.shutdown()
+
+    assert any(stack.startswith("/api/test/;predict;") for stack in stacks)
+    assert profiler.thread_tags == {}
+
+
+def test_profile_endpoint(monkeypatch):
+    client = TestClient(app)
+    # opt-in
+    assert client.get("/debug/profile", params={"seconds": 0.05}).status_code == 404
+
+    monkeypatch.setattr("app.main.settings.PROFILER_ENABLED", True)
+    response = client.get("/debug/profile", params={"seconds": 0.05})
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Samples"]) >= 1
+    assert client.get("/debug/profile", params={"seconds": 3600}).status_code == 422
+
+    future = profiler.start(0.2)
+    assert client.get("/debug/profile", params={"seconds": 0.05}).status_code == 409
+    future.result()
@@ -0,0 +1,153 @@
+"""
+Tests for the versioned model registry and hot reload (app.services.registry)
+"""
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ml.risk_calculator import BonoAI
+from app.ml.store import compile_models, write_store
+from app.services.registry import BundleRejected, ModelRegistry, check_model, reloads_total
+from tests.test_api import VALID_PATIENT_DATA
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return compile_models(BonoAI())
+
+
+def write_bundle(directory, name, snapshot, mtime, coef_scale=1.0, survival=None):
+    """A bundle of the shipped models, with scaled Cox coefficients (another version)"""
+    arrays, metadata = snapshot
+    arrays = dict(arrays)
+    for fx_type in metadata["models"]:
+        arrays[f"{fx_type}/cox_coef"] = arrays[f"{fx_type}/cox_coef"] * coef_scale
+        if survival is not None:
+            arrays[f"{fx_type}/baseline_survival"] = survival(arrays[f"{fx_type}/baseline_survival"])
+    metadata = {**metadata, "model_version": f"{metadata['model_version']}-{name}"}
+    path = os.path.join(directory, f"{name}.store")
+    write_store(path, arrays, metadata)
+    os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_check_accepts_shipped_models():
+    model = BonoAI()
+    risks, drift = check_model(model)
+    assert drift is None
+    assert set(risks) == {"vertebral", "hip", "any"}
+    assert check_model(model, reference=risks)[1] == 0
+
+
+def test_registry_falls_back_without_bundles(tmp_path):
+    registry = ModelRegistry(str(tmp_path / "missing"))
+    assert registry.version == BonoAI().version
+    assert not registry.poll()
+
+
+def test_new_bundle_is_swapped_in(tmp_path, snapshot):
+    write_bundle(tmp_path, "v1", snapshot, mtime=1_000_000_000)
+    registry = ModelRegistry(str(tmp_path))
+    first = registry.model
+    assert first.version.endswith("-v1")
+    warmed = []
+    registry.add_warmer(warmed.append)
+
+    write_bundle(tmp_path, "v2", snapshot, mtime=2_000_000_000, coef_scale=1.05)
+    activated = reloads_total.value(result="activated")
+    assert registry.poll()
+    assert registry.version.endswith("-v2")
+    assert warmed == [first, registry.model]
+    assert reloads_total.value(result="activated") == activated + 1
+    assert not registry.poll()
+
+    # a request that read the model before the swap keeps using it
+    features = first.prepare_matrix({name: [value] for name, value in VALID_PATIENT_DATA.items()})
+    before = first.predict_risks(features, "any", [24])
+    after = registry.model.predict_risks(features, "any", [24])
+    assert before[0, 0] != after[0, 0]
+
+    # removing the newest bundle rolls back
+    os.remove(tmp_path / "v2.store")
+    assert registry.poll()
+    assert registry.version == first.version
+
+
+def test_invalid_bundle_is_rejected(tmp_path, snapshot):
+    write_bundle(tmp_path, "v1", snapshot, mtime=1_000_000_000)
+    registry = ModelRegistry(str(tmp_path))
+    rejected = reloads_total.value(result="rejected")
+
+    # baseline survival increasing over time: risks would fall with the horizon
+    write_bundle(tmp_path, "broken", snapshot, mtime=2_000_000_000, survival=lambda s: s[::-1].copy())
+    assert not registry.poll()
+    assert registry.version.endswith("-v1")
+    assert reloads_total.value(result="rejected") == rejected + 1
+    # not retried while the file is unchanged
+    assert not registry.poll()
+    assert reloads_total.value(result="rejected") == rejected + 1
+
+    # a corrupt file
+    with open(tmp_path / "partial.store", "wb") as file:
+        file.write(b"BONOAIST")
+    os.utime(tmp_path / "partial.store", ns=(3_000_000_000, 3_000_000_000))
+    assert not registry.poll()
+    assert registry.version.endswith("-v1")
+
+
+def test_invalid_bundle_at_startup_is_replaced(tmp_path, snapshot):
+    """The version loaded at import is checked when the worker starts"""
+    write_bundle(tmp_path, "v1", snapshot, mtime=1_000_000_000)
+    write_bundle(tmp_path, "broken", snapshot, mtime=2_000_000_000, survival=lambda s: s[::-1].copy())
+    registry = ModelRegistry(str(tmp_path))
+    assert registry.version.endswith("-broken")
+
+    registry.verify()
+    assert registry.version.endswith("-v1")
+
+    os.remove(tmp_path / "v1.store")
+    registry = ModelRegistry(str(tmp_path))
+    registry.verify()
+    assert registry.version == BonoAI().version
+
+
+def test_drift_limit(tmp_path, snapshot):
+    write_bundle(tmp_path, "v1", snapshot, mtime=1_000_000_000)
+    registry = ModelRegistry(str(tmp_path), max_drift=0.5)
+    registry.verify()
+    write_bundle(tmp_path, "v2", snapshot, mtime=2_000_000_000, coef_scale=3.0)
+    assert not registry.poll()
+    assert registry.version.endswith("-v1")
+
+    reference = {fx_type: np.zeros((16, 7)) for fx_type in ("vertebral", "hip", "any")}
+    with pytest.raises(BundleRejected, match="percentage points"):
+        check_model(registry.model, reference, max_drift=0.5)
+
+
+def test_responses_report_the_serving_version(tmp_path, snapshot, monkeypatch):
+    from app.api import endpoints
+    from app.main import app
+
+    write_bundle(tmp_path, "v1", snapshot, mtime=1_000_000_000)
+    registry = ModelRegistry(str(tmp_path))
+    monkeypatch.setattr(endpoints, "registry", registry)
+    monkeypatch.setattr("app.main.registry", registry)
+    client = TestClient(app)
+    request = {"riskHorizon": 5, "patientData": VALID_PATIENT_DATA}
+
+    first = client.post("/api/getRisk/", json=request).json()
+    assert first["modelVersion"] == registry.version
+    assert client.get("/health").json()["modelVersion"] == registry.version
+
+    write_bundle(tmp_path, "v2", snapshot, mtime=2_000_000_000, coef_scale=1.05)
+    assert registry.poll()
+    second = client.post("/api/getRisk/", json=request).json()
+    assert second["modelVersion"].endswith("-v2")
+    assert second["risks"] != first["risks"]
+
+    stream = client.post(
+        "/api/getRiskStream/?riskHorizon=5", content=b'{"age": 65, "height": 165, "weight": 60}\n'
+    )
+    assert stream.headers["X-Model-Version"] == registry.version
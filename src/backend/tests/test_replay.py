@@ -0,0 +1,78 @@
+"""
+Tests for the traffic replay tool (app.ml.replay)
+"""
+import json
+
+import pytest
+
+from app.ml.replay import load_configuration, main, read_traffic, replay
+from app.ml.risk_calculator import BonoAI
+from app.ml.store import compile_models, write_store
+from app.services.audit import AuditLog
+from app.services.registry import CANNED_COHORT
+from tests.test_audit import record_cohort
+from tests.test_registry import write_bundle
+
+
+@pytest.fixture(scope="module")
+def store_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("replay") / "bonoai.store"
+    write_store(str(path), *compile_models(BonoAI()))
+    return str(path)
+
+
+@pytest.fixture
+def traffic(tmp_path):
+    path = tmp_path / "requests.ndjson"
+    lines = [
+        json.dumps({"riskHorizon": 1 + index % 7, "patientData": patient.model_dump()})
+        for index, patient in enumerate(CANNED_COHORT)
+    ]
+    lines.append(json.dumps({"riskHorizon": 5, "patientData": CANNED_COHORT[3].model_dump(), "fxType": "hip"}))
+    lines.append("not json")
+    lines.append(json.dumps({"riskHorizon": 9, "patientData": CANNED_COHORT[0].model_dump()}))
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def test_reads_requests_and_audit_records(traffic, tmp_path):
+    audit_log = AuditLog(str(tmp_path / "audit"), file_format="parquet")
+    record_cohort(audit_log, BonoAI(), CANNED_COHORT[:3])
+    audit_log.shutdown()
+
+    requests, skipped = read_traffic([str(traffic), str(tmp_path / "audit")])
+    assert skipped == 2
+    assert [request.kind for request in requests].count("shap") == 1
+    assert len(requests) == len(CANNED_COHORT) + 1 + 3
+    audited = requests[-1]
+    assert audited.horizons == [2, 5]
+    assert audited.features is not None
+
+
+def test_forest_and_booster_agree(traffic, store_path):
+    requests, _ = read_traffic([str(traffic)])
+    results = replay(requests, load_configuration(f"{store_path}:booster"), load_configuration(f"{store_path}:forest"))
+    assert len(results) == len(requests)
+    assert max(result["difference"] for result in results) < 1e-4
+    assert all(result["baselineMs"] > 0 and result["candidateMs"] > 0 for result in results)
+
+
+def test_forest_needs_a_store():
+    with pytest.raises(ValueError, match="model store"):
+        load_configuration("default:forest")
+
+
+def test_tolerance_fails_a_changed_bundle(traffic, tmp_path, capsys):
+    bundle = write_bundle(tmp_path, "v2", compile_models(BonoAI()), mtime=2_000_000_000, coef_scale=1.05)
+    output = tmp_path / "differences.ndjson"
+
+    assert main([str(traffic), "--candidate", bundle, "--tolerance", "0.1", "--output", str(output)]) == 1
+    report = capsys.readouterr().out
+    assert f"Replayed {len(CANNED_COHORT) + 1} requests" in report
+    assert "Largest differences" in report
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert max(result["difference"] for result in results if result["kind"] == "risk") > 0.1
+    # the SHAP values come from the boosters, which the bundle didn't change
+    assert [result["difference"] for result in results if result["kind"] == "shap"] == [0]
+
+    assert main([str(traffic), "--candidate", "default"]) == 0
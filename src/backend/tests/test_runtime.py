@@ -0,0 +1,56 @@
+"""
+Tests for the inference runtime thread configuration (app.services.runtime)
+"""
+import os
+
+from fastapi.testclient import TestClient
+
+from app.ml.risk_calculator import BonoAI
+from app.services.runtime import (
+    BLAS_ENV_VARS, blas_threads, booster_threads, effective_runtime, limit_blas_threads,
+)
+from app.services.warmup import Warmup
+
+
+def test_booster_threads_are_set_at_load():
+    assert all(booster_threads(booster) == 2 for booster in BonoAI(nthread=2).models["xgb"].values())
+    # XGBoost's default: all cores
+    assert effective_runtime(BonoAI())["xgb_nthread"] >= 1
+
+
+def test_load_model_applies_the_settings(monkeypatch):
+    from app.api import endpoints
+
+    monkeypatch.setattr(endpoints.settings, "XGB_NTHREAD", 3)
+    monkeypatch.setattr(endpoints.settings, "STORE_MAX_ROWS", 2)
+    for name in BLAS_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+    model = endpoints.load_model()
+    assert model.store_max_rows == 2
+    assert effective_runtime(model, plot_workers=0) == {
+        "cpu_count": effective_runtime(model)["cpu_count"],
+        "xgb_nthread": 3,
+        "blas_threads": 1,
+        "plot_workers": 0,
+    }
+    assert all(os.environ[name] == "1" for name in BLAS_ENV_VARS)
+
+
+def test_blas_limit_zero_keeps_the_default(monkeypatch):
+    for name in BLAS_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+    threads = blas_threads()
+    limit_blas_threads(0)
+    assert blas_threads() == threads
+    assert not any(name in os.environ for name in BLAS_ENV_VARS)
+
+
+def test_runtime_is_exported_at_startup(monkeypatch):
+    from app.main import app
+
+    monkeypatch.setattr("app.main.warmup", Warmup(enabled=False))
+    with TestClient(app) as client:
+        text = client.get("/metrics").text
+    assert 'bonoai_inference_runtime{setting="xgb_nthread"}' in text
+    assert 'bonoai_inference_runtime{setting="blas_threads"} 1' in text
+    assert 'bonoai_inference_runtime{setting="lane_risk_workers"} 4' in text
@@ -0,0 +1,99 @@
+"""
+Tests for the offline bulk scoring CLI (app.ml.score)
+"""
+import pandas as pd
+import pytest
+
+from app.ml.score import main, score_file
+from tests.test_api import VALID_PATIENT_DATA
+
+
+@pytest.fixture(scope="module")
+def cohort_csv(tmp_path_factory):
+    """Small cohort with varying age and an id column"""
+    rows = []
+    for patient_id, age in enumerate(range(50, 90, 4)):
+        rows.append({"patient_id": patient_id, **VALID_PATIENT_DATA, "age": age})
+    path = tmp_path_factory.mktemp("cohort") / "cohort.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture(scope="module")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app)
+
+
+class TestScoreFile:
+    """Tests for score_file"""
+
+    def test_matches_api(self, cohort_csv, tmp_path, client):
+        """Bulk risks equal the risks returned by /api/getRisk/"""
+        output = tmp_path / "risks.csv"
+        n_rows = score_file(
+            cohort_csv, output, horizons=[2, 5], chunk_size=3, workers=1,
+            keep_columns=["patient_id"],
+        )
+        assert n_rows == 10
+
+        risks = pd.read_csv(output)
+        assert list(risks["patient_id"]) == list(range(10))
+
+        patient = {**VALID_PATIENT_DATA, "age": 62}
+        for horizon in [2, 5]:
+            response = client.post(
+                "/api/getRisk/", json={"riskHorizon": horizon, "patientData": patient}
+            )
+            expected = response.json()["risks"]
+            for fx_type, risk in expected.items():
+                assert risks.loc[3, f"{fx_type}_risk_{horizon}y"] == pytest.approx(risk)
+
+    def test_process_pool_parquet(self, cohort_csv, tmp_path):
+        """Scoring with several workers gives the same result in input order"""
+        single = tmp_path / "single.parquet"
+        pooled = tmp_path / "pooled.parquet"
+        score_file(cohort_csv, single, chunk_size=3, workers=1, keep_columns=["patient_id"])
+        score_file(cohort_csv, pooled, chunk_size=3, workers=2, keep_columns=["patient_id"])
+
+        pd.testing.assert_frame_equal(pd.read_parquet(single), pd.read_parquet(pooled))
+
+    def test_missing_required_column(self, tmp_path):
+        """Inputs without a required PatientData column are rejected"""
+        path = tmp_path / "incomplete.csv"
+        pd.DataFrame([{"age": 65, "height": 165, "weight": 60}]).to_csv(path, index=False)
+
+        with pytest.raises(ValueError, match="tscore_neck"):
+            score_file(path, tmp_path / "out.csv", workers=1)
+
+    def test_invalid_row(self, tmp_path):
+        """Out of range and missing values are reported with their row instead of scored"""
+        rows = [dict(VALID_PATIENT_DATA) for _ in range(4)]
+        rows[1]["age"] = 150
+        path = tmp_path / "invalid.csv"
+        pd.DataFrame(rows).to_csv(path, index=False)
+        with pytest.raises(ValueError, match="row 1 age: Input should be less than or equal"):
+            score_file(path, tmp_path / "out.csv", chunk_size=2, workers=1)
+
+        # rows are numbered across Parquet batches too
+        rows[1]["age"] = 65
+        rows[3]["tscore_neck"] = None
+        path = tmp_path / "invalid.parquet"
+        pd.DataFrame(rows).to_parquet(path)
+        with pytest.raises(ValueError, match="row 3 tscore_neck: Input should be a finite number"):
+            score_file(path, tmp_path / "out.csv", chunk_size=2, workers=1)
+
+    def test_invalid_horizon(self, cohort_csv, tmp_path):
+        """Horizons outside 1-7 years are rejected"""
+        with pytest.raises(ValueError):
+            score_file(cohort_csv, tmp_path / "out.csv", horizons=[8], workers=1)
+
+    def test_cli(self, cohort_csv, tmp_path):
+        """The command line entry point writes one column per fracture type"""
+        output = tmp_path / "risks.csv"
+        main([str(cohort_csv), str(output), "--workers", "1", "--horizons", "1"])
+
+        risks = pd.read_csv(output)
+        assert list(risks.columns) == ["vertebral_risk_1y", "hip_risk_1y", "any_risk_1y"]
+        assert len(risks) == 10
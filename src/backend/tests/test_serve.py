@@ -0,0 +1,59 @@
+"""
+Tests for the pre-forking server (app.serve) and memory reporting
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from app.services.memory import memory_usage
+
+
+def test_memory_usage():
+    usage = memory_usage()
+    if usage is None:
+        pytest.skip("/proc/self/smaps_rollup not available")
+    assert 0 < usage["uss"] <= usage["pss"] <= usage["rss"]
+    assert memory_usage(2**22 + 1) is None  # above the largest pid
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(port, path):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.read().decode()
+
+
+def test_preforked_workers_serve_and_stop():
+    """Workers forked from the preloaded parent serve requests and stop on SIGTERM"""
+    port = free_port()
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--port", str(port), "--workers", "2", "--log-level", "warning"],
+        cwd=backend, env={**os.environ, "PLOT_WORKERS": "0"},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                assert '"healthy"' in get(port, "/health")
+                break
+            except OSError:
+                assert server.poll() is None and time.monotonic() < deadline
+                time.sleep(0.2)
+
+        if memory_usage() is not None:
+            assert "bonoai_process_unique_memory_bytes" in get(port, "/metrics")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=30) == 0
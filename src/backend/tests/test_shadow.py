@@ -0,0 +1,108 @@
+"""
+Tests for the shadow evaluation of a candidate model (app.services.shadow)
+"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ml.risk_calculator import BonoAI
+from app.ml.store import ModelStore, compile_models
+from app.models import patients_to_columns
+from app.services.registry import CANNED_COHORT
+from app.services.shadow import ShadowEvaluator, samples_total
+from tests.test_api import VALID_PATIENT_DATA
+from tests.test_registry import write_bundle
+
+
+@pytest.fixture(scope="module")
+def served():
+    return BonoAI()
+
+
+@pytest.fixture(scope="module")
+def candidate(tmp_path_factory):
+    """The shipped models with scaled Cox coefficients"""
+    directory = tmp_path_factory.mktemp("shadow")
+    path = write_bundle(directory, "candidate", compile_models(BonoAI()), mtime=1_000_000_000, coef_scale=1.05)
+    return BonoAI(store=ModelStore(path), nthread=1)
+
+
+def schedule_cohort(shadow, model):
+    for patient in CANNED_COHORT:
+        columns = patients_to_columns([patient])
+        features = model.prepare_matrix(columns)
+        risks = {
+            fx_type: round(float(model.predict_risks(features, fx_type, [60])[0, 0]) * 100, 2)
+            for fx_type in ("vertebral", "hip", "any")
+        }
+        if shadow.sample():
+            asyncio.run(shadow.schedule(model, columns, 5, risks, 0.002))
+    shadow.join()
+
+
+def test_candidate_is_compared_with_served_risks(served, candidate):
+    shadow = ShadowEvaluator(candidate, sample_rate=1, max_cpu_share=100)
+    schedule_cohort(shadow, served)
+    shadow.shutdown()
+
+    report = shadow.report()
+    assert report["samples"] == len(CANNED_COHORT)
+    assert report["candidateVersion"] == candidate.version
+    assert report["servedVersions"] == [served.version]
+    for fx_type, stats in report["risks"].items():
+        assert stats["maxAbsDelta"] > 0
+        # scaled coefficients move the risks but keep their order
+        assert stats["rankCorrelation"] > 0.95
+    assert report["latencyMs"]["served"]["p50"] == 2.0
+    assert report["latencyMs"]["candidate"]["p50"] > 0
+
+
+def test_cpu_share_is_capped(served, candidate):
+    dropped = samples_total.value(result="cpu_budget")
+    evaluated = samples_total.value(result="evaluated")
+    # a microsecond of CPU per second: the first evaluation uses it all up
+    shadow = ShadowEvaluator(candidate, sample_rate=1, max_cpu_share=1e-6)
+    schedule_cohort(shadow, served)
+    shadow.shutdown()
+
+    assert samples_total.value(result="evaluated") == evaluated + 1
+    assert samples_total.value(result="cpu_budget") == dropped + len(CANNED_COHORT) - 1
+    assert shadow.report()["samples"] == 1
+
+
+def test_sampling_and_load(served, candidate):
+    shadow = ShadowEvaluator(candidate, sample_rate=0)
+    assert not shadow.enabled
+    schedule_cohort(shadow, served)
+    assert shadow.report()["samples"] == 0
+
+    shadow = ShadowEvaluator(candidate, sample_rate=1, max_cpu_share=100, max_load=1, load=lambda: 5)
+    schedule_cohort(shadow, served)
+    shadow.shutdown()
+    assert shadow.report()["samples"] == 0
+    assert shadow.report()["risks"] == {}
+
+
+def test_get_risk_is_shadowed(candidate, monkeypatch):
+    from app.api import endpoints
+    from app.main import app
+
+    shadow = ShadowEvaluator(candidate, sample_rate=1, max_cpu_share=100)
+    monkeypatch.setattr(endpoints, "shadow", shadow)
+    monkeypatch.setattr("app.main.shadow", shadow)
+    client = TestClient(app)
+
+    response = client.post("/api/getRisk/", json={"riskHorizon": 5, "patientData": VALID_PATIENT_DATA})
+    assert response.status_code == 200
+    shadow.join()
+    report = client.get("/shadow").json()
+    shadow.shutdown()
+
+    assert report["enabled"]
+    assert report["samples"] == 1
+    assert report["servedVersions"] == [response.json()["modelVersion"]]
+    stats = report["risks"]["any"]
+    assert stats["meanAbsDelta"] == stats["maxAbsDelta"] > 0
+    # undefined for a single sample
+    assert stats["rankCorrelation"] is None
@@ -0,0 +1,135 @@
+"""
+Tests for single-flight deduplication (app.services.singleflight)
+"""
+import asyncio
+
+import pytest
+
+from app.services.singleflight import SingleFlight, request_key, shared_total
+
+
+class Computation:
+    """Counts calls and finishes when released"""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.error = error
+
+    async def __call__(self, value):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return value * 2
+
+
+def test_request_key_is_canonical():
+    """Key order of the request parts doesn't matter"""
+    assert request_key(2, {"a": 1, "b": 2}) == request_key(2, {"b": 2, "a": 1})
+    assert request_key(2, {"a": 1}) != request_key(3, {"a": 1})
+
+
+class TestSingleFlight:
+    """Tests for SingleFlight"""
+
+    def test_concurrent_callers_share_one_computation(self):
+        async def scenario():
+            flight = SingleFlight("test")
+            compute = Computation()
+            shared = shared_total.value(endpoint="test")
+            callers = [asyncio.create_task(flight.do("key", compute, 21)) for _ in range(5)]
+            await asyncio.sleep(0)
+            compute.release.set()
+            results = await asyncio.gather(*callers)
+
+            assert results == [42] * 5
+            assert compute.calls == 1
+            assert shared_total.value(endpoint="test") == shared + 4
+
+            # not cached: the next caller computes again
+            assert await flight.do("key", compute, 1) == 2
+            assert compute.calls == 2
+
+        asyncio.run(scenario())
+
+    def test_failure_propagates_to_all_callers(self):
+        async def scenario():
+            flight = SingleFlight("test")
+            compute = Computation(error=ValueError("invalid"))
+            callers = [asyncio.create_task(flight.do("key", compute, 1)) for _ in range(3)]
+            await asyncio.sleep(0)
+            compute.release.set()
+            results = await asyncio.gather(*callers, return_exceptions=True)
+
+            assert all(isinstance(result, ValueError) for result in results)
+            assert flight.in_flight() == 0
+
+        asyncio.run(scenario())
+
+    def test_cancelled_caller_does_not_poison_others(self):
+        async def scenario():
+            flight = SingleFlight("test")
+            compute = Computation()
+            first = asyncio.create_task(flight.do("key", compute, 5))
+            second = asyncio.create_task(flight.do("key", compute, 5))
+            await asyncio.sleep(0)
+
+            first.cancel()
+            await asyncio.sleep(0)
+            compute.release.set()
+
+            assert await second == 10
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            assert compute.calls == 1
+
+        asyncio.run(scenario())
+
+    def test_last_cancelled_caller_cancels_computation(self):
+        async def scenario():
+            flight = SingleFlight("test")
+            compute = Computation()
+            caller = asyncio.create_task(flight.do("key", compute, 5))
+            await asyncio.sleep(0)
+            caller.cancel()
+            await asyncio.sleep(0)
+            assert flight.in_flight() == 0
+
+            # a new caller starts a fresh computation instead of a cancelled one
+            compute.release.set()
+            assert await flight.do("key", compute, 5) == 10
+            assert compute.calls == 2
+
+        asyncio.run(scenario())
+
+
+def test_duplicate_shap_requests_share_a_plot(monkeypatch):
+    """Concurrent identical getShapPlot requests render the plot once"""
+    import threading
+
+    from fastapi.testclient import TestClient
+
+    from app.api import plot_pool
+    from app.main import app
+    from tests.test_api import VALID_PATIENT_DATA
+
+    monkeypatch.setattr(plot_pool, "workers", 0)
+    request = {"riskHorizon": 2, "patientData": {**VALID_PATIENT_DATA, "age": 83}, "fxType": "hip"}
+    shared = shared_total.value(endpoint="getShapPlot")
+    responses = []
+
+    def post():
+        responses.append(client.post("/api/getShapPlot/", json=request))
+
+    # one event loop for all requests, like a server worker
+    with TestClient(app) as client:
+        threads = [threading.Thread(target=post) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert len({response.json()["shap_plot"] for response in responses}) == 1
+    assert shared_total.value(endpoint="getShapPlot") > shared
@@ -0,0 +1,95 @@
+"""
+Tests for the memory-mapped model store (app.ml.store)
+"""
+import numpy as np
+import pytest
+
+from app.ml.risk_calculator import FX_TYPES, BonoAI
+from app.ml.store import ModelStore, compile_models, write_store
+
+
+@pytest.fixture(scope="module")
+def model():
+    return BonoAI()
+
+
+@pytest.fixture(scope="module")
+def store(model, tmp_path_factory):
+    path = tmp_path_factory.mktemp("store") / "bonoai.store"
+    write_store(path, *compile_models(model))
+    return ModelStore(path)
+
+
+@pytest.fixture(scope="module")
+def features():
+    rng = np.random.default_rng(7)
+    matrix = (rng.normal(size=(500, 47)) * 3).astype("float32")
+    matrix[rng.random(matrix.shape) < 0.1] = np.nan  # missing values
+    return matrix
+
+
+def test_arrays_are_read_only_views(model, store):
+    assert store.feature_names == list(model.feature_names)
+    for array in store.arrays.values():
+        assert not array.flags.writeable
+
+
+@pytest.mark.parametrize("fx_type", FX_TYPES)
+def test_forest_matches_booster(model, store, features, fx_type):
+    """Margins are identical to the booster's, outputs agree to 1 ulp"""
+    booster = model.models["xgb"][fx_type]
+    forest = store.forest(fx_type)
+    np.testing.assert_array_equal(
+        forest.predict_margin(features), booster.inplace_predict(features, predict_type="margin")
+    )
+    difference = forest.predict(features).view("int32") - booster.inplace_predict(features).view("int32")
+    assert np.abs(difference).max() <= 1
+
+
+@pytest.mark.parametrize("fx_type", FX_TYPES)
+def test_store_model_risks(model, store, features, fx_type):
+    """Without the pickled Cox models, risks come from the mapped tables"""
+    store_model = BonoAI(store=store)
+    assert store_model.models["cox"] == {}
+    times = [12, 24, 60, 84]
+    for rows in (features[:1], features[:8], features):
+        np.testing.assert_allclose(
+            store_model.predict_risks(rows, fx_type, times),
+            model.predict_risks(rows, fx_type, times),
+            rtol=1e-6,
+        )
+
+
+def test_boosters_from_snapshot(model, store, features):
+    """Boosters deserialized from the store predict and explain like the originals"""
+    boosters = store.load_boosters()
+    for fx_type in FX_TYPES:
+        np.testing.assert_array_equal(
+            boosters[fx_type].inplace_predict(features),
+            model.models["xgb"][fx_type].inplace_predict(features),
+        )
+    store_model = BonoAI(store=store)
+    for left, right in zip(store_model.explain(features[0], "hip"), model.explain(features[0], "hip")):
+        np.testing.assert_array_equal(left, right)
+
+
+def test_model_version_identifies_the_models(model, store, tmp_path):
+    path = tmp_path / "again.store"
+    write_store(path, *compile_models(model))
+    assert ModelStore(path).model_version == store.model_version
+
+
+def test_detects_corruption(store, tmp_path):
+    data = bytearray(open(store.path, "rb").read())
+    data[-10] ^= 0xFF
+    path = tmp_path / "corrupt.store"
+    path.write_bytes(data)
+    with pytest.raises(ValueError, match="checksum"):
+        ModelStore(path)
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "model.json"
+    path.write_bytes(b"{" * 64)
+    with pytest.raises(ValueError):
+        ModelStore(path)
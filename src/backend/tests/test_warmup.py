@@ -0,0 +1,66 @@
+"""
+Tests for the startup warm-up (app.services.warmup) and /ready
+"""
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from app.services.warmup import Warmup
+
+
+def test_steps_are_timed():
+    warmup = Warmup()
+    ran = []
+
+    async def step(name):
+        ran.append(name)
+
+    assert not warmup.ready
+    asyncio.run(warmup.run([("first", lambda: step("first")), ("second", lambda: step("second"))]))
+    assert ran == ["first", "second"]
+    assert warmup.ready
+    report = warmup.report()
+    assert report["status"] == "ready"
+    assert list(report["steps"]) == ["first", "second"]
+    assert report["seconds"] >= 0
+
+
+def test_failed_step_is_not_ready():
+    warmup = Warmup()
+
+    async def fail():
+        raise RuntimeError("no fonts")
+
+    asyncio.run(warmup.run([("shap_hip", fail), ("never", fail)]))
+    assert not warmup.ready
+    assert warmup.report()["error"] == "shap_hip: no fonts"
+    assert warmup.report()["steps"] == {}
+
+
+def test_disabled_warmup_is_ready():
+    warmup = Warmup(enabled=False)
+    asyncio.run(warmup.run([("never", None)]))
+    assert warmup.ready
+    assert warmup.report()["status"] == "skipped"
+
+
+def test_ready_only_after_warmup(monkeypatch):
+    """/ready answers 503 until the warm-up at startup ran every fracture type"""
+    from app.main import app
+
+    monkeypatch.setattr("app.main.warmup", Warmup())
+    assert TestClient(app).get("/ready").status_code == 503
+    assert TestClient(app).get("/health").status_code == 200
+
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 60
+        while (response := client.get("/ready")).status_code != 200:
+            assert response.status_code == 503
+            assert response.json()["warmup"]["status"] != "failed"
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+
+    data = response.json()
+    assert data["status"] == "ready"
+    assert set(data["warmup"]["steps"]) == {"risk", "shap_vertebral", "shap_hip", "shap_any"}
@@ -27,7 +27,7 @@ import {
 } from "@/components/ui/select";
 import { Skeleton } from "@/components/ui/skeleton";
 import { FormSchemaType } from "@/types/types";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import { getApiUrl } from "@/config/api";
 
@@ -52,8 +52,13 @@ export function SHAPDialog({ riskHorizon, data }: ShapPlotProps) {
   const [location, setLocation] = useState("any");
   const [shapData, setShapData] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const abortController = useRef<AbortController | null>(null);
 
   const onInsightsClick = () => {
+    // a newer request replaces the one in flight, the server stops its plot
+    abortController.current?.abort();
+    const controller = new AbortController();
+    abortController.current = controller;
     setIsLoading(true);
     const requestData = {
       riskHorizon: riskHorizon,
@@ -66,12 +71,16 @@ export function SHAPDialog({ riskHorizon, data }: ShapPlotProps) {
       method: "post",
       url: getApiUrl("getShapPlot"),
       data: requestData,
+      signal: controller.signal,
     })
       .then((response) => {
         setShapData(response.data.shap_plot);
         setIsLoading(false);
       })
       .catch((error) => {
+        if (axios.isCancel(error)) {
+          return;
+        }
         console.error("Error fetching SHAP plot", error);
         setIsLoading(false);
       });
@@ -79,6 +88,9 @@ export function SHAPDialog({ riskHorizon, data }: ShapPlotProps) {
   useEffect(() => {
     onInsightsClick();
   }, [location]);
+  useEffect(() => {
+    return () => abortController.current?.abort();
+  }, []);
 
   return (
     <Dialog>